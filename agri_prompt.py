@@ -1,18 +1,41 @@
-def build_prompt(user_input, language="English"):
+def build_prompt(user_input, language="English", passages=()):
     """
     Build a prompt for the GPT model based on user input and language.
     
     Args:
         user_input (str): The farmer's question
         language (str): The language to respond in
+        passages (list): Knowledge base passages to ground the reply in
         
     Returns:
         str: The formatted prompt for GPT
     """
+    # Relevant farming advice from the knowledge base, if any was found
+    knowledge = ""
+    if passages:
+        knowledge = "Relevant farming advice:\n" + "\n".join(f"- {p.text}" for p in passages) + "\n\n"
+
     return f"""
 You are KrishiMitra, a multilingual AI agent that helps Indian farmers.
 Respond in {language}. Be short, simple, and friendly.
 
-Farmer's question: {user_input}
+{knowledge}Farmer's question: {user_input}
 Reply:
 """
+
+
+def parse_prompt(prompt):
+    """
+    Recover the question and language from a prompt built by build_prompt.
+
+    Used by the fake model backends in benchmarks/, which answer locally.
+
+    Args:
+        prompt (str): A prompt returned by build_prompt
+
+    Returns:
+        tuple: (question, language)
+    """
+    language = prompt.split("Respond in ", 1)[-1].split(".", 1)[0].strip()
+    question = prompt.split("Farmer's question:")[-1].split("Reply:")[0].strip()
+    return question, language
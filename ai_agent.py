@@ -1,130 +1,308 @@
+import asyncio
+import logging
 import os
-from dotenv import load_dotenv
-from openai import AsyncOpenAI
+import random
+import tempfile
+import time
+from agri_prompt import build_prompt
+from knowledge_base import default_passage, search_knowledge
+from llm_client import LLMClient, LLMUnavailable
+from request_timing import add_stage, set_label, stage
+from response_cache import ResponseCache, SharedStore, normalize_question
+from sentences import split_sentences
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# "openai" sends prompts to the model; "local" answers from the knowledge base
+LLM_BACKEND = os.getenv("KRISHIMITRA_LLM_BACKEND", "local")
+LLM_MODEL = os.getenv("KRISHIMITRA_LLM_MODEL", "gpt-4-turbo")
 
-async def get_response_from_gpt(prompt):
+# Pooled, deadline-bound client for the model
+client = LLMClient(api_key=os.getenv("OPENAI_API_KEY"), model=LLM_MODEL)
+
+# Answers keyed on the normalized question and language
+ANSWER_CACHE_SIZE = int(os.getenv("KRISHIMITRA_ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("KRISHIMITRA_ANSWER_CACHE_TTL", "3600"))
+
+# SQLite file shared by every worker process; empty keeps answers per process
+ANSWER_CACHE_DB = os.getenv(
+    "KRISHIMITRA_ANSWER_CACHE_DB", os.path.join(tempfile.gettempdir(), "krishimitra_answers.sqlite3"))
+ANSWER_CACHE_SHARED_SIZE = int(os.getenv("KRISHIMITRA_ANSWER_CACHE_SHARED_SIZE", "16384"))
+# Milliseconds a lookup or write waits for another process's lock before giving up
+ANSWER_CACHE_DB_TIMEOUT_MS = float(os.getenv("KRISHIMITRA_ANSWER_CACHE_DB_TIMEOUT_MS", "50"))
+
+ANSWER_CACHE = ResponseCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    store=SharedStore(ANSWER_CACHE_DB, ANSWER_CACHE_SHARED_SIZE, ANSWER_CACHE_TTL,
+                      busy_timeout=ANSWER_CACHE_DB_TIMEOUT_MS / 1000) if ANSWER_CACHE_DB else None,
+)
+
+# Reply when nothing matches and the knowledge base has no general advice entry
+FALLBACK_ANSWER = ("I don't have advice on that yet. Please ask your local Krishi Vigyan Kendra "
+                   "or agriculture extension officer.")
+
+# Prefixes for replies to statements that are not clear questions
+QUESTION_PREFIXES = {
+    "English": ["Based on your question about farming, ", "Regarding your farming inquiry, ", "For your question about agriculture, "],
+    "Hindi": ["आपके खेती के सवाल के आधार पर, ", "आपके कृषि संबंधी प्रश्न के बारे में, "],
+    "Tamil": ["உங்கள் விவசாய கேள்வியின் அடிப்படையில், ", "உங்கள் வேளாண்மை கேள்விக்கு, "],
+    "Telugu": ["మీ వ్యవసాయ ప్రశ్న ఆధారంగా, ", "మీ వ్యవసాయ సంబంధిత ప్రశ్నకు, "]
+}
+
+def local_response(question, language="English"):
+    """
+    Answer a question offline from the best matching knowledge base entry.
+
+    Args:
+        question (str): The farmer's question
+        language (str): The language to respond in
+
+    Returns:
+        str: The response
+    """
+    # Find the best matching entry, or general advice if nothing matches
+    passages = search_knowledge(question, language, k=1)
+    passage = passages[0] if passages else default_passage(language)
+    if passage is None:
+        return FALLBACK_ANSWER
+
+    # Use current time for some randomness
+    random.seed(int(time.time()))
+
+    # Return the response with some personalization based on the question
+    lowered = question.lower()
+    if "how" in lowered or "what" in lowered or "?" in question:
+        # It's a question, give a direct answer
+        return passage.text
+    else:
+        # It's not a clear question, add a prefix
+        prefix_list = QUESTION_PREFIXES.get(passage.language, QUESTION_PREFIXES["English"])
+        selected_prefix = random.choice(prefix_list)
+
+        return selected_prefix + passage.text
+
+async def get_response_from_gpt(prompt, question, language="English"):
     """
     Get a response from GPT based on the provided prompt.
 
     Args:
         prompt (str): The prompt to send to GPT
+        question (str): The farmer's question, answered directly by the local backend
+        language (str): The language to respond in
 
     Returns:
         str: The response from GPT
+
+    Raises:
+        LLMUnavailable: If the model could not answer in time or sent an empty reply
+    """
+    if LLM_BACKEND == "openai":
+        logger.debug("Sending prompt to OpenAI model %s", LLM_MODEL)
+        reply = await client.complete(prompt)
+        if not reply or not reply.strip():
+            raise LLMUnavailable("empty reply")
+        return reply
+
+    logger.debug("Answering from the knowledge base")
+    return local_response(question, language)
+
+def sentence_chunks(text):
+    """
+    Split a finished reply into sentence-sized chunks for streaming.
+
+    Args:
+        text (str): The reply
+
+    Returns:
+        list[str]: Chunks that concatenate back to the reply
+    """
+    sentences = split_sentences(text)
+    return [sentence + " " for sentence in sentences[:-1]] + sentences[-1:]
+
+async def stream_response_from_gpt(prompt, question, language="English"):
     """
+    Stream a response from GPT as it is generated.
+
+    With the OpenAI backend, text deltas are forwarded as they arrive and the
+    upstream stream is closed as soon as the consumer stops iterating. The
+    local backend yields the knowledge base answer one sentence at a time.
+
+    Args:
+        prompt (str): The prompt to send to GPT
+        question (str): The farmer's question, answered directly by the local backend
+        language (str): The language to respond in
+
+    Yields:
+        str: Consecutive pieces of the response
+
+    Raises:
+        LLMUnavailable: If the model could not start answering in time
+    """
+    if LLM_BACKEND != "openai":
+        for chunk in sentence_chunks(local_response(question, language)):
+            yield chunk
+        return
+
+    async for piece in client.stream(prompt):
+        yield piece
+
+def answer_cache_key(question, language="English"):
+    """
+    Build the answer cache key for a question.
+
+    Args:
+        question (str): The farmer's question
+        language (str): The language to respond in
+
+    Returns:
+        tuple: The cache key
+    """
+    return normalize_question(question), language.strip().casefold()
+
+async def answer_question(question, language="English"):
+    """
+    Answer a farmer's question, reusing cached answers and sharing a single
+    upstream call between concurrent identical questions.
+
+    Args:
+        question (str): The farmer's question
+        language (str): The language to respond in
+
+    Returns:
+        str: The answer
+    """
+    key = answer_cache_key(question, language)
+    reply = await ANSWER_CACHE.get(key)
+    set_label("cache", "miss" if reply is None else "hit")
+    if reply is not None:
+        return reply
+
+    with stage("prompt"):
+        prompt = build_prompt(question, language, search_knowledge(question, language))
+    try:
+        with stage("llm"):
+            return await ANSWER_CACHE.compute(key, lambda: get_response_from_gpt(prompt, question, language))
+    except LLMUnavailable as e:
+        # Answer locally, and leave the cache empty so the model is asked again next time
+        logger.warning("%s; answering from the knowledge base", e)
+        return local_response(question, language)
+
+async def answer_batch(queries, concurrency):
+    """
+    Answer a batch of questions concurrently, answering duplicates only once.
+
+    Questions are grouped by their answer cache key, so repeats within the
+    batch share one call. At most `concurrency` distinct questions are
+    answered at a time. A failure is reported for its questions only.
+
+    Args:
+        queries (list): (question, language) pairs
+        concurrency (int): Distinct questions answered at once
+
+    Yields:
+        tuple: (positions, reply, error) for each distinct question as soon as
+            it completes, where positions are its indexes in `queries` and
+            exactly one of reply and error is set
+    """
+    groups = {}
+    for position, (question, language) in enumerate(queries):
+        if not question or not question.strip():
+            yield [position], None, "Question cannot be empty"
+            continue
+        key = answer_cache_key(question, language)
+        groups.setdefault(key, (question, language, []))[2].append(position)
+
+    limit = asyncio.Semaphore(concurrency)
+
+    async def answer(question, language, positions):
+        async with limit:
+            try:
+                return positions, await answer_question(question, language), None
+            except Exception as e:
+                logger.warning("Error answering batch question: %s", e)
+                return positions, None, "Reply generation failed"
+
+    tasks = [asyncio.ensure_future(answer(*group)) for group in groups.values()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stop outstanding work if the caller goes away
+        for task in tasks:
+            task.cancel()
+
+async def stream_answer(question, language="English"):
+    """
+    Stream the answer to a farmer's question.
+
+    Cached answers, and answers already being generated for an identical
+    question, are replayed in sentence-sized chunks. Otherwise the answer is
+    streamed from the model and cached once it has been sent in full;
+    identical questions arriving meanwhile wait for it instead of asking the
+    model again. If the model is unavailable or its reply is empty, the
+    local answer is streamed instead and nothing is cached.
+
+    Args:
+        question (str): The farmer's question
+        language (str): The language to respond in
+
+    Yields:
+        str: Consecutive pieces of the answer
+    """
+    key = answer_cache_key(question, language)
+    reply = await ANSWER_CACHE.get(key)
+    set_label("cache", "miss" if reply is None else "hit")
+    if reply is None:
+        try:
+            with stage("llm"):
+                reply = await ANSWER_CACHE.join(key)
+        except LLMUnavailable as e:
+            logger.warning("%s; answering from the knowledge base", e)
+            reply = local_response(question, language)
+    if reply is not None:
+        for chunk in sentence_chunks(reply):
+            yield chunk
+        return
+
+    with stage("prompt"):
+        prompt = build_prompt(question, language, search_knowledge(question, language))
+
+    # Identical questions arriving while this answer streams join it
+    pending = ANSWER_CACHE.begin(key)
+    # Count only time spent waiting on the model, not on the consumer
+    pieces = []
+    waited = 0.0
+    requested = time.perf_counter()
     try:
-        print(f"Sending request to OpenAI with API key: {os.getenv('OPENAI_API_KEY')[:5]}...")
-        print(f"Using model: gpt-4-turbo")
-
-        # Since we're having quota issues, let's use our farming responses directly
-        print("Using pre-defined farming responses due to API quota issues")
-
-        # Define farming-specific responses for different queries and languages
-        farming_responses = {
-            "rice": {
-                "English": "To grow rice: 1) Prepare the soil by plowing and leveling. 2) Soak rice seeds for 24 hours before sowing. 3) Maintain 2-5cm water level in the field. 4) Apply balanced fertilizer (NPK). 5) Control weeds and pests regularly. 6) Harvest when 80% of grains turn golden yellow.",
-                "Hindi": "चावल उगाने के लिए: 1) मिट्टी को जोतकर और समतल करके तैयार करें। 2) बीज बोने से पहले चावल के बीजों को 24 घंटे भिगोएं। 3) खेत में 2-5 सेमी पानी का स्तर बनाए रखें। 4) संतुलित उर्वरक (NPK) का प्रयोग करें। 5) नियमित रूप से खरपतवार और कीटों को नियंत्रित करें। 6) जब 80% अनाज सुनहरे पीले हो जाएं तो फसल काटें।",
-                "Tamil": "நெல் வளர்க்க: 1) மண்ணை உழுது சமப்படுத்தி தயார் செய்யவும். 2) விதைப்பதற்கு முன் நெல் விதைகளை 24 மணி நேரம் ஊறவைக்கவும். 3) வயலில் 2-5 செ.மீ நீர் மட்டத்தை பராமரிக்கவும். 4) சமச்சீர் உரம் (NPK) இடவும். 5) களைகள் மற்றும் பூச்சிகளை தொடர்ந்து கட்டுப்படுத்தவும். 6) 80% தானியங்கள் பொன் மஞ்சள் நிறமாக மாறும்போது அறுவடை செய்யவும்."
-            },
-            "pest": {
-                "English": "For natural pest control: 1) Use neem oil spray (mix 5ml neem oil with 1L water). 2) Introduce beneficial insects like ladybugs. 3) Practice crop rotation. 4) Use sticky traps for flying insects. 5) Apply wood ash around plants to deter crawling pests.",
-                "Hindi": "प्राकृतिक कीट नियंत्रण के लिए: 1) नीम तेल स्प्रे का उपयोग करें (5 मिली नीम तेल को 1 लीटर पानी में मिलाएं)। 2) लेडीबग जैसे लाभकारी कीड़ों को शामिल करें। 3) फसल चक्र का अभ्यास करें। 4) उड़ने वाले कीड़ों के लिए चिपचिपे जाल का उपयोग करें। 5) रेंगने वाले कीटों को रोकने के लिए पौधों के चारों ओर लकड़ी की राख लगाएं।",
-                "Tamil": "இயற்கை பூச்சி கட்டுப்பாட்டிற்கு: 1) வேப்ப எண்ணெய் தெளிப்பு பயன்படுத்தவும் (5மிலி வேப்ப எண்ணெயை 1லிட்டர் நீரில் கலக்கவும்). 2) லேடிபக் போன்ற பயனுள்ள பூச்சிகளை அறிமுகப்படுத்தவும். 3) பயிர் சுழற்சி முறையை பின்பற்றவும். 4) பறக்கும் பூச்சிகளுக்கு ஒட்டும் பொறிகளை பயன்படுத்தவும். 5) ஊர்ந்து செல்லும் பூச்சிகளை தடுக்க தாவரங்களைச் சுற்றி மர சாம்பலைப் பயன்படுத்தவும்."
-            },
-            "fertilizer": {
-                "English": "For organic fertilizers: 1) Compost - mix kitchen waste, dry leaves, and cow dung. 2) Vermicompost - use earthworms to break down organic matter. 3) Green manure - grow legumes and plow them back into soil. 4) Bone meal - good source of phosphorus. 5) Wood ash - provides potassium and calcium.",
-                "Hindi": "जैविक उर्वरकों के लिए: 1) कम्पोस्ट - रसोई के कचरे, सूखी पत्तियों और गोबर को मिलाएं। 2) वर्मीकम्पोस्ट - कार्बनिक पदार्थों को तोड़ने के लिए केंचुओं का उपयोग करें। 3) हरी खाद - फलियां उगाएं और उन्हें वापस मिट्टी में जोत दें। 4) हड्डी का चूरा - फास्फोरस का अच्छा स्रोत। 5) लकड़ी की राख - पोटेशियम और कैल्शियम प्रदान करती है।",
-                "Tamil": "இயற்கை உரங்களுக்கு: 1) கம்போஸ்ட் - சமையலறை கழிவுகள், உலர் இலைகள் மற்றும் மாட்டுச் சாணத்தை கலக்கவும். 2) மண்புழு உரம் - கரிம பொருட்களை சிதைக்க மண்புழுக்களைப் பயன்படுத்தவும். 3) பசுந்தாள் உரம் - பயறு வகைகளை வளர்த்து மண்ணில் உழவும். 4) எலும்பு மாவு - பாஸ்பரஸின் நல்ல ஆதாரம். 5) மர சாம்பல் - பொட்டாசியம் மற்றும் கால்சியம் வழங்குகிறது."
-            },
-            "default": {
-                "English": "For sustainable farming: 1) Practice crop rotation to maintain soil health. 2) Use organic fertilizers like compost and vermicompost. 3) Implement integrated pest management. 4) Conserve water through drip irrigation. 5) Plant native varieties that are adapted to local conditions.",
-                "Hindi": "टिकाऊ खेती के लिए: 1) मिट्टी के स्वास्थ्य को बनाए रखने के लिए फसल चक्र का अभ्यास करें। 2) कम्पोस्ट और वर्मीकम्पोस्ट जैसे जैविक उर्वरकों का उपयोग करें। 3) एकीकृत कीट प्रबंधन लागू करें। 4) ड्रिप सिंचाई के माध्यम से पानी का संरक्षण करें। 5) स्थानीय परिस्थितियों के अनुकूल देशी किस्मों को लगाएं।",
-                "Tamil": "நிலையான விவசாயத்திற்கு: 1) மண் ஆரோக்கியத்தை பராமரிக்க பயிர் சுழற்சி முறையை பின்பற்றவும். 2) கம்போஸ்ட் மற்றும் மண்புழு உரம் போன்ற இயற்கை உரங்களைப் பயன்படுத்தவும். 3) ஒருங்கிணைந்த பூச்சி மேலாண்மையை செயல்படுத்தவும். 4) சொட்டு நீர்ப்பாசனம் மூலம் நீரை பாதுகாக்கவும். 5) உள்ளூர் சூழலுக்கு ஏற்ற நாட்டு ரகங்களை நடவும்."
-            }
-        }
-
-        # Extract keywords from the prompt to determine the topic
-        keywords = {
-            "rice": ["rice", "paddy", "धान", "चावल", "நெல்", "அரிசி", "వరి", "బియ్యం"],
-            "wheat": ["wheat", "गेहूं", "கோதுமை", "గోధుమ"],
-            "pest": ["pest", "insect", "bug", "कीट", "कीड़े", "பூச்சி", "పురుగు"],
-            "fertilizer": ["fertilizer", "manure", "compost", "उर्वरक", "खाद", "உரம்", "ఎరువు"],
-            "water": ["water", "irrigation", "rain", "पानी", "सिंचाई", "நீர்", "பாசனம்", "నీరు", "నీటి"],
-            "soil": ["soil", "land", "मिट्टी", "भूमि", "மண்", "நிலம்", "నేల", "మట్టి"],
-            "organic": ["organic", "natural", "जैविक", "प्राकृतिक", "இயற்கை", "సహజ"],
-            "season": ["season", "weather", "climate", "मौसम", "जलवायु", "பருவம்", "காலநிலை", "సీజన్", "వాతావరణం"]
-        }
-
-        # Detect topics in the prompt
-        detected_topics = []
-        for topic, topic_keywords in keywords.items():
-            if any(word in prompt.lower() for word in topic_keywords):
-                detected_topics.append(topic)
-
-        # If no specific topics detected, use default
-        if not detected_topics:
-            detected_topics = ["default"]
-
-        # Determine language from the prompt
-        language = "English"
-        if any(char in prompt for char in "हिंदीफसलखेती"):
-            language = "Hindi"
-        elif any(char in prompt for char in "தமிழ்பயிர்நெல்"):
-            language = "Tamil"
-        elif any(char in prompt for char in "తెలుగు"):
-            language = "Telugu"
-
-        # Add some randomness to the response selection
-        import random
-        import time
-
-        # Use current time for some randomness
-        random.seed(int(time.time()))
-
-        # Select a random topic from detected topics
-        selected_topic = random.choice(detected_topics)
-
-        # Get responses for the selected topic and language
-        responses = farming_responses.get(selected_topic, farming_responses["default"])
-        language_responses = responses.get(language, responses["English"])
-
-        # Return the response with some personalization based on the prompt
-        if "how" in prompt.lower() or "what" in prompt.lower() or "?" in prompt:
-            # It's a question, give a direct answer
-            return language_responses
-        else:
-            # It's not a clear question, add a prefix
-            prefixes = {
-                "English": ["Based on your question about farming, ", "Regarding your farming inquiry, ", "For your question about agriculture, "],
-                "Hindi": ["आपके खेती के सवाल के आधार पर, ", "आपके कृषि संबंधी प्रश्न के बारे में, "],
-                "Tamil": ["உங்கள் விவசாய கேள்வியின் அடிப்படையில், ", "உங்கள் வேளாண்மை கேள்விக்கு, "],
-                "Telugu": ["మీ వ్యవసాయ ప్రశ్న ఆధారంగా, ", "మీ వ్యవసాయ సంబంధిత ప్రశ్నకు, "]
-            }
-
-            prefix_list = prefixes.get(language, prefixes["English"])
-            selected_prefix = random.choice(prefix_list)
-
-            return selected_prefix + language_responses
-    except Exception as e:
-        print(f"Error getting response from GPT: {str(e)}")
-        # Return a farming-related response as fallback
-        farming_responses = {
-            "English": "I'm sorry, I couldn't process your request right now. For pest control in crops, you can try neem oil spray or introducing beneficial insects. Please try again later for more specific advice.",
-            "Hindi": "मुझे खेद है, मैं अभी आपके अनुरोध को प्रोसेस नहीं कर सका। फसलों में कीट नियंत्रण के लिए, आप नीम तेल स्प्रे या लाभकारी कीड़ों को शामिल करने का प्रयास कर सकते हैं। अधिक विशिष्ट सलाह के लिए कृपया बाद में पुनः प्रयास करें।",
-            "Tamil": "உங்கள் கோரிக்கையை இப்போது செயலாக்க முடியவில்லை என்பதற்கு வருந்துகிறேன். பயிர்களில் பூச்சிகளைக் கட்டுப்படுத்த, நீங்கள் வேப்ப எண்ணெய் தெளிப்பு அல்லது பயனுள்ள பூச்சிகளை அறிமுகப்படுத்த முயற்சிக்கலாம். மேலும் குறிப்பிட்ட ஆலோசனைக்கு பின்னர் மீண்டும் முயற்சிக்கவும்."
-        }
-
-        # Try to detect language from prompt or default to English
-        language = "English"
-        if "हिंदी" in prompt or "फसल" in prompt:
-            language = "Hindi"
-        elif "தமிழ்" in prompt or "பயிர்" in prompt:
-            language = "Tamil"
-
-        return farming_responses.get(language, farming_responses["English"])
+        async for piece in stream_response_from_gpt(prompt, question, language):
+            waited += time.perf_counter() - requested
+            requested = None
+            pieces.append(piece)
+            yield piece
+            requested = time.perf_counter()
+        if not "".join(pieces).strip():
+            raise LLMUnavailable("empty reply")
+    except LLMUnavailable as e:
+        # Count the wait up to the failure or deadline before handing over
+        # to the consumer
+        if requested is not None:
+            waited += time.perf_counter() - requested
+            requested = None
+        # Raised before the first piece, or for an empty reply, so the local
+        # answer can take its place; waiting callers answer locally too
+        pending.set_exception(e)
+        logger.warning("%s; answering from the knowledge base", e)
+        for chunk in sentence_chunks(local_response(question, language)):
+            yield chunk
+        return
+    except BaseException as e:
+        # A failed or abandoned stream must not leave waiting callers hanging
+        if not pending.done():
+            pending.set_exception(e if isinstance(e, Exception) else LLMUnavailable("stream abandoned"))
+        raise
+    finally:
+        if requested is not None:
+            waited += time.perf_counter() - requested
+        add_stage("llm", waited)
+    pending.set_result("".join(pieces))
@@ -0,0 +1,265 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from knowledge_base import get_knowledge_base
+from text_matcher import TOPIC_KEYWORDS
+from transcode import REPLY_FORMATS
+from voice_output import LANGUAGE_CODE_MAP, encode_reply, text_to_speech
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Directory the pack is built into and served from
+ANSWER_PACK_DIR = os.getenv("KRISHIMITRA_ANSWER_PACK_DIR", os.path.join(ROOT, "answer_pack"))
+# Audio formats rendered for every answer
+ANSWER_PACK_FORMATS = os.getenv("KRISHIMITRA_ANSWER_PACK_FORMATS", ",".join(REPLY_FORMATS)).split(",")
+
+MANIFEST = "manifest.json"
+_SCHEMA = 1
+
+# Audio files are named after a digest of their content, so a name always
+# refers to the same bytes and can be cached for good
+_ASSET_NAME = re.compile(r"[0-9a-f]{20}\.(?:mp3|opus)")
+MEDIA_TYPES = {suffix: media_type for media_type, suffix, _ in REPLY_FORMATS.values()}
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an entity tag.
+
+    Args:
+        if_none_match (str): The header value, or None
+        etag (str): The quoted entity tag of the current content
+
+    Returns:
+        bool: True if the client already has the current content
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/"x" matches "x"
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _store(path, directory):
+    """Copy a file into the pack under a name derived from its content."""
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    name = digest[:20] + os.path.splitext(path)[1]
+    destination = os.path.join(directory, name)
+    if not os.path.exists(destination):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, destination)
+    return name, os.path.getsize(destination)
+
+
+def build_pack(directory=ANSWER_PACK_DIR, formats=ANSWER_PACK_FORMATS, languages=tuple(LANGUAGE_CODE_MAP), jobs=4):
+    """
+    Render every canned answer, in every language, into an answer pack.
+
+    For each knowledge base topic and language, the answer is the text
+    `/voice-ask` gives offline for that topic (the English entry where the
+    language has none), spoken in that language's voice exactly as the
+    server would synthesize it. The audio is stored once per format under
+    content-addressed names, and manifest.json lists every answer. The
+    manifest's version is a digest of the rest of the manifest, so
+    rebuilding an unchanged knowledge base with the same formats and
+    languages keeps the version, and clients keep their copy. Audio no
+    longer referenced is removed.
+
+    Args:
+        directory (str): Where to write the pack
+        formats (list[str]): Keys of REPLY_FORMATS to render
+        languages (tuple[str]): Languages to render
+        jobs (int): Answers synthesized at once
+
+    Returns:
+        dict: Version, answer and file counts, and total audio size in bytes
+    """
+    knowledge_base = get_knowledge_base()
+    audio_dir = os.path.join(directory, "audio")
+    os.makedirs(audio_dir, exist_ok=True)
+
+    items = []
+    for topic in sorted(knowledge_base.topics):
+        for language in languages:
+            passage = knowledge_base.topic_passage(topic, language) or knowledge_base.topic_passage(topic, "English")
+            if passage is not None:
+                items.append((topic, language, passage))
+
+    def render(item):
+        topic, language, passage = item
+        mp3_path = text_to_speech(passage.text, language)
+        audio = {}
+        for fmt in formats:
+            name, size = _store(encode_reply(mp3_path, fmt), audio_dir)
+            audio[fmt] = {"url": f"audio/{name}", "bytes": size}
+        return {"topic": topic, "language": language, "text_language": passage.language,
+                "text": passage.text, "audio": audio}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        answers = list(pool.map(render, items))
+
+    manifest = {
+        "schema": _SCHEMA,
+        "formats": list(formats),
+        "languages": list(languages),
+        "topics": {topic: TOPIC_KEYWORDS.get(topic, []) for topic in sorted(knowledge_base.topics)},
+        "answers": answers,
+    }
+    # The version covers everything else in the manifest, so it changes
+    # whenever the served manifest does
+    version = hashlib.sha256(json.dumps(manifest, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    manifest = {"schema": _SCHEMA, "version": version[:16], **manifest}
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+    referenced = {entry["url"].rsplit("/", 1)[1] for answer in answers for entry in answer["audio"].values()}
+    for name in os.listdir(audio_dir):
+        if name not in referenced:
+            os.remove(os.path.join(audio_dir, name))
+    return {
+        "version": manifest["version"],
+        "answers": len(answers),
+        "files": len(referenced),
+        "bytes": sum(os.path.getsize(os.path.join(audio_dir, name)) for name in referenced),
+    }
+
+
+class AnswerPack:
+    """
+    A built answer pack, read from disk and reloaded whenever its manifest
+    is replaced, so a rebuild takes effect without a restart.
+    """
+
+    def __init__(self, directory=ANSWER_PACK_DIR):
+        """
+        Args:
+            directory (str): Directory the pack was built into
+        """
+        self.directory = directory
+        self.hits = 0
+        self._mtime = None
+        self._manifest = None
+        self._audio = {}
+        self._lock = threading.Lock()
+
+    def manifest(self):
+        """
+        Return the manifest as served to clients.
+
+        Returns:
+            tuple | None: (JSON bytes, version), or None if no pack is built
+        """
+        self._refresh()
+        return self._manifest
+
+    def lookup(self, text, language, fmt):
+        """
+        Find the prebuilt audio for a reply.
+
+        Args:
+            text (str): The reply text
+            language (str): The language the reply is spoken in
+            fmt (str): A key of REPLY_FORMATS
+
+        Returns:
+            str | None: Path to the audio, or None if the pack doesn't have it
+        """
+        self._refresh()
+        name = self._audio.get((text, language, fmt))
+        if name is None:
+            return None
+        path = os.path.join(self.directory, "audio", name)
+        if not os.path.exists(path):
+            return None
+        self.hits += 1
+        return path
+
+    def asset_path(self, name):
+        """
+        Return the path of a pack audio file.
+
+        Args:
+            name (str): File name as listed in the manifest
+
+        Returns:
+            str | None: The path, or None for names that are not pack files
+        """
+        if not _ASSET_NAME.fullmatch(name):
+            return None
+        path = os.path.join(self.directory, "audio", name)
+        return path if os.path.exists(path) else None
+
+    def stats(self):
+        """Return the loaded version, answer count and replies served from the pack."""
+        self._refresh()
+        return {
+            "version": self._manifest[1] if self._manifest else None,
+            "answers": len({(text, language) for text, language, _ in self._audio}),
+            "hits": self.hits,
+        }
+
+    def _refresh(self):
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            manifest, audio = None, {}
+            if mtime is not None:
+                with open(path, "rb") as f:
+                    body = f.read()
+                data = json.loads(body)
+                manifest = (body, data["version"])
+                for answer in data["answers"]:
+                    for fmt, entry in answer["audio"].items():
+                        audio[(answer["text"], answer["language"], fmt)] = entry["url"].rsplit("/", 1)[1]
+            self._manifest, self._audio, self._mtime = manifest, audio, mtime
+
+
+ANSWER_PACK = AnswerPack()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline answer pack.")
+    parser.add_argument("--output", default=ANSWER_PACK_DIR, help="directory to write the pack to")
+    parser.add_argument("--formats", default=",".join(ANSWER_PACK_FORMATS),
+                        help=f"comma-separated audio formats ({', '.join(REPLY_FORMATS)})")
+    parser.add_argument("--languages", default=",".join(LANGUAGE_CODE_MAP), help="comma-separated languages")
+    parser.add_argument("--jobs", type=int, default=4, help="answers synthesized at once")
+    args = parser.parse_args()
+
+    formats = [fmt.strip() for fmt in args.formats.split(",")]
+    unknown = [fmt for fmt in formats if fmt not in REPLY_FORMATS]
+    if unknown:
+        parser.error(f"unknown format: {', '.join(unknown)}")
+    languages = tuple(language.strip() for language in args.languages.split(","))
+    unknown = [language for language in languages if language not in LANGUAGE_CODE_MAP]
+    if unknown:
+        parser.error(f"unknown language: {', '.join(unknown)}")
+
+    started = time.perf_counter()
+    stats = build_pack(args.output, formats, languages, args.jobs)
+    print(f"Built answer pack {stats['version']} in {args.output}: {stats['answers']} answers, "
+          f"{stats['files']} audio files ({stats['bytes'] / 1024:.0f} KiB) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
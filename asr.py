@@ -0,0 +1,350 @@
+import asyncio
+import importlib.util
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from metrics import Histogram
+from workers import Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Whisper model size: tiny, base, small, medium, large-v3, ...
+WHISPER_MODEL = os.getenv("KRISHIMITRA_WHISPER_MODEL", "base")
+# Directory holding downloaded model weights, for nodes without internet access
+WHISPER_MODEL_DIR = os.getenv("KRISHIMITRA_WHISPER_MODEL_DIR") or None
+
+# Whisper decodes 30-second windows; shorter clips can be batched together
+WHISPER_WINDOW_SAMPLES = 30 * 16000
+
+# Model loaded once in each worker process by _init_worker
+_model = None
+
+
+def whisper_available():
+    """Return True if the openai-whisper package is installed."""
+    return importlib.util.find_spec("whisper") is not None
+
+
+def _init_worker(model_name, download_root, threads):
+    """Load the Whisper model once when a worker process starts."""
+    global _model
+    import torch
+    import whisper
+
+    torch.set_num_threads(threads)
+    _model = whisper.load_model(model_name, device="cpu", download_root=download_root)
+
+
+def _ping():
+    """No-op used to start worker processes ahead of the first request."""
+    return os.getpid()
+
+
+def _transcribe_batch(jobs):
+    """
+    Transcribe a batch of clips in a worker process.
+
+    Clips that fit in one 30-second window are decoded together, one batch
+    per language hint. Longer clips fall back to Whisper's sliding-window
+    transcription.
+
+    Args:
+        jobs (list): (audio, language_code) pairs, where audio is a file path
+            or a float32 array of 16 kHz mono samples
+
+    Returns:
+        list: (ok, text_or_error) pairs in job order
+    """
+    import torch
+    import whisper
+
+    results = [None] * len(jobs)
+    windows = {}
+    for index, (audio, language) in enumerate(jobs):
+        try:
+            if isinstance(audio, str):
+                audio = whisper.load_audio(audio)
+            if len(audio) > WHISPER_WINDOW_SAMPLES:
+                result = _model.transcribe(audio, language=language, fp16=False)
+                results[index] = (True, result["text"].strip())
+                continue
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=_model.dims.n_mels)
+            windows.setdefault(language, []).append((index, mel))
+        except Exception as e:
+            results[index] = (False, f"{type(e).__name__}: {e}")
+
+    for language, items in windows.items():
+        options = whisper.DecodingOptions(language=language, fp16=False, without_timestamps=True)
+        try:
+            mels = torch.stack([mel for _, mel in items])
+            decoded = whisper.decode(_model, mels, options)
+            for (index, _), result in zip(items, decoded):
+                results[index] = (True, result.text.strip())
+        except Exception as e:
+            for index, _ in items:
+                results[index] = (False, f"{type(e).__name__}: {e}")
+    return results
+
+
+class TranscriptionError(Exception):
+    """Raised when the speech-to-text engine fails on a clip."""
+
+
+class WhisperPool:
+    """
+    Process pool running local Whisper speech-to-text on CPU.
+
+    Each worker process loads the model once at startup. Clips wait in a
+    queue while every worker is busy; whenever a worker frees up it receives
+    up to `batch_size` queued clips at once, so requests that queued behind
+    each other share one decoder pass. An idle pool waits `batch_wait`
+    seconds for more clips before sending a partial batch.
+
+    If a worker process dies (the model failed to load, or it ran out of
+    memory), the clips it held fail with TranscriptionError and the
+    processes are started afresh for the next clips. A worker that holds a
+    clip past the timeout is treated as hung: its batch fails, its slot is
+    released, and the processes are replaced the same way.
+    """
+
+    def __init__(self, model_name, workers, threads_per_worker, batch_size, batch_wait, max_queue,
+                 download_root=None, timeout=60.0):
+        """
+        Args:
+            model_name (str): Whisper model size
+            workers (int): Number of worker processes
+            threads_per_worker (int): Torch threads used by each worker
+            batch_size (int): Largest number of clips sent to a worker at once
+            batch_wait (float): Seconds to wait for a batch to fill up
+            max_queue (int): Clips allowed to wait before new ones are rejected
+            download_root (str): Directory holding the model weights
+            timeout (float): Seconds a clip may wait for its transcript
+        """
+        self.model_name = model_name
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_queue = max_queue
+        self.download_root = download_root
+        self.timeout = timeout
+        self.rejected = 0
+        self.restarts = 0
+        self.timeouts = 0
+        self.batches = 0
+        self.batched_clips = 0
+        self.latency = Histogram()
+        self._executor = None
+        self._waiting = []
+        self._outstanding = 0
+        self._busy_workers = 0
+        self._running = {}
+        self._flush_timer = None
+
+    def start(self):
+        """Start the worker processes and load the model in each of them."""
+        if self._executor is not None:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.download_root, self.threads_per_worker),
+        )
+
+    async def warmup(self):
+        """Start every worker process and wait until each has loaded the model."""
+        self.start()
+        executor = self._executor
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*[
+                loop.run_in_executor(executor, _ping) for _ in range(self.workers)
+            ])
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def transcribe(self, audio, language=None):
+        """
+        Transcribe one clip.
+
+        Args:
+            audio: Path to an audio file, or a float32 array of 16 kHz samples
+            language (str): Whisper language code hint, or None to auto-detect
+
+        Returns:
+            str: The transcribed text
+
+        Raises:
+            Overloaded: If too many clips are already waiting
+            TranscriptionError: If the engine fails on the clip, its worker
+                died, or no transcript arrived within the timeout
+        """
+        if self._outstanding >= self.max_queue + self.workers * self.batch_size:
+            self.rejected += 1
+            raise Overloaded("asr", max(1, math.ceil(self.latency.quantile(0.5))))
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiting.append((audio, language, waiter))
+        self._outstanding += 1
+        started = loop.time()
+        try:
+            if self._busy_workers < self.workers:
+                if len(self._waiting) >= self.batch_size:
+                    self._flush()
+                elif self._flush_timer is None:
+                    self._flush_timer = loop.call_later(self.batch_wait, self._flush)
+
+            ok, text = await asyncio.wait_for(waiter, self.timeout)
+        except TimeoutError:
+            self.timeouts += 1
+            self._abandon(waiter)
+            raise TranscriptionError(f"no transcript within {self.timeout:g}s") from None
+        finally:
+            self._outstanding -= 1
+            if not waiter.done() or waiter.cancelled():
+                # Timed out or cancelled before a worker took it: don't send it
+                self._waiting = [item for item in self._waiting if item[2] is not waiter]
+        self.latency.observe(loop.time() - started)
+        if not ok:
+            raise TranscriptionError(text)
+        return text
+
+    def stats(self):
+        """Return queue, batching and latency figures."""
+        return {
+            "model": self.model_name,
+            "workers": self.workers,
+            "outstanding": self._outstanding,
+            "waiting": len(self._waiting),
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_clips / self.batches, 2) if self.batches else 0.0,
+            "latency": self.latency.snapshot(),
+        }
+
+    def _flush(self):
+        """Send waiting clips to idle workers, up to one batch per worker."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        # Skip clips whose requests gave up in the meantime
+        self._waiting = [item for item in self._waiting if not item[2].done()]
+        while self._waiting and self._busy_workers < self.workers:
+            batch = self._waiting[:self.batch_size]
+            del self._waiting[:self.batch_size]
+            self.start()
+            executor = self._executor
+            try:
+                future = asyncio.wrap_future(
+                    executor.submit(_transcribe_batch, [(audio, language) for audio, language, _ in batch])
+                )
+            except (BrokenProcessPool, RuntimeError) as e:
+                # The pool broke since the last batch; fail these clips and
+                # start new processes for the next ones
+                self._fail(batch, e)
+                self._restart(executor)
+                continue
+            self.batches += 1
+            self.batched_clips += len(batch)
+            self._busy_workers += 1
+            self._running[future] = (batch, executor)
+            future.add_done_callback(lambda done, batch=batch: self._batch_done(batch, done, executor))
+
+    def _batch_done(self, batch, done, executor):
+        """Release the worker and pass the next queued clips to it."""
+        if self._running.pop(done, None) is None:
+            # Already released by _abandon; retrieve the outcome so it isn't logged
+            if not done.cancelled():
+                done.exception()
+            return
+        self._busy_workers -= 1
+        self._deliver(batch, done)
+        if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+            self._restart(executor)
+        if self._waiting:
+            self._flush()
+
+    def _abandon(self, waiter):
+        """Give up on the batch holding a timed-out clip and replace its hung worker."""
+        for future, (batch, executor) in list(self._running.items()):
+            if any(item[2] is waiter for item in batch):
+                break
+        else:
+            # The clip was still queued
+            return
+        del self._running[future]
+        self._busy_workers -= 1
+        self._fail(batch, TimeoutError(f"worker gave no transcript within {self.timeout:g}s"))
+        self._restart(executor, terminate=True)
+        if self._waiting:
+            self._flush()
+
+    def _restart(self, executor, terminate=False):
+        """
+        Replace a broken process pool; later failures of the same pool are ignored.
+
+        Args:
+            executor: The pool to replace
+            terminate (bool): Also kill its processes, which may be hung
+        """
+        if terminate:
+            # shutdown() leaves a hung process running, so stop them directly
+            for process in list((executor._processes or {}).values()):
+                process.terminate()
+        if executor is not self._executor:
+            return
+        if terminate:
+            logger.warning("Whisper worker did not answer in time; starting new workers")
+        else:
+            logger.warning("Whisper worker process died; starting new workers")
+        self.restarts += 1
+        self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _fail(batch, error):
+        """Fail every clip of a batch that could not be sent to a worker."""
+        for _, _, waiter in batch:
+            if not waiter.done():
+                waiter.set_result((False, f"{type(error).__name__}: {error}"))
+
+    @staticmethod
+    def _deliver(batch, done):
+        """Hand each clip's result to the request waiting on it."""
+        for index, (_, _, waiter) in enumerate(batch):
+            if waiter.done():
+                continue
+            if done.cancelled():
+                waiter.cancel()
+            elif done.exception() is not None:
+                waiter.set_result((False, f"{type(done.exception()).__name__}: {done.exception()}"))
+            else:
+                waiter.set_result(done.result()[index])
+
+
+ASR_POOL = WhisperPool(
+    model_name=WHISPER_MODEL,
+    workers=int(os.getenv("KRISHIMITRA_ASR_WORKERS", "1")),
+    threads_per_worker=int(os.getenv("KRISHIMITRA_ASR_THREADS", "1")),
+    batch_size=int(os.getenv("KRISHIMITRA_ASR_BATCH_SIZE", "4")),
+    batch_wait=float(os.getenv("KRISHIMITRA_ASR_BATCH_WAIT_MS", "25")) / 1000,
+    max_queue=int(os.getenv("KRISHIMITRA_ASR_QUEUE", "32")),
+    download_root=WHISPER_MODEL_DIR,
+    timeout=float(os.getenv("KRISHIMITRA_ASR_TIMEOUT", "60")),
+)
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+
+class AudioCache:
+    """
+    Disk-backed, content-addressed cache for synthesized audio files.
+
+    Entries are stored as one file per key inside a single directory, so the
+    cache can be shared by every process that points at the same directory.
+    A file's modification time records when it was written (used for the age
+    budget) and its access time records when it was last served (used for
+    least-recently-used eviction).
+    """
+
+    def __init__(self, directory, max_bytes, max_age, suffix=".mp3"):
+        """
+        Args:
+            directory (str): Directory that holds the cached files
+            max_bytes (int): Total size budget for the cache in bytes
+            max_age (float): Maximum age of an entry in seconds
+            suffix (str): File extension used for cached entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Temporary files left behind by writers that died mid-write
+        self.stale_parts = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._approx_bytes = sum(size for _, _, size, _ in self._scan())
+
+    @staticmethod
+    def key(*parts):
+        """
+        Build a cache key from the values that determine the audio content.
+
+        Args:
+            *parts: Values such as the text, language code and voice settings
+
+        Returns:
+            str: Hex digest identifying the content
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\x1f")
+        return digest.hexdigest()
+
+    def path_for(self, key, suffix=None):
+        """Return the file path an entry with the given key is stored at."""
+        return os.path.join(self.directory, key + (suffix or self.suffix))
+
+    def get(self, key, suffix=None):
+        """
+        Look up a cached file.
+
+        Args:
+            key (str): Key returned by AudioCache.key
+            suffix (str): File extension of the entry, if not the default
+
+        Returns:
+            str | None: Path to the cached file, or None on a miss
+        """
+        path = self.path_for(key, suffix)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        now = time.time()
+        if now - st.st_mtime > self.max_age:
+            self._remove(path, st.st_size)
+            self._count("misses")
+            return None
+
+        # Record the access for LRU ordering without changing the write time
+        try:
+            os.utime(path, (now, st.st_mtime))
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return path
+
+    def put(self, key, writer, suffix=None):
+        """
+        Store a new entry by letting `writer` produce it.
+
+        The file is written to a temporary name inside the cache directory and
+        then renamed into place, so concurrent writers of the same key never
+        expose a partially written file.
+
+        Args:
+            key (str): Key returned by AudioCache.key
+            writer (callable): Called with a file path to write the audio to
+            suffix (str): File extension of the entry, if not the default
+
+        Returns:
+            str: Path to the cached file
+        """
+        path = self.path_for(key, suffix)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        os.close(fd)
+        try:
+            writer(tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._approx_bytes += size
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+        return path
+
+    def evict(self):
+        """
+        Drop expired entries, then least-recently-used ones until the cache
+        is back under 90% of its size budget.
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        for path, atime, size, mtime in self._scan():
+            if path.endswith(".part"):
+                # An hour-old temporary file belongs to a writer that died
+                if now - mtime > 3600:
+                    self._remove(path, 0, "stale_parts")
+                else:
+                    total += size
+                continue
+            if now - mtime > self.max_age:
+                self._remove(path, 0)
+                continue
+            entries.append((atime, path, size))
+            total += size
+
+        low_water = self.max_bytes * 0.9
+        entries.sort()
+        for _, path, size in entries:
+            if total <= low_water:
+                break
+            self._remove(path, 0)
+            total -= size
+
+        with self._lock:
+            self._approx_bytes = total
+
+    def stats(self):
+        """Return hit/miss and eviction counters and the current cache size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "stale_parts": self.stale_parts,
+                "bytes": self._approx_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _scan(self):
+        """Yield (path, atime, size, mtime) for every file in the cache directory."""
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_atime, st.st_size, st.st_mtime
+
+    def _remove(self, path, size, counter="evictions"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self._approx_bytes = max(0, self._approx_bytes - size)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
@@ -0,0 +1,259 @@
+import io
+import os
+import struct
+from tempfile import NamedTemporaryFile
+from fastapi import HTTPException, UploadFile
+from workers import VOICE_POOL
+
+# Upload limits for voice questions
+MAX_UPLOAD_BYTES = int(float(os.getenv("KRISHIMITRA_MAX_UPLOAD_MB", "10")) * 1024 * 1024)
+MAX_AUDIO_SECONDS = float(os.getenv("KRISHIMITRA_MAX_AUDIO_SECONDS", "120"))
+# Uploads stay in memory up to this size and are spilled to disk above it
+SPOOL_THRESHOLD = int(os.getenv("KRISHIMITRA_UPLOAD_SPOOL_KB", "512")) * 1024
+CHUNK_SIZE = 64 * 1024
+# Allowance for multipart boundaries and form fields around the audio itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+# MPEG audio bitrates in kbit/s, indexed by [MPEG-1?][bitrate index], layer III
+_MP3_BITRATES = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0),
+}
+
+
+def detect_audio_format(header):
+    """
+    Identify an audio container from its first bytes.
+
+    Args:
+        header (bytes): The start of the file (at least 12 bytes)
+
+    Returns:
+        str | None: File extension for the format, or None if unrecognized
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if header[4:8] == b"ftyp":
+        return "m4a"
+    if header[:5] == b"#!AMR":
+        return "amr"
+    if header[:3] == b"ID3":
+        return "mp3"
+    if len(header) >= 2 and header[0] == 0xFF:
+        # ADTS AAC has layer bits 00; MPEG audio frames have a non-zero layer
+        if header[1] & 0xF6 == 0xF0:
+            return "aac"
+        if header[1] & 0xE0 == 0xE0 and header[1] & 0x06:
+            return "mp3"
+    return None
+
+
+def audio_byte_rate(audio_format, header):
+    """
+    Work out how many bytes per second of audio a file holds, from its header.
+
+    Exact for WAV; for MP3 it assumes a constant bitrate taken from the first
+    frame. Other formats return None and are only bounded by size.
+
+    Args:
+        audio_format (str): Format returned by detect_audio_format
+        header (bytes): The start of the file
+
+    Returns:
+        tuple | None: (byte_rate, header_bytes) or None if unknown
+    """
+    if audio_format == "wav":
+        pos = 12
+        while pos + 8 <= len(header):
+            chunk_id, size = header[pos:pos + 4], struct.unpack("<I", header[pos + 4:pos + 8])[0]
+            if chunk_id == b"fmt " and pos + 20 <= len(header):
+                byte_rate = struct.unpack("<I", header[pos + 16:pos + 20])[0]
+                return (byte_rate, 44) if byte_rate else None
+            pos += 8 + size + (size & 1)
+        return None
+
+    if audio_format == "mp3":
+        offset = 0
+        if header[:3] == b"ID3" and len(header) >= 10:
+            # Syncsafe tag size: 7 bits per byte
+            size = header[6] << 21 | header[7] << 14 | header[8] << 7 | header[9]
+            offset = 10 + size
+        if offset + 4 > len(header) or header[offset] != 0xFF:
+            return None
+        mpeg1 = bool(header[offset + 1] & 0x08)
+        kbps = _MP3_BITRATES[mpeg1][header[offset + 2] >> 4]
+        return (kbps * 1000 // 8, offset) if kbps else None
+
+    return None
+
+
+class SpooledAudio:
+    """
+    Uploaded audio held in memory, spilling to a temporary file once it grows
+    past a threshold. The file carries the extension of the detected format,
+    and every disk operation runs on the voice pool, so it never blocks the
+    event loop. The pool work is done for a request that has already been
+    admitted, so it is queued rather than rejected.
+    """
+
+    def __init__(self, audio_format, threshold):
+        self.format = audio_format
+        self.size = 0
+        self._threshold = threshold
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    async def write(self, data):
+        """Append a chunk, moving the data to disk once past the threshold."""
+        self.size += len(data)
+        if self._file is None and self.size <= self._threshold:
+            self._buffer.write(data)
+            return
+        await VOICE_POOL.run(self._write_file, data, admitted=True)
+
+    async def path(self):
+        """
+        Return a file path holding the audio, writing it out if still in memory.
+
+        Returns:
+            str: Path to the audio file
+        """
+        return await VOICE_POOL.run(self._flush, admitted=True)
+
+    async def close(self):
+        """Discard the buffer and remove any temporary file."""
+        self._buffer = io.BytesIO()
+        if self._file is not None:
+            file, self._file = self._file, None
+            await VOICE_POOL.run(self._remove, file, admitted=True)
+
+    def _flush(self):
+        if self._file is None:
+            self._spill()
+        self._file.flush()
+        return self._file.name
+
+    @staticmethod
+    def _remove(file):
+        file.close()
+        if os.path.exists(file.name):
+            os.remove(file.name)
+
+    def _write_file(self, data):
+        if self._file is None:
+            self._spill()
+        self._file.write(data)
+
+    def _spill(self):
+        self._file = NamedTemporaryFile(delete=False, suffix=f".{self.format}")
+        self._file.write(self._buffer.getbuffer())
+        self._buffer = io.BytesIO()
+
+
+async def read_upload(audio: UploadFile, max_bytes=MAX_UPLOAD_BYTES, max_seconds=MAX_AUDIO_SECONDS,
+                      chunk_size=CHUNK_SIZE, spool_threshold=SPOOL_THRESHOLD):
+    """
+    Read an uploaded clip in fixed-size chunks into a SpooledAudio buffer.
+
+    The format is detected from the first chunk's magic bytes. Copying stops
+    as soon as the clip is known to be too large or too long. By then
+    Starlette has already received the whole request body, so these limits
+    keep an oversized or overlong clip from being copied and transcribed,
+    not from being uploaded; only UploadLimitMiddleware's byte limit cuts an
+    upload off while it arrives.
+
+    Args:
+        audio (UploadFile): The uploaded audio file
+        max_bytes (int): Largest accepted upload in bytes
+        max_seconds (float): Longest accepted clip, where the format allows
+            the duration to be read from its header
+        chunk_size (int): Bytes read per chunk
+        spool_threshold (int): Bytes kept in memory before spilling to disk
+
+    Returns:
+        SpooledAudio: The buffered clip
+
+    Raises:
+        HTTPException: 415 for unrecognized formats, 413 for oversized clips
+    """
+    first = await audio.read(chunk_size)
+    audio_format = detect_audio_format(first)
+    if audio_format is None:
+        raise HTTPException(status_code=415, detail="Unsupported or unrecognized audio format")
+
+    rate = audio_byte_rate(audio_format, first)
+    limit = max_bytes
+    if rate:
+        byte_rate, header_bytes = rate
+        limit = min(limit, header_bytes + int(byte_rate * max_seconds))
+
+    spool = SpooledAudio(audio_format, spool_threshold)
+    chunk = first
+    try:
+        while chunk:
+            if spool.size + len(chunk) > limit:
+                too_long = limit < max_bytes
+                detail = (f"Audio longer than {max_seconds:g} seconds" if too_long
+                          else f"Audio larger than {max_bytes // (1024 * 1024)} MB")
+                raise HTTPException(status_code=413, detail=detail)
+            await spool.write(chunk)
+            chunk = await audio.read(chunk_size)
+    except BaseException:
+        await spool.close()
+        raise
+    return spool
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that rejects oversized request bodies on the voice
+    endpoints with 413 before they are read in full.
+
+    Requests with a Content-Length above the limit are refused without
+    reading the body; chunked uploads are cut off once the limit is crossed.
+    """
+
+    def __init__(self, app, path_prefix="/voice-ask", max_body=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # Raised while the form is being parsed; FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = b'{"detail":"Upload too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,80 @@
+"""
+Throughput benchmark for the local Whisper transcription pool.
+
+Transcribes a fixed set of sample clips through asr.WhisperPool and reports
+clips per second, and clips per second per CPU core, for each batch size.
+Model loading happens during warmup and is not counted.
+
+Usage:
+    python benchmarks/bench_asr.py [--samples response.mp3 ...] [--clips 32]
+        [--model base] [--workers 1] [--threads 1] [--batch-sizes 1,4]
+        [--language en] [--timeout 600]
+"""
+import argparse
+import asyncio
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from asr import WHISPER_MODEL, WHISPER_MODEL_DIR, WhisperPool
+
+
+async def run(pool, samples, clips, language):
+    """Submit `clips` clips at once, cycling through the samples."""
+    await pool.warmup()
+    started = time.perf_counter()
+    texts = await asyncio.gather(*[
+        pool.transcribe(samples[i % len(samples)], language) for i in range(clips)
+    ])
+    return time.perf_counter() - started, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", nargs="+", default=[os.path.join(ROOT, "response.mp3")],
+                        help="audio files or glob patterns used as the fixed sample set")
+    parser.add_argument("--clips", type=int, default=32, help="clips transcribed per run")
+    parser.add_argument("--model", default=WHISPER_MODEL, help="Whisper model size")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per worker")
+    parser.add_argument("--batch-sizes", default="1,4", help="comma-separated batch sizes to compare")
+    parser.add_argument("--language", default=None, help="Whisper language code hint, e.g. hi or ta")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="seconds each clip may take; every clip is submitted at once, so the "
+                             "last ones wait for all the others")
+    args = parser.parse_args()
+
+    samples = sorted(path for pattern in args.samples for path in glob.glob(pattern))
+    if not samples:
+        parser.error("no sample audio files found")
+
+    cores = args.workers * args.threads
+    print(f"model={args.model} workers={args.workers} threads/worker={args.threads} "
+          f"samples={len(samples)} clips={args.clips}")
+    print(f"{'batch':>6}{'seconds':>10}{'clips/s':>10}{'clips/s/core':>14}{'mean batch':>12}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        pool = WhisperPool(
+            model_name=args.model,
+            workers=args.workers,
+            threads_per_worker=args.threads,
+            batch_size=batch_size,
+            batch_wait=0.025,
+            max_queue=args.clips,
+            download_root=WHISPER_MODEL_DIR,
+            timeout=args.timeout,
+        )
+        try:
+            elapsed, _ = asyncio.run(run(pool, samples, args.clips, args.language))
+        finally:
+            pool.shutdown()
+        rate = args.clips / elapsed
+        print(f"{batch_size:>6}{elapsed:>10.2f}{rate:>10.2f}{rate / cores:>14.2f}"
+              f"{pool.stats()['mean_batch_size']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
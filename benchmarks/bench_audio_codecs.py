@@ -0,0 +1,85 @@
+"""
+Reply codec benchmark: payload size, transcode time and download time.
+
+Transcodes gTTS replies into each reply format and reports the payload
+size, the time ffmpeg took, and how long the payload takes to download over
+typical rural links. Also times the upload normalization (decode to 16 kHz
+mono PCM and silence trim) on the same clips.
+
+Usage:
+    python benchmarks/bench_audio_codecs.py [--samples "samples/*.mp3"] [--repeat 3]
+        [--links 2g=50,3g=384,4g=4000]
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from transcode import REPLY_FORMATS, encode_audio, ffmpeg_available, normalize_audio
+
+
+def parse_links(value):
+    """Parse `name=kbps,...` into (name, bits per second) pairs."""
+    links = []
+    for item in value.split(","):
+        name, _, kbps = item.partition("=")
+        links.append((name.strip(), float(kbps) * 1000))
+    return links
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", default=os.path.join(ROOT, "response.mp3"),
+                        help="glob of gTTS MP3 replies to transcode")
+    parser.add_argument("--repeat", type=int, default=3, help="transcodes timed per sample and format")
+    parser.add_argument("--links", default="2g=50,3g=384,4g=4000",
+                        help="link speeds as name=kbps pairs for the download estimate")
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        raise SystemExit("ffmpeg-python and the ffmpeg binary are required")
+    samples = sorted(glob.glob(args.samples))
+    if not samples:
+        raise SystemExit(f"no samples match {args.samples}")
+    links = parse_links(args.links)
+
+    sizes = {fmt: [] for fmt in REPLY_FORMATS}
+    times = {fmt: [] for fmt in REPLY_FORMATS}
+    normalize_times = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for sample in samples:
+            sizes["mp3"].append(os.path.getsize(sample))
+            times["mp3"].append(0.0)
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                normalize_audio(sample)
+                normalize_times.append(time.perf_counter() - started)
+            for fmt, (_, suffix, _) in REPLY_FORMATS.items():
+                if fmt == "mp3":
+                    continue
+                output = os.path.join(tmp, "reply" + suffix)
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    encode_audio(sample, output, fmt)
+                    times[fmt].append(time.perf_counter() - started)
+                sizes[fmt].append(os.path.getsize(output))
+
+    print(f"{len(samples)} sample(s); upload normalization mean {statistics.mean(normalize_times) * 1000:.1f} ms")
+    header = f"{'format':<9} {'mean KB':>8} {'vs mp3':>7} {'encode ms':>10}"
+    print(header + "".join(f" {name + ' s':>8}" for name, _ in links))
+    base = statistics.mean(sizes["mp3"])
+    for fmt in REPLY_FORMATS:
+        size = statistics.mean(sizes[fmt])
+        row = (f"{fmt:<9} {size / 1024:>8.1f} {size / base:>7.2f} "
+               f"{statistics.mean(times[fmt]) * 1000:>10.1f}")
+        print(row + "".join(f" {size * 8 / bps:>8.2f}" for _, bps in links))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Lookup benchmark for the knowledge base index.
+
+Builds an index over a synthetic corpus of --entries passages, made by
+recombining the steps of the real entries in knowledge/entries.jsonl with
+region and variety names, so the vocabulary grows with the corpus. Reports
+build time, index size, resident memory added by loading the index, and
+search latency per query for a multilingual question mix.
+
+Usage:
+    python benchmarks/bench_knowledge_base.py [--entries 20000] [--queries 2000] [-k 3]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from knowledge_base import KB_ENTRIES, KnowledgeBase, build_index, load_entries
+
+QUESTIONS = [
+    ("How do I grow wheat in sandy soil?", "English"),
+    ("How can I save water during summer?", "English"),
+    ("Which organic fertilizer is best for rice?", "English"),
+    ("When should I sow mustard this season?", "English"),
+    ("गेहूं की खेती कैसे करें?", "Hindi"),
+    ("मिट्टी की जांच कब कराएं?", "Hindi"),
+    ("धान में कीट नियंत्रण कैसे करें?", "Hindi"),
+    ("நெல்லுக்கு எவ்வளவு தண்ணீர் தேவை?", "Tamil"),
+    ("இயற்கை விவசாயம் எப்படி தொடங்குவது?", "Tamil"),
+]
+
+REGIONS = ["Punjab", "Haryana", "Bihar", "Odisha", "Vidarbha", "Marathwada", "Konkan", "Malwa",
+           "Bundelkhand", "Terai", "Thanjavur", "Coimbatore", "Madurai", "Warangal", "Guntur"]
+
+
+def synthetic_entries(base, count, seed=7):
+    """Recombine the steps of the real entries into `count` new passages."""
+    rng = random.Random(seed)
+    steps = {}
+    for entry in base:
+        parts = [part.strip() for part in re.split(r"\s*\d\)\s*", entry["text"]) if part.strip()]
+        steps.setdefault(entry["language"], []).append((entry["topic"], parts[0], parts[1:]))
+
+    entries = []
+    for i in range(count):
+        language = rng.choice(list(steps))
+        topic, heading, topic_steps = rng.choice(steps[language])
+        chosen = rng.sample(topic_steps, min(3, len(topic_steps)))
+        region = rng.choice(REGIONS)
+        text = f"{heading} ({region}, variety KM-{i % 5000}) " + " ".join(
+            f"{n}) {step}" for n, step in enumerate(chosen, 1))
+        entries.append({"id": f"synthetic-{i}", "topic": topic, "language": language, "text": text})
+    return entries
+
+
+def rss_kb():
+    """Resident set size of this process in KB (Linux only, else 0)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=20000, help="synthetic passages to index")
+    parser.add_argument("--queries", type=int, default=2000, help="searches to time")
+    parser.add_argument("-k", type=int, default=3, help="passages returned per search")
+    args = parser.parse_args()
+
+    entries = load_entries(KB_ENTRIES) + synthetic_entries(load_entries(KB_ENTRIES), args.entries)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bin")
+        started = time.perf_counter()
+        stats = build_index(entries, path)
+        build_time = time.perf_counter() - started
+
+        before = rss_kb()
+        knowledge_base = KnowledgeBase(path)
+        loaded = rss_kb()
+
+        # Warm the page cache and the interpreter
+        for question, language in QUESTIONS:
+            knowledge_base.search(question, args.k, language)
+
+        timings = []
+        for i in range(args.queries):
+            question, language = QUESTIONS[i % len(QUESTIONS)]
+            started = time.perf_counter_ns()
+            knowledge_base.search(question, args.k, language)
+            timings.append((time.perf_counter_ns() - started) / 1000)
+        after = rss_kb()
+        knowledge_base.close()
+
+    timings.sort()
+    print(f"Indexed {stats['docs']} entries ({stats['terms']} terms, {stats['postings']} postings) "
+          f"in {build_time:.2f}s; index is {stats['bytes'] / 1024 / 1024:.1f} MB")
+    print(f"RSS added by loading: {loaded - before} KB; after {args.queries} searches: {after - before} KB")
+    print(f"search (k={args.k}): mean {statistics.mean(timings):.1f} us, "
+          f"p50 {timings[len(timings) // 2]:.1f} us, p95 {timings[int(len(timings) * 0.95)]:.1f} us, "
+          f"max {timings[-1]:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
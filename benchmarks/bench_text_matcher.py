@@ -0,0 +1,82 @@
+"""
+Micro-benchmark for topic and language detection.
+
+Compares the per-call cost of the shared matcher in text_matcher.py with the
+detection code that get_response_from_gpt used to run inline, on prompts
+built by build_prompt from long farmer questions. The legacy code lower-cases
+the prompt once per keyword and scans it once per marker character; the
+matcher lower-cases once and runs a single automaton scan. Latin-script text
+is the matcher's weakest case: most letters can start a keyword, so the
+automaton visits nearly every position, while the legacy substring searches
+run at memchr speed.
+
+Usage:
+    python benchmarks/bench_text_matcher.py [--repeat N] [--sizes 200,2000,20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agri_prompt import build_prompt
+from text_matcher import TOPIC_KEYWORDS, detect_language, detect_topics
+
+# Question fragments per language; repeated to reach the requested length
+SAMPLE_QUESTIONS = {
+    "English": "My paddy leaves are turning yellow after the rain, what should I do? ",
+    "Hindi": "बारिश के बाद मेरी फसल की पत्तियां पीली हो रही हैं, मुझे क्या करना चाहिए? ",
+    "Tamil": "மழைக்குப் பிறகு என் பயிர் இலைகள் மஞ்சள் நிறமாக மாறுகின்றன, நான் என்ன செய்ய வேண்டும்? ",
+    "Telugu": "వర్షం తర్వాత నా పంట ఆకులు పసుపు రంగులోకి మారుతున్నాయి, నేను ఏమి చేయాలి? ",
+}
+
+
+def legacy_detect(prompt):
+    """Topic and language detection as previously done inside get_response_from_gpt."""
+    keywords = {topic: list(words) for topic, words in TOPIC_KEYWORDS.items()}
+    detected_topics = []
+    for topic, topic_keywords in keywords.items():
+        if any(word in prompt.lower() for word in topic_keywords):
+            detected_topics.append(topic)
+
+    language = "English"
+    if any(char in prompt for char in "हिंदीफसलखेती"):
+        language = "Hindi"
+    elif any(char in prompt for char in "தமிழ்பயிர்நெல்"):
+        language = "Tamil"
+    elif any(char in prompt for char in "తెలుగు"):
+        language = "Telugu"
+    return detected_topics, language
+
+
+def matcher_detect(prompt):
+    """Topic and language detection through the shared matcher."""
+    return detect_topics(prompt), detect_language(prompt)
+
+
+def per_call_us(func, prompt, repeat):
+    """Return the best-of-five mean cost of one call in microseconds."""
+    timer = timeit.Timer(lambda: func(prompt))
+    return min(timer.repeat(repeat=5, number=repeat)) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="calls per timing sample")
+    parser.add_argument("--sizes", default="200,2000,20000", help="comma-separated question lengths in characters")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"{'language':<10}{'chars':>8}{'legacy us':>12}{'matcher us':>12}{'speedup':>10}")
+    for language, fragment in SAMPLE_QUESTIONS.items():
+        for size in sizes:
+            question = (fragment * (size // len(fragment) + 1))[:size]
+            prompt = build_prompt(question, language)
+            legacy = per_call_us(legacy_detect, prompt, args.repeat)
+            matcher = per_call_us(matcher_detect, prompt, args.repeat)
+            print(f"{language:<10}{size:>8}{legacy:>12.1f}{matcher:>12.1f}{legacy / matcher:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Fake OpenAI-compatible chat completions server with fault injection.
+
+Serves POST /v1/chat/completions, plain and streamed (SSE), answering from
+the knowledge base after a configurable delay. A share of requests can be
+made to fail with HTTP 500, to hang until the client gives up, or to take
+an extra slow-path delay (to exercise hedging). Faults can be changed while
+the server runs with POST /faults, and GET /faults reports the current
+settings with request counts.
+
+Point the API at it with KRISHIMITRA_LLM_BACKEND=openai and
+KRISHIMITRA_LLM_BASE_URL=http://127.0.0.1:8100/v1, or pass --llm-url to
+benchmarks/load_test.py.
+
+Usage:
+    python benchmarks/fake_openai_server.py [--port 8100] [--latency-ms 600]
+        [--ttft-ms 150] [--jitter-ms 50] [--error-rate 0.0] [--hang-rate 0.0]
+        [--slow-rate 0.0] [--slow-ms 5000] [--seed 1]
+
+    # Make half of all requests fail while the server is running
+    curl -X POST localhost:8100/faults -H 'Content-Type: application/json' -d '{"error_rate": 0.5}'
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from agri_prompt import parse_prompt
+from knowledge_base import default_passage, search_knowledge
+
+FAULT_FIELDS = ("latency_ms", "ttft_ms", "jitter_ms", "error_rate", "hang_rate", "slow_rate", "slow_ms")
+
+
+def reply_for(prompt):
+    """Answer the farmer's question in a prompt from the knowledge base."""
+    question, language = parse_prompt(prompt)
+    passages = search_knowledge(question, language, k=1)
+    return (passages[0] if passages else default_passage(language) or default_passage("English")).text
+
+
+def create_app(faults, seed=1):
+    """
+    Build the fake server.
+
+    Args:
+        faults (dict): Initial values for FAULT_FIELDS
+        seed (int): Seed for fault injection
+
+    Returns:
+        FastAPI: The app
+    """
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(seed)
+    counts = {"requests": 0, "errors": 0, "hangs": 0, "slow": 0}
+
+    def delay(ms):
+        return max(0.0, ms + rng.uniform(-faults["jitter_ms"], faults["jitter_ms"])) / 1000
+
+    @app.get("/faults")
+    async def get_faults():
+        return {**faults, **counts}
+
+    @app.post("/faults")
+    async def set_faults(request: Request):
+        updates = await request.json()
+        faults.update({name: float(value) for name, value in updates.items() if name in FAULT_FIELDS})
+        return faults
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        counts["requests"] += 1
+        roll = rng.random()
+        if roll < faults["error_rate"]:
+            counts["errors"] += 1
+            await asyncio.sleep(delay(faults["ttft_ms"]))
+            return JSONResponse(status_code=500, content={
+                "error": {"message": "Injected failure", "type": "server_error", "code": None}})
+        roll -= faults["error_rate"]
+        if roll < faults["hang_rate"]:
+            counts["hangs"] += 1
+            await asyncio.sleep(3600)
+        roll -= faults["hang_rate"]
+        extra = 0.0
+        if roll < faults["slow_rate"]:
+            counts["slow"] += 1
+            extra = faults["slow_ms"] / 1000
+
+        text = reply_for(body["messages"][-1]["content"])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay(faults["latency_ms"]) + extra)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+
+        async def events():
+            words = text.split(" ")
+            gap = max(0.0, faults["latency_ms"] - faults["ttft_ms"]) / 1000 / max(1, len(words) - 1)
+            await asyncio.sleep(delay(faults["ttft_ms"]) + extra)
+            for index, word in enumerate(words):
+                if index:
+                    await asyncio.sleep(gap)
+                    word = " " + word
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=600.0, help="total reply time")
+    parser.add_argument("--ttft-ms", type=float, default=150.0, help="time to first token of streamed replies")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="random +/- added to each delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 500")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share of requests that never answer")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests delayed by --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=5000.0, help="extra delay for slow requests")
+    parser.add_argument("--seed", type=int, default=1, help="seed for fault injection")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    faults = {name: getattr(args, name) for name in FAULT_FIELDS}
+    uvicorn.run(create_app(faults, args.seed), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
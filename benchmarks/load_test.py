@@ -0,0 +1,480 @@
+"""
+Load test for the KrishiMitra API.
+
+Drives the FastAPI app with a fixed number of concurrent clients for a fixed
+duration per endpoint, using a multilingual mix of farming questions, and
+reports p50/p95/p99 latency and requests per second for each endpoint.
+
+The LLM and gTTS are replaced with local fakes with configurable latency, so
+the test runs without network access; speech-to-text uses the simulated
+backend. By default the app runs in-process behind httpx's ASGI transport.
+With --mode uvicorn the app is served by a local uvicorn subprocess (with the
+same fakes), which also makes time to first byte meaningful for the streaming
+endpoints. --url points the test at an already running server instead.
+
+Results are saved as JSON and compared with the baseline committed as
+benchmarks/baseline.json (or --baseline): the run fails (exit code 1) if
+p50 or p95 latency rose, or requests per second fell, by more than
+--max-regression percent for any endpoint. Simulated replies are the
+offline answers the questions would get, in their own language. The speech
+and answer caches a run creates are removed when it ends.
+
+Usage:
+    python benchmarks/load_test.py [--endpoints ask,voice-ask] [--concurrency 16]
+        [--duration 10] [--warmup 2] [--llm-latency-ms 600] [--llm-ttft-ms 150]
+        [--tts-latency-ms 300] [--llm-url http://127.0.0.1:8100/v1] [--repeat-ratio 0.5] [--mode inprocess|uvicorn]
+        [--url http://127.0.0.1:8000] [--output benchmarks/results/load_test.json]
+        [--baseline benchmarks/baseline.json] [--max-regression 10]
+        [--save-baseline benchmarks/baseline.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+from agri_prompt import parse_prompt
+
+# Baseline compared against unless --baseline says otherwise
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# Questions sent during the test, as (language, question) pairs
+QUESTION_MIX = [
+    ("English", "How do I grow rice in clay soil?"),
+    ("English", "What is the best natural pest control for tomatoes?"),
+    ("English", "Which organic fertilizer should I use for wheat?"),
+    ("English", "How much water does sugarcane need in summer?"),
+    ("Hindi", "धान की खेती कैसे करें?"),
+    ("Hindi", "गेहूं में कीट नियंत्रण के लिए क्या करें?"),
+    ("Hindi", "जैविक खाद कैसे बनाएं?"),
+    ("Tamil", "நெல் சாகுபடி செய்வது எப்படி?"),
+    ("Tamil", "பூச்சி கட்டுப்பாட்டிற்கு என்ன செய்ய வேண்டும்?"),
+    ("Telugu", "వరి పంటకు ఎంత నీరు అవసరం?"),
+    ("Bengali", "ধান চাষের জন্য কোন সার ভালো?"),
+    ("Marathi", "कापसावरील कीड कशी नियंत्रित करावी?"),
+    ("Punjabi", "ਕਣਕ ਦੀ ਬਿਜਾਈ ਕਦੋਂ ਕਰਨੀ ਚਾਹੀਦੀ ਹੈ?"),
+    ("Kannada", "ಮಣ್ಣಿನ ಫಲವತ್ತತೆ ಹೆಚ್ಚಿಸುವುದು ಹೇಗೆ?"),
+]
+
+ENDPOINTS = ("ask", "ask-stream", "voice-ask", "voice-ask-stream")
+
+# Metrics compared against the baseline, and whether higher is better
+COMPARED_METRICS = (("p50_ms", False), ("p95_ms", False), ("rps", True))
+
+
+def silent_wav(seconds=1.0, rate=16000):
+    """Return a mono 16-bit PCM WAV file of silence, used as the voice upload."""
+    data = b"\0\0" * int(rate * seconds)
+    fmt = struct.pack("<HHIIHH", 1, 1, rate, rate * 2, 2, 16)
+    return (b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE"
+            + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+            + b"data" + struct.pack("<I", len(data)) + data)
+
+
+class FakeStream:
+    """Async iterator of chat completion chunks, mimicking the OpenAI client."""
+
+    def __init__(self, text, ttft, latency):
+        self.words = text.split(" ")
+        self.ttft = ttft
+        self.gap = max(0.0, latency - ttft) / max(1, len(self.words) - 1)
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.ttft)
+        for index, word in enumerate(self.words):
+            if index:
+                await asyncio.sleep(self.gap)
+                word = " " + word
+            delta = SimpleNamespace(content=word)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    async def close(self):
+        pass
+
+
+class FakeCompletions:
+    """Stand-in for client.chat.completions that answers from local_response."""
+
+    def __init__(self, latency, ttft):
+        self.latency = latency
+        self.ttft = ttft
+
+    async def create(self, model, messages, stream=False):
+        import ai_agent
+
+        # Give the answer the question would get offline, in its language
+        text = ai_agent.local_response(*parse_prompt(messages[-1]["content"]))
+        if stream:
+            return FakeStream(text, self.ttft, self.latency)
+        await asyncio.sleep(self.latency)
+        message = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def run_state_paths(pid=None):
+    """Return the speech cache directory and answer cache file of a process (default: this one)."""
+    prefix = os.path.join(os.environ.get("TMPDIR", "/tmp"), f"krishimitra_load_test_{pid or os.getpid()}")
+    return prefix, prefix + "_answers.sqlite3"
+
+
+def remove_run_state(pid=None):
+    """Delete the speech and answer caches install_fakes set up in a process (default: this one)."""
+    tts_dir, answer_db = run_state_paths(pid)
+    shutil.rmtree(tts_dir, ignore_errors=True)
+    for path in (answer_db, answer_db + "-wal", answer_db + "-shm"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+
+def install_fakes(llm_latency, llm_ttft, tts_latency, llm_url=None):
+    """
+    Replace the OpenAI client and gTTS with local fakes and import the app.
+
+    With `llm_url`, the model is instead reached over HTTP at that
+    OpenAI-compatible URL, e.g. benchmarks/fake_openai_server.py.
+
+    Must run before main is imported by anything else, since the backends are
+    chosen from the environment at import time.
+
+    Returns:
+        FastAPI: The app
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+    os.environ["KRISHIMITRA_LLM_BACKEND"] = "openai"
+    os.environ["KRISHIMITRA_ASR_BACKEND"] = "simulated"
+    if llm_url:
+        os.environ["KRISHIMITRA_LLM_BASE_URL"] = llm_url
+    # Keep per-request log lines out of the report
+    os.environ.setdefault("KRISHIMITRA_LOG_LEVEL", "WARNING")
+    # Start every run with empty speech and answer caches
+    tts_dir, answer_db = run_state_paths()
+    os.environ["KRISHIMITRA_TTS_CACHE_DIR"] = tts_dir
+    os.environ["KRISHIMITRA_ANSWER_CACHE_DB"] = answer_db
+
+    import ai_agent
+    import voice_output
+    from main import app
+
+    sample = os.path.join(ROOT, "response.mp3")
+    payload = open(sample, "rb").read()[:32 * 1024] if os.path.exists(sample) else b"\xff\xfb" * 4096
+
+    class FakeTTS:
+        def __init__(self, text, lang="en", slow=False):
+            self.text = text
+
+        def save(self, path):
+            time.sleep(tts_latency)
+            with open(path, "wb") as f:
+                f.write(payload)
+
+    if not llm_url:
+        ai_agent.client.completions = FakeCompletions(llm_latency, llm_ttft)
+    voice_output.gTTS = FakeTTS
+    return app
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))]
+
+
+def summarize(samples, elapsed):
+    """
+    Summarize one endpoint's samples.
+
+    Args:
+        samples (list): (status, latency, ttfb) tuples
+        elapsed (float): Wall-clock seconds the endpoint was driven for
+
+    Returns:
+        dict: Request counts, status codes, requests per second and latency in ms
+    """
+    statuses = {}
+    for status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sorted(latency for status, latency, _ in samples if status == 200)
+    ttfb = sorted(first for status, _, first in samples if status == 200)
+    ms = lambda seconds: round(seconds * 1000, 2)
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": len(samples) - len(ok),
+        "status": statuses,
+        "rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": ms(sum(ok) / len(ok)) if ok else 0.0,
+        "p50_ms": ms(percentile(ok, 0.50)),
+        "p95_ms": ms(percentile(ok, 0.95)),
+        "p99_ms": ms(percentile(ok, 0.99)),
+        "max_ms": ms(ok[-1]) if ok else 0.0,
+        "ttfb_p50_ms": ms(percentile(ttfb, 0.50)),
+        "ttfb_p95_ms": ms(percentile(ttfb, 0.95)),
+    }
+
+
+async def send(client, endpoint, language, question, upload):
+    """
+    Send one request and read the whole response.
+
+    Returns:
+        tuple: (status, latency, time to first byte) in seconds
+    """
+    if endpoint in ("ask", "ask-stream"):
+        path = "/ask" if endpoint == "ask" else "/ask/stream"
+        kwargs = {"json": {"question": question, "language": language}}
+    else:
+        path = "/voice-ask/" if endpoint == "voice-ask" else "/voice-ask/stream"
+        kwargs = {"files": {"audio": ("question.wav", upload, "audio/wav")}, "data": {"language": language}}
+
+    started = time.perf_counter()
+    ttfb = None
+    async with client.stream("POST", path, **kwargs) as response:
+        async for _ in response.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - started
+    latency = time.perf_counter() - started
+    return response.status_code, latency, ttfb if ttfb is not None else latency
+
+
+async def drive(client, endpoint, concurrency, duration, repeat_ratio, seed, upload):
+    """
+    Run `concurrency` closed-loop clients against one endpoint for `duration` seconds.
+
+    Returns:
+        tuple: (samples, elapsed seconds)
+    """
+    deadline = time.perf_counter() + duration
+    samples = []
+
+    async def client_loop(worker):
+        rng = random.Random(seed * 1000 + worker)
+        count = 0
+        while time.perf_counter() < deadline:
+            language, question = rng.choice(QUESTION_MIX)
+            if rng.random() >= repeat_ratio:
+                # A unique suffix makes the answer cache miss
+                count += 1
+                question = f"{question} {worker}-{count}"
+            sent = time.perf_counter()
+            try:
+                samples.append(await send(client, endpoint, language, question, upload))
+            except httpx.HTTPError as e:
+                samples.append((type(e).__name__, time.perf_counter() - sent, None))
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client_loop(worker) for worker in range(concurrency)])
+    return samples, time.perf_counter() - started
+
+
+async def run_load(args, client):
+    """Warm up and drive each endpoint in turn, returning per-endpoint results."""
+    upload = silent_wav()
+    results = {}
+    for endpoint in args.endpoints:
+        if args.warmup:
+            await drive(client, endpoint, args.concurrency, args.warmup, args.repeat_ratio, args.seed + 1, upload)
+        samples, elapsed = await drive(client, endpoint, args.concurrency, args.duration,
+                                       args.repeat_ratio, args.seed, upload)
+        results[endpoint] = summarize(samples, elapsed)
+    return results
+
+
+@contextlib.contextmanager
+def uvicorn_server(args):
+    """Serve the app with fakes installed from a uvicorn subprocess."""
+    port = args.port
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--llm-ttft-ms", str(args.llm_ttft_ms),
+        "--tts-latency-ms", str(args.tts_latency_ms),
+    ]
+    if args.llm_url:
+        command += ["--llm-url", args.llm_url]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        # Wait for the server to accept requests
+        for _ in range(300):
+            if process.poll() is not None:
+                raise SystemExit(f"uvicorn exited with code {process.returncode}")
+            try:
+                httpx.get(url + "/", timeout=1.0)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        else:
+            raise SystemExit("uvicorn did not start within 30 seconds")
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        # uvicorn re-raises the signal once it has shut down, so the server
+        # cannot be relied on to clean up after itself
+        remove_run_state(process.pid)
+
+
+def serve(args):
+    """Run the app under uvicorn with the fakes installed (used by --mode uvicorn)."""
+    import uvicorn
+
+    app = install_fakes(args.llm_latency_ms / 1000, args.llm_ttft_ms / 1000, args.tts_latency_ms / 1000,
+                        args.llm_url)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def compare(results, baseline, max_regression):
+    """
+    Compare results with a baseline run.
+
+    Returns:
+        list[str]: One message per metric that regressed by more than
+            `max_regression` percent
+    """
+    failures = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = previous.get(metric, 0.0), current.get(metric, 0.0)
+            if not before:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            if worse > max_regression:
+                failures.append(f"{endpoint} {metric}: {before} -> {after} ({change:+.1f}%)")
+    return failures
+
+
+def format_row(endpoint, result):
+    return (f"{endpoint:<18} {result['requests']:>7} {result['errors']:>6} {result['rps']:>9.1f} "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+            f"{result['ttfb_p50_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="ask,voice-ask",
+                        help=f"comma-separated endpoints to drive: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per endpoint")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds each endpoint is driven for")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each endpoint")
+    parser.add_argument("--llm-latency-ms", type=float, default=600.0, help="fake LLM total reply time")
+    parser.add_argument("--llm-ttft-ms", type=float, default=150.0, help="fake LLM time to first token")
+    parser.add_argument("--llm-url", help="reach the model at this OpenAI-compatible URL instead of the "
+                        "in-process fake, e.g. http://127.0.0.1:8100/v1 for fake_openai_server.py")
+    parser.add_argument("--tts-latency-ms", type=float, default=300.0, help="fake gTTS time per synthesis")
+    parser.add_argument("--repeat-ratio", type=float, default=0.5,
+                        help="share of questions repeated verbatim from the mix (answer cache hits)")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the question sequence")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess",
+                        help="run the app in-process or in a local uvicorn subprocess")
+    parser.add_argument("--url", help="drive an already running server instead (no fakes installed)")
+    parser.add_argument("--port", type=int, default=8765, help="port for --mode uvicorn")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "load_test.json"),
+                        help="where to save the results as JSON")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="results file to compare against, if it exists; empty to skip the comparison")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="percent change against the baseline that fails the run")
+    parser.add_argument("--save-baseline", help="also save the results to this baseline file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    args.endpoints = [endpoint.strip() for endpoint in args.endpoints.split(",") if endpoint.strip()]
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    async def run_inprocess():
+        app = install_fakes(args.llm_latency_ms / 1000, args.llm_ttft_ms / 1000, args.tts_latency_ms / 1000,
+                            args.llm_url)
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+                return await run_load(args, client)
+        finally:
+            remove_run_state()
+
+    async def run_http(url):
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+            return await run_load(args, client)
+
+    if args.url:
+        mode = "url"
+        endpoints = asyncio.run(run_http(args.url))
+    elif args.mode == "uvicorn":
+        mode = "uvicorn"
+        with uvicorn_server(args) as url:
+            endpoints = asyncio.run(run_http(url))
+    else:
+        mode = "inprocess"
+        endpoints = asyncio.run(run_inprocess())
+
+    print(f"{'endpoint':<18} {'requests':>7} {'errors':>6} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb p50':>9}")
+    for endpoint, result in endpoints.items():
+        print(format_row(endpoint, result))
+
+    results = {
+        "config": {
+            "mode": mode,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_ttft_ms": args.llm_ttft_ms,
+            "llm_url": args.llm_url,
+            "tts_latency_ms": args.tts_latency_ms,
+            "repeat_ratio": args.repeat_ratio,
+            "seed": args.seed,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "endpoints": endpoints,
+    }
+
+    # Read the baseline first, since --save-baseline may overwrite it
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {path}")
+
+    if baseline is not None:
+        if baseline.get("config") != results["config"]:
+            print("Warning: baseline was recorded with a different configuration")
+        failures = compare(results, baseline, args.max_regression)
+        if failures:
+            print(f"Regressions beyond {args.max_regression:g}%:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.max_regression:g}% against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
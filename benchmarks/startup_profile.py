@@ -0,0 +1,198 @@
+"""
+Cold-start profile for the KrishiMitra API, with a budget check.
+
+Measures, each in a fresh interpreter:
+
+- `import main` under `python -X importtime`: total import time, the
+  packages and project modules that cost the most, and whether any module
+  that should load lazily (the OpenAI SDK, gTTS, Whisper, ...) was pulled
+  in by the import;
+- time from launching `python main.py` to the first successful POST /ask,
+  and to GET /ready returning 200.
+
+Imports are profiled --runs times and the fastest run is reported, since
+the first run also pays for a cold filesystem cache. The server runs with
+the local answer backend and simulated speech-to-text unless the
+environment says otherwise, so no network access is needed.
+
+With --budget, the run fails (exit code 1) if import time or time to first
+request exceeds the budget, or a lazy module is imported by `import main`.
+
+Usage:
+    python benchmarks/startup_profile.py [--runs 3] [--top 12] [--port 8766]
+        [--budget benchmarks/startup_budget.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+
+def server_env():
+    """Environment for the profiled processes: offline backends unless set otherwise."""
+    env = dict(os.environ)
+    env.setdefault("KRISHIMITRA_LLM_BACKEND", "local")
+    env.setdefault("KRISHIMITRA_ASR_BACKEND", "simulated")
+    env.setdefault("KRISHIMITRA_LOG_LEVEL", "WARNING")
+    env.setdefault("KRISHIMITRA_ANSWER_CACHE_DB", os.path.join(
+        tempfile.gettempdir(), f"krishimitra_startup_{os.getpid()}.sqlite3"))
+    return env
+
+
+def project_modules():
+    """Names of the modules in the repository root."""
+    return {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+
+def profile_imports():
+    """
+    Import main in a fresh interpreter under -X importtime.
+
+    Returns:
+        list: (name, self_us, cumulative_us, depth) for each imported module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=server_env(), capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise SystemExit(f"import main failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def summarize_imports(modules, top):
+    """
+    Summarize one import profile.
+
+    Returns:
+        dict: Total time, heaviest packages by self time and project modules
+            by cumulative time, in milliseconds, plus the set of module names
+    """
+    total = next(cumulative for name, _, cumulative, _ in modules if name == "main")
+    packages = {}
+    for name, self_us, _, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    local = project_modules()
+    ms = lambda us: round(us / 1000, 1)
+    return {
+        "import_ms": ms(total),
+        "packages": sorted(((name, ms(us)) for name, us in packages.items()), key=lambda item: -item[1])[:top],
+        "project": sorted(((name, ms(cumulative)) for name, _, cumulative, _ in modules if name in local),
+                          key=lambda item: -item[1]),
+        "modules": {name for name, _, _, _ in modules},
+    }
+
+
+def time_to_first_request(port, timeout=120.0):
+    """
+    Launch the server and time its first successful /ask and /ready.
+
+    Returns:
+        dict: Milliseconds from launch to the first 200 from POST /ask and
+            from GET /ready (None if it never became ready)
+    """
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "main.py"), "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env=server_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    first_request = ready = None
+    try:
+        with httpx.Client(base_url=url, timeout=5.0) as client:
+            while time.perf_counter() - started < timeout and (first_request is None or ready is None):
+                if process.poll() is not None:
+                    raise SystemExit(f"server exited with code {process.returncode}")
+                try:
+                    if first_request is None:
+                        response = client.post("/ask", json={"question": "How do I grow rice?"})
+                        if response.status_code == 200:
+                            first_request = time.perf_counter() - started
+                    if ready is None and client.get("/ready").status_code == 200:
+                        ready = time.perf_counter() - started
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    if first_request is None:
+        raise SystemExit(f"no successful request within {timeout:.0f}s")
+    return {
+        "first_request_ms": round(first_request * 1000, 1),
+        "ready_ms": round(ready * 1000, 1) if ready is not None else None,
+    }
+
+
+def check_budget(budget, imports, startup):
+    """
+    Compare a profile against the budget.
+
+    Returns:
+        list[str]: One message per exceeded limit
+    """
+    failures = []
+    if imports["import_ms"] > budget.get("import_ms", float("inf")):
+        failures.append(f"import main took {imports['import_ms']} ms (budget {budget['import_ms']} ms)")
+    if startup["first_request_ms"] > budget.get("first_request_ms", float("inf")):
+        failures.append(f"first request after {startup['first_request_ms']} ms "
+                        f"(budget {budget['first_request_ms']} ms)")
+    for name in budget.get("lazy_modules", []):
+        if name in imports["modules"]:
+            failures.append(f"import main loads {name}, which should load lazily")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="import profiles taken; the fastest is reported")
+    parser.add_argument("--top", type=int, default=12, help="packages listed by import time")
+    parser.add_argument("--port", type=int, default=8766, help="port for the server launch")
+    parser.add_argument("--budget", help="JSON budget file; exceeding it exits with code 1")
+    args = parser.parse_args()
+
+    imports = min((summarize_imports(profile_imports(), args.top) for _ in range(args.runs)),
+                  key=lambda summary: summary["import_ms"])
+    startup = time_to_first_request(args.port)
+
+    print(f"import main: {imports['import_ms']:.1f} ms (fastest of {args.runs})")
+    print("\nheaviest packages (self time, ms):")
+    for name, ms in imports["packages"]:
+        print(f"  {name:<28} {ms:>8.1f}")
+    print("\nproject modules (cumulative, ms):")
+    for name, ms in imports["project"]:
+        print(f"  {name:<28} {ms:>8.1f}")
+    ready = f"{startup['ready_ms']:.1f} ms" if startup["ready_ms"] is not None else "never"
+    print(f"\nlaunch to first successful /ask: {startup['first_request_ms']:.1f} ms; to /ready 200: {ready}")
+
+    if args.budget:
+        with open(args.budget, encoding="utf-8") as f:
+            budget = json.load(f)
+        failures = check_budget(budget, imports, startup)
+        if failures:
+            print("\nStartup budget exceeded:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("\nWithin the startup budget")
+
+
+if __name__ == "__main__":
+    main()
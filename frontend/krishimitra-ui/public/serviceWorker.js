@@ -12,6 +12,51 @@ const urlsToCache = [
   '/pwa-512x512.png'
 ];
 
+// Offline answer pack: prebuilt answers with their audio, kept in a cache of
+// its own and refreshed with a conditional request on every page load
+const PACK_CACHE = 'krishimitra-answer-pack';
+const PACK_URL = 'http://localhost:8000/pack/';
+const PACK_FORMAT = 'mp3-low';
+
+async function syncAnswerPack() {
+  const cache = await caches.open(PACK_CACHE);
+  const manifestUrl = PACK_URL + 'manifest.json';
+  const cached = await cache.match(manifestUrl);
+  const etag = cached && cached.headers.get('ETag');
+  const response = await fetch(manifestUrl, {
+    cache: 'no-store',
+    headers: etag ? { 'If-None-Match': etag } : {}
+  });
+  // 304: the cached pack is current
+  if (!response.ok) {
+    return;
+  }
+
+  const manifest = await response.clone().json();
+  const urls = new Set();
+  manifest.answers.forEach(answer => {
+    const audio = answer.audio[PACK_FORMAT];
+    if (audio) {
+      urls.add(PACK_URL + audio.url);
+    }
+  });
+
+  // Audio files are named after their content, so only new ones are fetched
+  const missing = [];
+  for (const url of urls) {
+    if (!(await cache.match(url))) {
+      missing.push(url);
+    }
+  }
+  await cache.addAll(missing);
+  for (const request of await cache.keys()) {
+    if (request.url !== manifestUrl && !urls.has(request.url)) {
+      await cache.delete(request);
+    }
+  }
+  await cache.put(manifestUrl, response);
+}
+
 // Install event - cache assets
 self.addEventListener('install', event => {
   event.waitUntil(
@@ -20,12 +65,13 @@ self.addEventListener('install', event => {
         console.log('Opened cache');
         return cache.addAll(urlsToCache);
       })
+      .then(() => syncAnswerPack().catch(error => console.log('Answer pack not synced: ', error)))
   );
 });
 
 // Activate event - clean up old caches
 self.addEventListener('activate', event => {
-  const cacheWhitelist = [CACHE_NAME];
+  const cacheWhitelist = [CACHE_NAME, PACK_CACHE];
   event.waitUntil(
     caches.keys().then(cacheNames => {
       return Promise.all(
@@ -41,6 +87,21 @@ self.addEventListener('activate', event => {
 
 // Fetch event - serve from cache if available, otherwise fetch from network
 self.addEventListener('fetch', event => {
+  // Answer pack files come from the pack cache, falling back to the network
+  if (event.request.url.startsWith(PACK_URL)) {
+    event.respondWith(
+      caches.open(PACK_CACHE)
+        .then(cache => cache.match(event.request))
+        .then(response => response || fetch(event.request))
+    );
+    return;
+  }
+
+  // Check for a newer answer pack whenever the app is opened
+  if (event.request.mode === 'navigate') {
+    event.waitUntil(syncAnswerPack().catch(() => {}));
+  }
+
   // Skip cross-origin requests
   if (!event.request.url.startsWith(self.location.origin)) {
     return;
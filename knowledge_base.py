@@ -0,0 +1,396 @@
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter, namedtuple
+import numpy as np
+from response_cache import normalize_question
+from text_matcher import TOPIC_KEYWORDS
+
+# Entries live in a JSON Lines file, one passage per line with an id, topic,
+# language and text. `python knowledge_base.py build` compiles them into a
+# binary index that is memory-mapped, so lookups only touch the postings
+# they need and the index stays cheap with tens of thousands of entries.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+KB_ENTRIES = os.getenv("KRISHIMITRA_KB_ENTRIES", os.path.join(ROOT, "knowledge", "entries.jsonl"))
+KB_INDEX = os.getenv("KRISHIMITRA_KB_INDEX", os.path.join(ROOT, "knowledge", "index.bin"))
+KB_TOP_K = int(os.getenv("KRISHIMITRA_KB_TOP_K", "3"))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Indic words take many suffixes (நெல் / நெல்லுக்கு), so longer non-Latin
+# tokens are also indexed under their first few characters
+STEM_CHARS = 4
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or should "
+    "that the this to what when which with you your "
+    "का की के को में से पर है हैं और क्या कैसे मैं मेरे लिए".split()
+)
+
+_MAGIC = b"KMKB"
+_VERSION = 1
+# magic, version, reserved, docs, terms, table slots, postings,
+# then offsets of the table, doc ids, impacts, doc languages, record offsets,
+# records and metadata, and the metadata length
+_HEADER = struct.Struct("<4sHHIIII8Q")
+_SLOT = struct.Struct("<QII")
+
+Passage = namedtuple("Passage", ["id", "topic", "language", "text", "score"])
+
+
+def tokenize(text):
+    """
+    Split text into index terms.
+
+    Applies the answer cache's normalization (case folding, NFC, punctuation
+    removed), drops stopwords, folds the Devanagari chandrabindu into the
+    anusvara and strips a plural "s" from Latin words. Non-Latin words longer
+    than STEM_CHARS also yield their prefix.
+
+    Args:
+        text (str): Question or passage text
+
+    Returns:
+        list[str]: Terms, with repeats
+    """
+    terms = []
+    for token in normalize_question(text).replace("ँ", "ं").split():
+        if token in STOPWORDS:
+            continue
+        if token.isascii():
+            if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+                token = token[:-1]
+            terms.append(token)
+        else:
+            terms.append(token)
+            if len(token) > STEM_CHARS:
+                terms.append(token[:STEM_CHARS])
+    return terms
+
+
+def term_hash(term):
+    """Stable 64-bit hash of a term; never 0, which marks an empty slot."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+
+def load_entries(path=KB_ENTRIES):
+    """
+    Read knowledge base entries from a JSON Lines file.
+
+    Args:
+        path (str): Path to the entries file
+
+    Returns:
+        list[dict]: Entries with id, topic, language and text
+    """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            missing = {"id", "topic", "language", "text"} - entry.keys()
+            if missing:
+                raise ValueError(f"{path}:{line_number}: missing {', '.join(sorted(missing))}")
+            entries.append(entry)
+    return entries
+
+
+def build_index(entries, path=KB_INDEX):
+    """
+    Build the BM25 index for a list of entries and write it to disk.
+
+    Each entry is indexed on its text plus the keywords of its topic, so a
+    question naming the topic in any supported language finds it. The file
+    is written to a temporary name and renamed into place, so running
+    servers never map a partial index.
+
+    Args:
+        entries (list[dict]): Entries with id, topic, language and text
+        path (str): Where to write the index
+
+    Returns:
+        dict: Document, term and posting counts
+    """
+    languages = sorted({entry["language"] for entry in entries})
+    language_ids = {language: index for index, language in enumerate(languages)}
+
+    doc_terms = []
+    for entry in entries:
+        keywords = " ".join(TOPIC_KEYWORDS.get(entry["topic"], []))
+        doc_terms.append(Counter(tokenize(entry["text"] + " " + keywords)))
+    lengths = [sum(counts.values()) for counts in doc_terms]
+    avgdl = sum(lengths) / len(lengths) if lengths else 1.0
+
+    postings = {}
+    for doc_id, counts in enumerate(doc_terms):
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    # Precompute each posting's BM25 contribution so lookups only add floats
+    n_docs = len(entries)
+    slots = 1 << max(4, math.ceil(math.log2(max(1, len(postings)) * 2)))
+    table = bytearray(slots * _SLOT.size)
+    doc_ids = []
+    impacts = []
+    for term, docs in postings.items():
+        idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        scored = [(idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[doc] / avgdl)), doc) for doc, tf in docs]
+        h = term_hash(term)
+        slot = h & (slots - 1)
+        while _SLOT.unpack_from(table, slot * _SLOT.size)[0]:
+            slot = (slot + 1) & (slots - 1)
+        _SLOT.pack_into(table, slot * _SLOT.size, h, len(doc_ids), len(scored))
+        for impact, doc in scored:
+            doc_ids.append(doc)
+            impacts.append(impact)
+
+    records = [json.dumps(entry, ensure_ascii=False).encode("utf-8") for entry in entries]
+    record_offsets = [0]
+    for record in records:
+        record_offsets.append(record_offsets[-1] + len(record))
+
+    topics = {}
+    for doc_id, entry in enumerate(entries):
+        topics.setdefault(entry["topic"], {}).setdefault(entry["language"], doc_id)
+    meta = json.dumps({
+        "languages": languages,
+        "topics": topics,
+        "avgdl": avgdl,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }, ensure_ascii=False).encode("utf-8")
+
+    sections = [
+        bytes(table),
+        struct.pack(f"<{len(doc_ids)}I", *doc_ids),
+        struct.pack(f"<{len(impacts)}f", *impacts),
+        bytes(language_ids[entry["language"]] for entry in entries),
+        struct.pack(f"<{len(record_offsets)}Q", *record_offsets),
+        b"".join(records),
+        meta,
+    ]
+    offsets = []
+    position = _HEADER.size
+    for section in sections:
+        # Align sections to 8 bytes for the typed views
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, n_docs, len(postings), slots, len(doc_ids), *offsets, len(meta)))
+        for offset, section in zip(offsets, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(section)
+    os.replace(tmp_path, path)
+    return {"docs": n_docs, "terms": len(postings), "postings": len(doc_ids), "bytes": position}
+
+
+class KnowledgeBase:
+    """
+    Read-only view of a memory-mapped knowledge base index.
+
+    Postings and per-document data are numpy views straight onto the mapped
+    file, so nothing is copied into memory when the index is opened.
+    """
+
+    def __init__(self, path=KB_INDEX):
+        """
+        Args:
+            path (str): Path to an index written by build_index
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self.n_docs, self.n_terms, self._slots, n_postings,
+         self._table_at, docs_at, impacts_at, langs_at, offsets_at, self._records_at,
+         meta_at, meta_len) = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC or version != _VERSION:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a version {_VERSION} knowledge base index")
+
+        self._doc_ids = np.frombuffer(self._mmap, dtype="<u4", count=n_postings, offset=docs_at)
+        self._impacts = np.frombuffer(self._mmap, dtype="<f4", count=n_postings, offset=impacts_at)
+        self._doc_languages = np.frombuffer(self._mmap, dtype=np.uint8, count=self.n_docs, offset=langs_at)
+        self._record_offsets = np.frombuffer(self._mmap, dtype="<u8", count=self.n_docs + 1, offset=offsets_at)
+        meta = json.loads(self._mmap[meta_at:meta_at + meta_len].decode("utf-8"))
+        self.languages = meta["languages"]
+        self.topics = meta["topics"]
+        self._language_ids = {language: index for index, language in enumerate(self.languages)}
+        self._language_masks = {}
+
+    def search(self, query, k=KB_TOP_K, language=None):
+        """
+        Return the passages that best match a query.
+
+        Args:
+            query (str): The farmer's question
+            k (int): Number of passages to return
+            language (str): Only return passages in this language
+
+        Returns:
+            list[Passage]: Up to k passages, best first
+        """
+        wanted = self._language_ids.get(language) if language else None
+        if language and wanted is None:
+            return []
+
+        postings = [self._lookup(term) for term in set(tokenize(query))]
+        postings = [(start, count) for start, count in postings if count]
+        if not postings:
+            return []
+
+        # Doc ids are unique within a term's postings, so fancy-indexed adds are safe
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for start, count in postings:
+            scores[self._doc_ids[start:start + count]] += self._impacts[start:start + count]
+        if wanted is not None:
+            scores *= self._language_mask(wanted)
+
+        # Rank only the documents that matched; partitioning the whole array is slow
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        best = candidates[np.argsort(scores[candidates])[::-1]]
+        return [self._passage(int(doc), float(scores[doc])) for doc in best]
+
+    def topic_passage(self, topic, language):
+        """
+        Return the entry for a topic in a language.
+
+        Args:
+            topic (str): Topic name, such as "wheat" or "default"
+            language (str): The language of the entry
+
+        Returns:
+            Passage | None: The entry, or None if there is none
+        """
+        doc = self.topics.get(topic, {}).get(language)
+        return None if doc is None else self._passage(doc, 0.0)
+
+    def close(self):
+        """Unmap the index."""
+        # The numpy views must go before the map can be closed
+        self._doc_ids = self._impacts = self._doc_languages = self._record_offsets = None
+        self._language_masks.clear()
+        self._mmap.close()
+
+    def _lookup(self, term):
+        """Return the start and length of a term's postings."""
+        h = term_hash(term)
+        mask = self._slots - 1
+        slot = h & mask
+        while True:
+            stored, start, count = _SLOT.unpack_from(self._mmap, self._table_at + slot * _SLOT.size)
+            if stored == h:
+                return start, count
+            if not stored:
+                return 0, 0
+            slot = (slot + 1) & mask
+
+    def _language_mask(self, language_id):
+        mask = self._language_masks.get(language_id)
+        if mask is None:
+            mask = self._language_masks[language_id] = (self._doc_languages == language_id).astype(np.float32)
+        return mask
+
+    def _passage(self, doc, score):
+        start = self._records_at + int(self._record_offsets[doc])
+        end = self._records_at + int(self._record_offsets[doc + 1])
+        entry = json.loads(self._mmap[start:end].decode("utf-8"))
+        return Passage(entry["id"], entry["topic"], entry["language"], entry["text"], round(score, 4))
+
+
+_knowledge_base = None
+_load_lock = threading.Lock()
+
+
+def get_knowledge_base():
+    """
+    Return the shared knowledge base, loading it on first use.
+
+    The index is rebuilt first if it is missing or older than the entries file.
+
+    Returns:
+        KnowledgeBase: The loaded knowledge base
+    """
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _load_lock:
+            if _knowledge_base is None:
+                if not os.path.exists(KB_INDEX) or os.path.getmtime(KB_INDEX) < os.path.getmtime(KB_ENTRIES):
+                    build_index(load_entries(KB_ENTRIES), KB_INDEX)
+                _knowledge_base = KnowledgeBase(KB_INDEX)
+    return _knowledge_base
+
+
+def search_knowledge(question, language="English", k=KB_TOP_K):
+    """
+    Find passages relevant to a question, in the requested language when the
+    knowledge base has any, otherwise in English.
+
+    Args:
+        question (str): The farmer's question
+        language (str): The language to respond in
+        k (int): Number of passages to return
+
+    Returns:
+        list[Passage]: Up to k passages, best first
+    """
+    knowledge_base = get_knowledge_base()
+    passages = knowledge_base.search(question, k, language)
+    if not passages and language != "English":
+        passages = knowledge_base.search(question, k, "English")
+    return passages
+
+
+def default_passage(language="English"):
+    """
+    Return the general farming advice entry, used when nothing matches.
+
+    Args:
+        language (str): The language to respond in
+
+    Returns:
+        Passage | None: The entry in that language, or in English
+    """
+    knowledge_base = get_knowledge_base()
+    return knowledge_base.topic_passage("default", language) or knowledge_base.topic_passage("default", "English")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the KrishiMitra knowledge base index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile the entries file into an index")
+    build.add_argument("--entries", default=KB_ENTRIES, help="JSON Lines file of entries")
+    build.add_argument("--output", default=KB_INDEX, help="where to write the index")
+    search = commands.add_parser("search", help="print the best passages for a question")
+    search.add_argument("question")
+    search.add_argument("--language", help="only return passages in this language")
+    search.add_argument("-k", type=int, default=KB_TOP_K, help="number of passages")
+    search.add_argument("--index", default=KB_INDEX, help="index to search")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        stats = build_index(load_entries(args.entries), args.output)
+        print(f"Indexed {stats['docs']} entries, {stats['terms']} terms and {stats['postings']} postings "
+              f"into {args.output} ({stats['bytes']} bytes) in {time.perf_counter() - started:.2f}s")
+    else:
+        knowledge_base = KnowledgeBase(args.index)
+        for passage in knowledge_base.search(args.question, args.k, args.language):
+            print(f"{passage.score:8.3f}  {passage.id:<16} {passage.text[:100]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# OpenAI-compatible endpoint; unset means api.openai.com
+LLM_BASE_URL = os.getenv("KRISHIMITRA_LLM_BASE_URL") or None
+
+# Connection pool shared by every request to the model
+LLM_MAX_CONNECTIONS = int(os.getenv("KRISHIMITRA_LLM_MAX_CONNECTIONS", "32"))
+
+# Seconds a request may take before the local answer is used instead; for
+# streamed replies this bounds the time to the first token
+LLM_DEADLINE = float(os.getenv("KRISHIMITRA_LLM_DEADLINE", "15"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("KRISHIMITRA_LLM_CONNECT_TIMEOUT", "3"))
+
+# Send a second, identical request when the first has not answered within
+# this many milliseconds; 0 disables hedging
+LLM_HEDGE_MS = float(os.getenv("KRISHIMITRA_LLM_HEDGE_MS", "0"))
+
+# Circuit breaker: open once the error rate over the last calls crosses the
+# threshold, then probe the upstream again after the cooldown
+BREAKER_WINDOW = int(os.getenv("KRISHIMITRA_LLM_BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("KRISHIMITRA_LLM_BREAKER_MIN_CALLS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("KRISHIMITRA_LLM_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("KRISHIMITRA_LLM_BREAKER_COOLDOWN", "30"))
+
+
+class LLMUnavailable(Exception):
+    """Raised when the model cannot answer in time and the caller should answer locally."""
+
+    def __init__(self, reason):
+        super().__init__(f"LLM unavailable: {reason}")
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Tracks upstream failures and stops sending requests while they persist.
+
+    The breaker is closed while the error rate over the last `window` calls
+    stays below the threshold. Once it is crossed, the breaker opens and
+    every call is refused for `cooldown` seconds. After that a single probe
+    is let through (half-open): success closes the breaker, failure opens it
+    again.
+    """
+
+    def __init__(self, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+                 error_rate=BREAKER_ERROR_RATE, cooldown=BREAKER_COOLDOWN):
+        """
+        Args:
+            window (int): Number of recent calls the error rate is taken over
+            min_calls (int): Calls needed in the window before the breaker can open
+            error_rate (float): Share of failed calls that opens the breaker
+            cooldown (float): Seconds the breaker stays open before probing
+        """
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened = 0
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+
+    def allow(self):
+        """
+        Check whether a call may go upstream.
+
+        Returns:
+            bool: False while the breaker is open or a probe is outstanding
+        """
+        now = time.monotonic()
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self._opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._probe_started = now
+            return True
+        # A probe that never reported back (e.g. cancelled) is replaced
+        if self.state == "half_open" and now - self._probe_started >= self.cooldown:
+            self._probe_started = now
+            return True
+        return False
+
+    def record(self, ok):
+        """
+        Record the outcome of a call that was let through.
+
+        Args:
+            ok (bool): Whether the call succeeded
+        """
+        if self.state == "half_open":
+            if ok:
+                self._close()
+            else:
+                self._open()
+            return
+
+        self._results.append(ok)
+        failures = self._results.count(False)
+        if (self.state == "closed" and len(self._results) >= self.min_calls
+                and failures / len(self._results) >= self.error_rate):
+            self._open()
+
+    def stats(self):
+        """Return the breaker state and recent error rate."""
+        calls = len(self._results)
+        return {
+            "state": self.state,
+            "opened": self.opened,
+            "recent_calls": calls,
+            "recent_error_rate": round(self._results.count(False) / calls, 4) if calls else 0.0,
+        }
+
+    def _open(self):
+        if self.state != "open":
+            logger.warning("Circuit breaker opened; answering locally for %.0fs", self.cooldown)
+        self.state = "open"
+        self.opened += 1
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        logger.info("Circuit breaker closed; upstream is answering again")
+        self.state = "closed"
+        self._results.clear()
+
+
+class LLMClient:
+    """
+    Chat completion client with a shared connection pool, a per-request
+    deadline, a circuit breaker and optional request hedging.
+
+    Every failure (deadline exceeded, upstream error, breaker open) is
+    raised as LLMUnavailable so callers can answer locally straight away.
+    The OpenAI SDK's own retries are disabled; the deadline decides how long
+    a caller waits. The SDK is imported and the pool created on first use
+    (or by connect() during warmup), so processes that answer locally never
+    load it.
+    """
+
+    def __init__(self, api_key, model, base_url=LLM_BASE_URL, max_connections=LLM_MAX_CONNECTIONS,
+                 deadline=LLM_DEADLINE, connect_timeout=LLM_CONNECT_TIMEOUT, hedge_ms=LLM_HEDGE_MS,
+                 breaker=None):
+        """
+        Args:
+            api_key (str): API key sent upstream
+            model (str): Model name
+            base_url (str): OpenAI-compatible base URL, or None for OpenAI
+            max_connections (int): Size of the connection pool
+            deadline (float): Seconds a request may take
+            connect_timeout (float): Seconds to establish a connection
+            hedge_ms (float): Delay before a hedged request is sent, 0 to disable
+            breaker (CircuitBreaker): Breaker to use, or None for the default
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.hedge_after = hedge_ms / 1000
+        self.max_connections = max_connections
+        self.breaker = breaker or CircuitBreaker()
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.short_circuited = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency = Histogram()
+        self._http = None
+        self._completions = None
+
+    @property
+    def completions(self):
+        """The chat completions endpoint; the load test swaps in a fake here."""
+        if self._completions is None:
+            self.connect()
+        return self._completions
+
+    @completions.setter
+    def completions(self, value):
+        self._completions = value
+
+    def connect(self):
+        """Import the OpenAI SDK and create the connection pool, if not done yet."""
+        if self._completions is not None:
+            return
+        import httpx
+        from openai import AsyncOpenAI
+
+        self._http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.deadline, connect=self.connect_timeout),
+        )
+        openai = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=self._http, max_retries=0)
+        self._completions = openai.chat.completions
+
+    async def complete(self, prompt):
+        """
+        Get the model's reply to a prompt.
+
+        Args:
+            prompt (str): The prompt
+
+        Returns:
+            str: The reply
+
+        Raises:
+            LLMUnavailable: If the breaker is open, the deadline passed or the
+                upstream call failed
+        """
+        self._admit()
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.deadline):
+                reply = await self._hedged([{"role": "user", "content": prompt}])
+        except Exception as e:
+            raise self._failed(e) from e
+        self.breaker.record(True)
+        self.latency.observe(time.perf_counter() - started)
+        return reply
+
+    async def stream(self, prompt):
+        """
+        Stream the model's reply to a prompt.
+
+        The deadline applies to the first token; after that, pieces are
+        forwarded as they arrive and the upstream stream is closed as soon as
+        the consumer stops iterating. Streams are never hedged.
+
+        Args:
+            prompt (str): The prompt
+
+        Yields:
+            str: Consecutive pieces of the reply
+
+        Raises:
+            LLMUnavailable: Before the first piece, if the breaker is open, the
+                deadline passed or the upstream call failed. Failures after the
+                first piece are raised as they are; either way the breaker
+                counts the call as failed.
+        """
+        self._admit()
+        started = time.perf_counter()
+        stream = None
+        try:
+            async with asyncio.timeout(self.deadline):
+                stream = await self.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    stream=True,
+                )
+                events = aiter(stream)
+                first = await self._next_piece(events)
+        except Exception as e:
+            if stream is not None:
+                await stream.close()
+            raise self._failed(e) from e
+        self.latency.observe(time.perf_counter() - started)
+
+        # The outcome is recorded once the stream ends; a consumer that stops
+        # early does not count against the upstream
+        ok = True
+        try:
+            if first is not None:
+                yield first
+            while (piece := await self._next_piece(events)) is not None:
+                yield piece
+        except Exception:
+            ok = False
+            self.failures += 1
+            raise
+        finally:
+            self.breaker.record(ok)
+            # Stops generation upstream if the client went away mid-stream
+            await stream.close()
+
+    def stats(self):
+        """Return request, failure and hedging counters, latency and breaker state."""
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "short_circuited": self.short_circuited,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "latency": self.latency.snapshot(),
+            "breaker": self.breaker.stats(),
+            "max_connections": self.max_connections,
+            "deadline_s": self.deadline,
+        }
+
+    async def aclose(self):
+        """Close the pooled connections."""
+        if self._http is not None:
+            await self._http.aclose()
+
+    def _admit(self):
+        self.requests += 1
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            raise LLMUnavailable("circuit open")
+
+    def _failed(self, error):
+        self.breaker.record(False)
+        self.failures += 1
+        if isinstance(error, TimeoutError):
+            self.timeouts += 1
+            return LLMUnavailable(f"no reply within {self.deadline:g}s")
+        return LLMUnavailable(f"{type(error).__name__}: {error}")
+
+    async def _create(self, messages):
+        completion = await self.completions.create(model=self.model, messages=messages)
+        return completion.choices[0].message.content
+
+    async def _hedged(self, messages):
+        """
+        Send a request, and a second identical one if the first is slow.
+
+        The first reply to arrive wins and the other request is cancelled.
+        Hedging is skipped unless the breaker is closed, so a struggling
+        upstream is not sent twice the traffic.
+        """
+        first = asyncio.ensure_future(self._create(messages))
+        if self.hedge_after <= 0 or self.breaker.state != "closed":
+            return await first
+
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            self.hedged += 1
+            second = asyncio.ensure_future(self._create(messages))
+            pending.add(second)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _next_piece(events):
+        """Return the next non-empty text delta, or None at the end of the stream."""
+        async for event in events:
+            if event.choices and event.choices[0].delta.content:
+                return event.choices[0].delta.content
+        return None
@@ -1,20 +1,111 @@
+import asyncio
+import json
+import logging
 import os
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query as QueryParam, Request, UploadFile, File, Form, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response as RawResponse, StreamingResponse
 from pydantic import BaseModel
-from ai_agent import get_response_from_gpt
-from agri_prompt import build_prompt
-from voice_input import transcribe_audio
-from voice_output import text_to_speech
+
+# Load .env before the modules below read their settings from the environment
+load_dotenv()
+
+from ai_agent import ANSWER_CACHE, LLM_BACKEND, answer_batch, answer_question, client as llm_client, stream_answer
+from answer_pack import ANSWER_PACK, MEDIA_TYPES, etag_matches
+from asr import ASR_POOL, TranscriptionError
+from audio_ingest import UploadLimitMiddleware
+from knowledge_base import get_knowledge_base, search_knowledge
+from metrics import Histogram, render_metrics
+from request_timing import REQUEST_SECONDS, STAGE_SECONDS, TimingMiddleware, set_label, stage
+from sentences import iter_sentences
+from transcode import REPLY_FORMATS, TRANSCODE_STATS, TranscodeError, negotiate_format
+from voice_input import ASR_BACKEND, transcribe_audio
+from voice_output import (LANGUAGE_CODE_MAP, TTS_CACHE, encode_reply, load_tts, lookup_speech, stream_speech,
+                          synthesize_speech)
+from voice_session import SESSION_STATS, VoiceSession
+from workers import VOICE_POOL, Overloaded
+
+# Log lines go to stderr as key=value pairs
+logging.basicConfig(
+    level=os.getenv("KRISHIMITRA_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+)
+logger = logging.getLogger("krishimitra")
+
+# Load the knowledge base and speech-to-text models before accepting traffic
+PRELOAD = os.getenv("KRISHIMITRA_PRELOAD", "1") == "1"
+
+# Readiness of this worker process, reported by /ready
+READINESS = {"ready": False, "checks": {}}
+
+async def preload():
+    """
+    Load heavy resources so the first requests don't pay for them.
+
+    Returns:
+        dict: "ok" or the error for each resource
+    """
+    checks = {}
+
+    async def check(name, load):
+        started = time.perf_counter()
+        try:
+            await load()
+            checks[name] = "ok"
+            logger.info("Preloaded %s in %.2fs", name, time.perf_counter() - started)
+        except Exception as e:
+            checks[name] = f"{type(e).__name__}: {e}"
+            logger.exception("Preloading %s failed", name)
+
+    def load_knowledge_base():
+        # Map the index (rebuilding it if stale) and touch its pages with one lookup
+        get_knowledge_base()
+        search_knowledge("rice", "English")
+
+    await check("knowledge_base", lambda: asyncio.to_thread(load_knowledge_base))
+    # Heavy SDKs are not imported by `import main`; load them here instead of
+    # on the first request
+    await check("tts", lambda: asyncio.to_thread(load_tts))
+    if LLM_BACKEND == "openai":
+        await check("llm", lambda: asyncio.to_thread(llm_client.connect))
+    if ASR_BACKEND == "whisper":
+        # Start the Whisper processes and wait until each has loaded the model
+        await check("asr", ASR_POOL.warmup)
+    return checks
+
+@asynccontextmanager
+async def lifespan(app):
+    """Preload at startup and mark the worker ready; release pools at shutdown."""
+    if PRELOAD:
+        READINESS["checks"] = await preload()
+    else:
+        # Requests search the knowledge base on the event loop, so load it
+        # (rebuilding a stale index) here rather than inside the first one
+        await asyncio.to_thread(get_knowledge_base)
+    READINESS["ready"] = all(result == "ok" for result in READINESS["checks"].values())
+    yield
+    # Stop advertising readiness first so load balancers drain this worker
+    READINESS["ready"] = False
+    await llm_client.aclose()
+    ASR_POOL.shutdown()
+    if ANSWER_CACHE.store is not None:
+        ANSWER_CACHE.store.close()
 
 # Initialize FastAPI app
 app = FastAPI(
     title="KrishiMitra API",
     description="A multilingual AI assistant for Indian farmers",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
+# Reject oversized voice uploads before their body is read in full
+app.add_middleware(UploadLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -22,8 +113,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["Server-Timing", "X-TTS-Cache", "X-Audio-Format", "ETag"],
 )
 
+# Time each request by stage; added last so it wraps the other middleware
+app.add_middleware(TimingMiddleware)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Turn away work early with 503 when a worker pool is saturated."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy ({exc.pool} pool full), please retry"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Time to first chunk and total duration of /ask/stream responses
+STREAM_TTFB = Histogram()
+STREAM_TOTAL = Histogram()
+
+# Time to first audio of /voice-ask/stream responses
+VOICE_STREAM_TTFA = Histogram()
+
+# Largest /ask/batch request, and distinct questions answered at once per batch
+BATCH_MAX_ITEMS = int(os.getenv("KRISHIMITRA_BATCH_MAX_ITEMS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("KRISHIMITRA_BATCH_CONCURRENCY", "8"))
+
+# Formats /voice-ask/stream can send: per-sentence MP3 frames concatenate
+# into one stream, but separate Ogg files do not
+STREAM_FORMATS = ("mp3", "mp3-low")
+
+def choose_reply_format(request, requested, allowed=tuple(REPLY_FORMATS)):
+    """
+    Pick the reply audio format from the `format` query parameter or the
+    Accept header.
+
+    Raises:
+        HTTPException: If the requested format is not supported
+    """
+    fmt = negotiate_format(request.headers.get("accept"), requested, allowed)
+    if fmt is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported format; use one of: {', '.join(allowed)}")
+    return fmt
+
+def metric_language(language):
+    """Map a requested language to a metric label, keeping label values bounded."""
+    return language.lower() if language in LANGUAGE_CODE_MAP else "other"
+
 # Define request model
 class Query(BaseModel):
     question: str
@@ -33,11 +169,57 @@ class Query(BaseModel):
 class Response(BaseModel):
     reply: str
 
+# One answer in a batch; exactly one of reply and error is set
+class BatchItem(BaseModel):
+    index: int
+    reply: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchItem]
+
 @app.get("/")
 async def root():
     """Root endpoint to check if the API is running."""
     return {"message": "Welcome to KrishiMitra API! Use /ask endpoint to ask questions."}
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe, separate from the / liveness check: 200 once this worker
+    has preloaded its resources, 503 before that, after a failed preload and
+    during shutdown.
+    """
+    return JSONResponse(
+        status_code=200 if READINESS["ready"] else 503,
+        content={"ready": READINESS["ready"], "pid": os.getpid(), "checks": READINESS["checks"]},
+    )
+
+@app.get("/stats")
+async def stats():
+    """Report cache hit/miss counters for this worker process."""
+    return {
+        "pid": os.getpid(),
+        "answer_cache": ANSWER_CACHE.stats(),
+        "tts_cache": TTS_CACHE.stats(),
+        "ask_stream": {"ttfb": STREAM_TTFB.snapshot(), "total": STREAM_TOTAL.snapshot()},
+        "voice_ask_stream": {"ttfa": VOICE_STREAM_TTFA.snapshot()},
+        "voice_pool": VOICE_POOL.stats(),
+        "asr": ASR_POOL.stats(),
+        "llm": llm_client.stats(),
+        "transcode": TRANSCODE_STATS.stats(),
+        "voice_session": SESSION_STATS.snapshot(),
+        "answer_pack": ANSWER_PACK.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Serve request and per-stage latency histograms in Prometheus text format."""
+    return PlainTextResponse(
+        render_metrics(REQUEST_SECONDS, STAGE_SECONDS),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 @app.post("/ask", response_model=Response)
 async def ask_agent(query: Query):
     """
@@ -51,50 +233,366 @@ async def ask_agent(query: Query):
     """
     if not query.question:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
+    set_label("language", metric_language(query.language))
 
-    prompt = build_prompt(query.question, query.language)
-    reply = await get_response_from_gpt(prompt)
+    reply = await answer_question(query.question, query.language)
 
     return Response(reply=reply)
 
-@app.post("/voice-ask/")
-async def ask_by_voice(audio: UploadFile = File(...), language: str = Form("English")):
+def sse_event(event, data):
+    """Format one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_agent_stream(query: Query, request: Request):
     """
-    Endpoint to ask questions to KrishiMitra using voice input.
+    Endpoint to ask questions to KrishiMitra with the reply streamed back as
+    Server-Sent Events.
+
+    Each `chunk` event carries the next piece of the reply. A final `done`
+    event reports time to first chunk and total time in milliseconds; an
+    `error` event is sent instead if generation fails part-way.
+
+    Args:
+        query (Query): The query containing the question and language
+        request (Request): The incoming request, used to detect disconnects
+
+    Returns:
+        StreamingResponse: The text/event-stream response
+    """
+    if not query.question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+    set_label("language", metric_language(query.language))
+
+    async def events():
+        started = time.perf_counter()
+        ttfb = None
+        chunks = stream_answer(query.question, query.language)
+        try:
+            async for chunk in chunks:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, stopping /ask/stream generation")
+                    return
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                    STREAM_TTFB.observe(ttfb)
+                yield sse_event("chunk", {"text": chunk})
+        except Exception as e:
+            logger.warning("Error streaming reply: %s", e)
+            yield sse_event("error", {"detail": "Reply generation failed"})
+            return
+        finally:
+            # Closing the generator closes the upstream model stream
+            await chunks.aclose()
+
+        total = time.perf_counter() - started
+        STREAM_TOTAL.observe(total)
+        yield sse_event("done", {
+            "ttfb_ms": round((ttfb or total) * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+        })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def start_batch(queries):
+    """
+    Validate a batch request and label its metrics.
+
+    Args:
+        queries (list[Query]): The batched queries
+
+    Returns:
+        list: (question, language) pairs to answer
+    """
+    if not queries:
+        raise HTTPException(status_code=400, detail="Batch cannot be empty")
+    if len(queries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch cannot have more than {BATCH_MAX_ITEMS} questions")
+
+    languages = {metric_language(query.language) for query in queries}
+    set_label("language", languages.pop() if len(languages) == 1 else "mixed")
+    return [(query.question, query.language) for query in queries]
+
+@app.post("/ask/batch", response_model=BatchResponse)
+async def ask_agent_batch(queries: List[Query]):
+    """
+    Endpoint to ask several questions in one request.
+
+    Identical questions are answered once, and distinct questions are
+    answered concurrently up to a configurable limit. Results are returned
+    in input order; a question that fails gets an `error` instead of a
+    `reply` without failing the rest of the batch.
+
+    Args:
+        queries (list[Query]): The questions and their languages
+
+    Returns:
+        BatchResponse: One result per query, in input order
+    """
+    pairs = start_batch(queries)
+    results = [None] * len(pairs)
+    async for positions, reply, error in answer_batch(pairs, BATCH_CONCURRENCY):
+        for position in positions:
+            results[position] = BatchItem(index=position, reply=reply, error=error)
+    set_label("cache", "mixed")
+
+    return BatchResponse(results=results)
+
+@app.post("/ask/batch/stream")
+async def ask_agent_batch_stream(queries: List[Query], request: Request):
+    """
+    Endpoint to ask several questions in one request, with each answer
+    streamed back as a line of NDJSON as soon as it is ready.
+
+    Lines arrive in completion order and carry the `index` of the query they
+    answer, with the same fields as the items of `/ask/batch`.
+
+    Args:
+        queries (list[Query]): The questions and their languages
+        request (Request): The incoming request, used to detect disconnects
+
+    Returns:
+        StreamingResponse: The application/x-ndjson response
+    """
+    pairs = start_batch(queries)
+
+    async def lines():
+        answers = answer_batch(pairs, BATCH_CONCURRENCY)
+        try:
+            async for positions, reply, error in answers:
+                if await request.is_disconnected():
+                    logger.info("Client disconnected, stopping /ask/batch/stream")
+                    return
+                for position in positions:
+                    item = {"index": position, "reply": reply, "error": error}
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # Cancels questions still being answered
+            await answers.aclose()
+            set_label("cache", "mixed")
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def transcribe_question(audio, language):
+    """
+    Transcribe an uploaded voice question.
 
     Args:
         audio (UploadFile): The audio file containing the farmer's question
-        language (str): The language to respond in
+        language (str): The language of the question
 
     Returns:
-        FileResponse: The audio file containing the response
+        str: The transcribed question
     """
     # Add language to the filename to help with language detection
     original_filename = audio.filename
     audio.filename = f"{language.lower()}_{original_filename}"
 
     # Log the request details
-    print(f"Processing voice request in {language} language with file: {audio.filename}")
+    logger.debug("Processing voice request in %s with file %s", language, audio.filename)
+
+    try:
+        return await transcribe_audio(audio, language)
+    except (TranscriptionError, TranscodeError) as e:
+        logger.warning("Error transcribing audio: %s", e)
+        raise HTTPException(status_code=422, detail="Could not transcribe the audio")
+
+@app.post("/voice-ask/")
+async def ask_by_voice(request: Request, audio: UploadFile = File(...), language: str = Form("English"),
+                       reply_format: Optional[str] = QueryParam(None, alias="format")):
+    """
+    Endpoint to ask questions to KrishiMitra using voice input.
+
+    Args:
+        audio (UploadFile): The audio file containing the farmer's question
+        language (str): The language to respond in
+        reply_format (str): Reply audio format (`mp3`, `mp3-low` or `opus`);
+            otherwise chosen from the Accept header
+
+    Returns:
+        FileResponse: The audio file containing the response
+    """
+    # Reject before doing any work if the voice pool is saturated; once
+    # admitted, the request's voice pool jobs queue instead of failing
+    VOICE_POOL.admit()
+    fmt = choose_reply_format(request, reply_format)
+    set_label("language", metric_language(language))
 
     # Step 1: Convert voice to text
-    farmer_text = await transcribe_audio(audio)
+    farmer_text = await transcribe_question(audio, language)
 
-    # Step 2: Build and send prompt
-    prompt = build_prompt(farmer_text, language)
-    reply = await get_response_from_gpt(prompt)
+    # Step 2: Build and send prompt, sharing answers for repeated questions
+    reply = await answer_question(farmer_text, language)
 
-    # Step 3: Convert reply to speech
-    mp3_path = text_to_speech(reply, language)
+    # Step 3: Prebuilt answers are served from the answer pack as they are
+    audio_path = ANSWER_PACK.lookup(reply, language, fmt)
+    tts_cache = "pack"
+    if audio_path is None:
+        # Step 4: Convert reply to speech, serving repeated replies from the cache
+        with stage("tts"):
+            mp3_path = lookup_speech(reply, language)
+            tts_cache = "hit"
+            if mp3_path is None:
+                tts_cache = "miss"
+                mp3_path = await VOICE_POOL.run(synthesize_speech, reply, language, admitted=True)
 
-    # Step 4: Return voice reply as downloadable audio
+        # Step 5: Shrink the audio for slow links if a compact format was asked for
+        audio_path = mp3_path
+        if fmt != "mp3":
+            with stage("transcode"):
+                try:
+                    audio_path = await VOICE_POOL.run(encode_reply, mp3_path, fmt, admitted=True)
+                except TranscodeError as e:
+                    # The reply is still playable as the MP3 gTTS produced
+                    logger.warning("Could not transcode the reply to %s, sending MP3: %s", fmt, e)
+                    fmt = "mp3"
+
+    # Step 6: Return voice reply as downloadable audio
+    media_type, suffix, _ = REPLY_FORMATS[fmt]
     return FileResponse(
-        mp3_path,
+        audio_path,
+        media_type=media_type,
+        filename=f"krishimitra_reply{suffix}",
+        headers={
+            "Content-Disposition": f"attachment; filename=krishimitra_reply{suffix}",
+            "X-TTS-Cache": tts_cache,
+            "X-Audio-Format": fmt,
+        }
+    )
+
+@app.post("/voice-ask/stream")
+async def ask_by_voice_stream(request: Request, audio: UploadFile = File(...), language: str = Form("English"),
+                              reply_format: Optional[str] = QueryParam(None, alias="format")):
+    """
+    Endpoint to ask questions using voice input, with the spoken reply
+    streamed back sentence by sentence.
+
+    The reply is split into sentences as it is generated; each sentence is
+    synthesized as soon as it is complete and its MP3 frames are sent while
+    the next sentence is being synthesized.
+
+    Args:
+        audio (UploadFile): The audio file containing the farmer's question
+        language (str): The language to respond in
+        reply_format (str): `mp3` or `mp3-low`; otherwise chosen from the
+            Accept header
+
+    Returns:
+        StreamingResponse: Chunked MP3 audio containing the response
+    """
+    started = time.perf_counter()
+    VOICE_POOL.admit()
+    fmt = choose_reply_format(request, reply_format, STREAM_FORMATS)
+    set_label("language", metric_language(language))
+    farmer_text = await transcribe_question(audio, language)
+
+    async def audio_chunks():
+        first = True
+        sentences = iter_sentences(stream_answer(farmer_text, language))
+        try:
+            async for data in stream_speech(sentences, language, fmt=fmt):
+                if first:
+                    VOICE_STREAM_TTFA.observe(time.perf_counter() - started)
+                    first = False
+                yield data
+        except Exception:
+            # The status line has gone out already; abort the chunked response
+            # so the client sees the reply failed rather than a clean but
+            # truncated one
+            logger.exception("Error streaming the voice reply")
+            raise
+
+    return StreamingResponse(
+        audio_chunks(),
         media_type="audio/mpeg",
-        filename="krishimitra_reply.mp3",
-        headers={"Content-Disposition": f"attachment; filename=krishimitra_reply.mp3"}
+        headers={"Content-Disposition": "attachment; filename=krishimitra_reply.mp3", "X-Audio-Format": fmt},
     )
 
+@app.get("/pack/manifest.json")
+async def answer_pack_manifest(request: Request):
+    """
+    Serve the offline answer pack's manifest.
+
+    The ETag is the pack version, so clients revalidate with If-None-Match
+    and get 304 until the pack is rebuilt with different answers.
+    """
+    manifest = ANSWER_PACK.manifest()
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="No answer pack has been built")
+    body, version = manifest
+    headers = {"ETag": f'"{version}"', "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return RawResponse(status_code=304, headers=headers)
+    return RawResponse(body, media_type="application/json", headers=headers)
+
+@app.get("/pack/audio/{name}")
+async def answer_pack_audio(name: str, request: Request):
+    """
+    Serve an audio file of the answer pack. Files are named after their
+    content and never change, so they may be cached indefinitely.
+    """
+    path = ANSWER_PACK.asset_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    stem, suffix = os.path.splitext(name)
+    headers = {"ETag": f'"{stem}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return RawResponse(status_code=304, headers=headers)
+    return FileResponse(path, media_type=MEDIA_TYPES[suffix], headers=headers)
+
+@app.websocket("/ws/voice")
+async def voice_ws(websocket: WebSocket, language: str = "English",
+                   reply_format: Optional[str] = QueryParam(None, alias="format")):
+    """
+    Real-time voice session.
+
+    The client sends 16 kHz mono 16-bit PCM in binary messages as it records.
+    Partial transcripts come back while the farmer speaks. Once the end of
+    the utterance is detected, the answer is sent as text messages and as
+    one audio message per sentence.
+
+    Args:
+        websocket (WebSocket): The connection
+        language (str): The language the farmer speaks and is answered in
+        reply_format (str): Audio format of the spoken answer, or `text` for
+            no audio; otherwise chosen from the Accept header
+    """
+    fmt = None
+    if reply_format != "text":
+        # Every audio message is a complete file, so Ogg Opus works here too
+        fmt = negotiate_format(websocket.headers.get("accept"), reply_format)
+        if fmt is None:
+            await websocket.close(1008, f"Unsupported format; use text or one of: {', '.join(REPLY_FORMATS)}")
+            return
+    await VoiceSession(websocket, language, fmt).run()
+
 # Run the app with uvicorn
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+
+    parser = argparse.ArgumentParser(description="Run the KrishiMitra API.")
+    parser.add_argument("--host", default=os.getenv("KRISHIMITRA_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("KRISHIMITRA_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("KRISHIMITRA_WORKERS", "1")),
+                        help="worker processes")
+    parser.add_argument("--reload", action="store_true",
+                        help="restart on code changes (development only; runs a single worker)")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=None if args.reload else args.workers,
+        reload=args.reload,
+        timeout_graceful_shutdown=30,
+    )
@@ -0,0 +1,154 @@
+import bisect
+import threading
+
+# Latency bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram for latency observations, in seconds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple): Sorted bucket upper bounds
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record one observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation within its bucket.
+
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns:
+            float: The estimated value, or 0.0 with no observations
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return 0.0
+
+        rank = q * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """Return count, mean and quantile estimates in milliseconds."""
+        count = self.count
+        return {
+            "count": count,
+            "mean_ms": round(self.sum / count * 1000, 2) if count else 0.0,
+            "p50_ms": round(self.quantile(0.5) * 1000, 2),
+            "p95_ms": round(self.quantile(0.95) * 1000, 2),
+            "p99_ms": round(self.quantile(0.99) * 1000, 2),
+        }
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class HistogramFamily:
+    """
+    Histograms sharing a metric name, one per combination of label values,
+    rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            name (str): Metric name
+            documentation (str): Help text shown in the exposition
+            labelnames (tuple): Names of the labels, in order
+            buckets (tuple): Sorted bucket upper bounds
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """
+        Return the histogram for a set of label values, creating it if needed.
+
+        Args:
+            **labels: One value per label name
+
+        Returns:
+            Histogram: The histogram for these label values
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = Histogram(self.buckets)
+        return child
+
+    def observe(self, value, **labels):
+        """Record one observation under the given label values."""
+        self.labels(**labels).observe(value)
+
+    def render(self):
+        """
+        Render every histogram in the family.
+
+        Returns:
+            str: Prometheus text exposition lines, newline-terminated
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            labels = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(self.labelnames, key))
+            with child._lock:
+                counts = list(child.counts)
+                total = child.count
+                value_sum = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {value_sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def render_metrics(*families):
+    """
+    Render histogram families as one Prometheus text exposition.
+
+    Args:
+        *families (HistogramFamily): The families to include
+
+    Returns:
+        str: The exposition body
+    """
+    return "".join(family.render() for family in families)
@@ -0,0 +1,149 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from metrics import HistogramFamily
+
+logger = logging.getLogger("krishimitra.requests")
+
+# Per-request timings; labels are filled in by the handlers as they learn them
+REQUEST_SECONDS = HistogramFamily(
+    "krishimitra_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response.",
+    ("endpoint", "language", "cache", "status"),
+)
+STAGE_SECONDS = HistogramFamily(
+    "krishimitra_stage_duration_seconds",
+    "Time spent in each stage of a request: upload, asr, prompt, llm, tts, write.",
+    ("endpoint", "language", "cache", "stage"),
+)
+
+_current = contextvars.ContextVar("krishimitra_request_timing", default=None)
+
+
+class RequestTiming:
+    """
+    Stage durations and metric labels collected while handling one request.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.labels = {"language": "none", "cache": "none"}
+
+    def add(self, name, seconds):
+        """Add time to a stage; repeated stages are summed."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """
+        Format the stages recorded so far as a Server-Timing header value.
+
+        Returns:
+            str: Entries such as `asr;dur=812.4, llm;dur=640.1`
+        """
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        if self.labels["cache"] != "none":
+            entries.append(f'cache;desc="{self.labels["cache"]}"')
+        return ", ".join(entries)
+
+
+def current_timing():
+    """Return the timing for the request being handled, or None outside a request."""
+    return _current.get()
+
+
+def add_stage(name, seconds):
+    """
+    Record time spent in a stage of the current request.
+
+    Args:
+        name (str): Stage name
+        seconds (float): Time spent
+    """
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as a stage of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - started)
+
+
+def set_label(name, value):
+    """
+    Set a metric label for the current request.
+
+    Args:
+        name (str): "language" or "cache"
+        value (str): The label value
+    """
+    timing = _current.get()
+    if timing is not None:
+        timing.labels[name] = value
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware that times each request by stage.
+
+    Stages recorded before the response starts are sent in a Server-Timing
+    header. Once the last byte is sent, the time spent writing the response
+    is added as the `write` stage, every stage is recorded in the
+    histograms, and one log line summarizes the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        status = 500
+        response_started = None
+
+        async def timed_send(message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = time.perf_counter()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                if response_started is not None:
+                    timing.add("write", time.perf_counter() - response_started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            self._record(scope, timing, status)
+
+    @staticmethod
+    def _record(scope, timing, status):
+        total = time.perf_counter() - timing.started
+        route = scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        labels = {"endpoint": endpoint, **timing.labels}
+        REQUEST_SECONDS.observe(total, status=status, **labels)
+        for name, seconds in timing.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=name, **labels)
+
+        stages = " ".join(f"{name}_ms={seconds * 1000:.1f}" for name, seconds in timing.stages.items())
+        logger.info(
+            "method=%s endpoint=%s status=%s language=%s cache=%s total_ms=%.1f %s",
+            scope["method"], endpoint, status, labels["language"], labels["cache"], total * 1000, stages,
+        )
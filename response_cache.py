@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def normalize_question(text):
+    """
+    Normalize a question so that trivially different phrasings share a key.
+
+    Applies case folding and Unicode NFC, replaces punctuation (including the
+    Devanagari danda) with spaces and collapses runs of whitespace.
+
+    Args:
+        text (str): The question as typed or transcribed
+
+    Returns:
+        str: The normalized question
+    """
+    text = unicodedata.normalize("NFC", text.casefold())
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return " ".join(text.split())
+
+
+class SharedStore:
+    """
+    Answer store in an SQLite database in WAL mode, shared by every worker
+    process that opens the same file.
+
+    WAL lets readers in one process carry on while another process writes.
+    Entries carry a wall-clock expiry so all processes agree on it; once the
+    table grows past `maxsize`, the oldest-written entries are dropped.
+
+    Every query runs on the store's own thread, never on the event loop:
+    lookup() awaits a read and save() queues a write without waiting for it.
+    Queries still give up on a lock held by another process after
+    `busy_timeout`, so they don't pile up behind it: the read counts as a
+    miss and the write is skipped.
+    """
+
+    # Prune expired and surplus rows after this many writes
+    PRUNE_EVERY = 64
+
+    def __init__(self, path, maxsize, ttl, busy_timeout=0.05):
+        """
+        Args:
+            path (str): Database file
+            maxsize (int): Rows kept before the oldest are dropped
+            ttl (float): Seconds an entry stays valid
+            busy_timeout (float): Seconds to wait for another process's lock
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.busy = 0
+        # Row count as of the last prune, so stats never query the database
+        self.rows = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="answer-store")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Setting up the schema may wait as long as it takes; only lookups
+        # and writes on the request path give up early
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        self.rows = self._count()
+
+    async def lookup(self, key):
+        """
+        Look a key up on the store's thread.
+
+        Args:
+            key: A JSON-serializable cache key
+
+        Returns:
+            tuple | None: (value, seconds until it expires)
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._thread, self.get, key)
+
+    def save(self, key, value):
+        """
+        Queue a write on the store's thread without waiting for it.
+
+        Args:
+            key: A JSON-serializable cache key
+            value (str): The value
+        """
+        self._thread.submit(self.set, key, value)
+
+    def get(self, key):
+        """
+        Return the stored value for a key, or None if absent or expired.
+        Blocks; call lookup() from the event loop.
+
+        Args:
+            key: A JSON-serializable cache key
+
+        Returns:
+            tuple | None: (value, seconds until it expires)
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM answers WHERE key = ? AND expires_at > ?", (self._encode(key), now)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # Locked by another process for longer than busy_timeout
+                self.busy += 1
+                return None
+        return (row[0], row[1] - now) if row else None
+
+    def set(self, key, value):
+        """
+        Store a value, pruning the table every PRUNE_EVERY writes. The write
+        is skipped if the database stays locked for longer than busy_timeout.
+        Blocks; call save() from the event loop.
+
+        Args:
+            key: A JSON-serializable cache key
+            value (str): The value
+        """
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers (key, value, expires_at) VALUES (?, ?, ?)",
+                    (self._encode(key), value, time.time() + self.ttl),
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    self._prune()
+            except sqlite3.OperationalError:
+                self.busy += 1
+
+    def close(self):
+        """Finish queued writes and close the database connection."""
+        self._thread.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+
+    def _count(self):
+        return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def _prune(self):
+        self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM answers WHERE key IN "
+            "(SELECT key FROM answers ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+        self.rows = self._count()
+
+    @staticmethod
+    def _encode(key):
+        return json.dumps(key, ensure_ascii=False)
+
+
+class ResponseCache:
+    """
+    In-memory answer cache with TTL expiry, LRU eviction and single-flight
+    coalescing of concurrent misses.
+
+    When several requests miss on the same key at once, only the first one
+    calls the upstream; the others wait for its result instead of sending
+    their own request.
+
+    With a shared store, entries missing from memory are looked up there
+    and new entries are written to it, so answers computed by one worker
+    process are reused by the others. Coalescing stays per process.
+    """
+
+    def __init__(self, maxsize, ttl, store=None):
+        """
+        Args:
+            maxsize (int): Maximum number of cached answers
+            ttl (float): Seconds an answer stays valid
+            store (SharedStore): Store shared with other processes, or None
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    async def get(self, key):
+        """
+        Return the cached value for a key, or None if absent or expired.
+        Entries missing from memory are looked up in the shared store.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The cached value, or None
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        stored = await self.store.lookup(key) if self.store is not None else None
+        if stored is None:
+            self.misses += 1
+            return None
+        # Another worker answered this question; keep a copy in memory until
+        # the shared entry expires
+        value, ttl = stored
+        self._remember(key, value, ttl)
+        self.hits += 1
+        self.shared_hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entry when full.
+        The write to the shared store is queued, not waited for.
+
+        Args:
+            key: The cache key
+            value: The value to cache
+        """
+        if self.maxsize <= 0:
+            return
+        self._remember(key, value, self.ttl)
+        if self.store is not None:
+            self.store.save(key, value)
+
+    async def get_or_compute(self, key, factory):
+        """
+        Return the cached value for a key, computing it at most once.
+
+        Args:
+            key: The cache key
+            factory (callable): Returns an awaitable producing the value
+
+        Returns:
+            The cached or freshly computed value
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+        return await self.compute(key, factory)
+
+    async def compute(self, key, factory):
+        """
+        Compute the value for a key that missed the cache, sharing an upstream
+        call already in flight for the same key.
+
+        Args:
+            key: The cache key
+            factory (callable): Returns an awaitable producing the value
+
+        Returns:
+            The computed value
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        # Shield the shared call so one caller disconnecting doesn't cancel it
+        # for everyone else waiting on the same key
+        return await asyncio.shield(task)
+
+    def begin(self, key):
+        """
+        Register a computation the caller runs itself, such as a streamed
+        answer, so that concurrent misses on the same key wait for it.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            asyncio.Future: Set its result to the value, which is then cached,
+                or its exception to raise it in every caller waiting on it
+
+        Raises:
+            RuntimeError: If a computation for the key is already in flight;
+                callers should join() it instead
+        """
+        if key in self._inflight:
+            raise RuntimeError(f"a computation for {key!r} is already in flight")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return future
+
+    async def join(self, key):
+        """
+        Wait for an upstream call already in flight for a key.
+
+        Args:
+            key: The cache key
+
+        Returns:
+            The call's result, or None if no call is in flight
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            return None
+        self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """
+        Return hit, miss and coalescing counters. Coalesced requests are
+        misses that waited on another request's upstream call; shared hits
+        are hits served from the shared store, and shared busy counts store
+        lookups and writes given up because another process held the lock.
+        Shared size is the store's row count as of its last prune.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "inflight": len(self._inflight),
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "shared_size": self.store.rows if self.store is not None else None,
+            "shared_busy": self.store.busy if self.store is not None else None,
+        }
+
+    def _remember(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _finish(self, key, task):
+        # Leave a newer computation registered under the same key in place
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.set(key, task.result())
@@ -0,0 +1,69 @@
+import re
+
+# Sentence-ending punctuation: Latin, Devanagari danda and double danda
+# (also used in Bengali and Gurmukhi text), and the Urdu full stop and
+# question mark. Tamil and Telugu text uses the Latin marks.
+SENTENCE_TERMINATORS = ".?!।॥۔؟"
+
+# A sentence ends at a run of terminators followed by whitespace or the end of
+# the text, so abbreviations such as "செ.மீ" stay in one piece
+_SENTENCE_END = re.compile(f"[{re.escape(SENTENCE_TERMINATORS)}]+(?=\\s|$)")
+
+
+def split_sentences(text):
+    """
+    Split text into sentences.
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        list[str]: Non-empty sentences with surrounding whitespace removed
+    """
+    sentences = []
+    start = 0
+    for m in _SENTENCE_END.finditer(text):
+        sentence = text[start:m.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = m.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+async def iter_sentences(pieces, max_chars=200):
+    """
+    Regroup a stream of text pieces into complete sentences.
+
+    A sentence is emitted once the whitespace after its terminator has
+    arrived, so a terminator that turns out to be part of an abbreviation is
+    never split on. Text that runs past `max_chars` without a terminator is
+    cut at the last space so synthesis can start.
+
+    Args:
+        pieces: Async iterable of text pieces, such as model deltas
+        max_chars (int): Longest run of text held back waiting for a terminator
+
+    Yields:
+        str: Complete sentences with surrounding whitespace removed
+    """
+    buffer = ""
+    async for piece in pieces:
+        buffer += piece
+        end = 0
+        for m in _SENTENCE_END.finditer(buffer):
+            if m.end() < len(buffer):
+                end = m.end()
+        if end:
+            for sentence in split_sentences(buffer[:end]):
+                yield sentence
+            buffer = buffer[end:]
+        while len(buffer) > max_chars:
+            end = buffer.rfind(" ", 0, max_chars) + 1 or max_chars
+            if buffer[:end].strip():
+                yield buffer[:end].strip()
+            buffer = buffer[end:]
+    for sentence in split_sentences(buffer):
+        yield sentence
@@ -0,0 +1,12 @@
+import ai_agent
+
+
+def test_local_response_without_any_default_entry(monkeypatch):
+    monkeypatch.setattr(ai_agent, "search_knowledge", lambda question, language, k: [])
+    monkeypatch.setattr(ai_agent, "default_passage", lambda language: None)
+    assert ai_agent.local_response("Tell me about saffron", "Odia") == ai_agent.FALLBACK_ANSWER
+
+
+def test_local_response_answers_from_the_knowledge_base():
+    reply = ai_agent.local_response("How do I grow rice?", "English")
+    assert reply and reply != ai_agent.FALLBACK_ANSWER
@@ -0,0 +1,127 @@
+import os
+import time
+
+import pytest
+
+from audio_cache import AudioCache
+
+
+def write_bytes(size):
+    """Return a writer that fills the file with `size` bytes."""
+    def writer(path):
+        with open(path, "wb") as f:
+            f.write(b"\xff" * size)
+    return writer
+
+
+def age(path, atime_ago, mtime_ago):
+    """Set a file's access and modification times to the given seconds ago."""
+    now = time.time()
+    os.utime(path, (now - atime_ago, now - mtime_ago))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AudioCache(str(tmp_path), max_bytes=1000, max_age=3600)
+
+
+def test_miss_then_hit(cache):
+    key = AudioCache.key("How do I grow rice?", "en", "slow=False")
+    assert cache.get(key) is None
+
+    path = cache.put(key, write_bytes(100))
+    assert cache.get(key) == path
+    with open(path, "rb") as f:
+        assert f.read() == b"\xff" * 100
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_key_depends_on_every_part():
+    assert AudioCache.key("rice", "en") != AudioCache.key("rice", "hi")
+    assert AudioCache.key("ab", "c") != AudioCache.key("a", "bc")
+
+
+def test_suffix_selects_a_separate_entry(cache):
+    key = AudioCache.key("rice")
+    cache.put(key, write_bytes(10))
+    assert cache.get(key, ".opus") is None
+    assert cache.put(key, write_bytes(10), ".opus").endswith(".opus")
+
+
+def test_get_keeps_write_time(cache):
+    key = AudioCache.key("rice")
+    path = cache.put(key, write_bytes(10))
+    age(path, 600, 600)
+    mtime = os.stat(path).st_mtime
+    cache.get(key)
+    st = os.stat(path)
+    assert st.st_mtime == mtime
+    assert st.st_atime > mtime
+
+
+def test_expired_entry_is_a_miss_and_removed(cache):
+    key = AudioCache.key("rice")
+    path = cache.put(key, write_bytes(10))
+    age(path, 3601, 3601)
+    assert cache.get(key) is None
+    assert not os.path.exists(path)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evict_drops_expired_entries(cache):
+    fresh = cache.put(AudioCache.key("fresh"), write_bytes(10))
+    old = cache.put(AudioCache.key("old"), write_bytes(10))
+    age(old, 0, 3601)
+    cache.evict()
+    assert os.path.exists(fresh)
+    assert not os.path.exists(old)
+
+
+def test_lru_eviction_down_to_low_water_mark(cache):
+    # Ten 100-byte entries fill the 1000-byte budget; the oldest access goes first
+    paths = []
+    for i in range(10):
+        paths.append(cache.put(AudioCache.key(i), write_bytes(100)))
+        age(paths[-1], 1000 - i, 60)
+    # Touch entry 0 so it becomes the most recently used
+    cache.get(AudioCache.key(0))
+
+    newest = cache.put(AudioCache.key("new"), write_bytes(100))
+
+    remaining = sorted(path for path in paths + [newest] if os.path.exists(path))
+    # 1100 bytes in total, evicted down to at most 900
+    assert len(remaining) == 9
+    assert not os.path.exists(paths[1])
+    assert not os.path.exists(paths[2])
+    assert os.path.exists(paths[0])
+    assert os.path.exists(newest)
+    assert cache.stats()["bytes"] == 900
+    assert cache.stats()["evictions"] == 2
+
+
+def test_failed_writer_leaves_no_part_file(cache, tmp_path):
+    def broken_writer(path):
+        with open(path, "wb") as f:
+            f.write(b"\xff" * 50)
+        raise RuntimeError("synthesis failed")
+
+    key = AudioCache.key("rice")
+    with pytest.raises(RuntimeError):
+        cache.put(key, broken_writer)
+    assert os.listdir(tmp_path) == []
+    assert cache.get(key) is None
+
+
+def test_stale_part_files_are_not_counted_as_evictions(cache, tmp_path):
+    stale = tmp_path / "abandoned.part"
+    stale.write_bytes(b"\xff" * 10)
+    age(str(stale), 7200, 7200)
+    in_progress = tmp_path / "writing.part"
+    in_progress.write_bytes(b"\xff" * 10)
+
+    cache.evict()
+    assert not stale.exists()
+    assert in_progress.exists()
+    assert cache.stats()["stale_parts"] == 1
+    assert cache.stats()["evictions"] == 0
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import llm_client
+from llm_client import CircuitBreaker, LLMClient, LLMUnavailable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Settings the fake server is restored to after each test
+FAULTS = {"latency_ms": 50, "ttft_ms": 10, "jitter_ms": 0, "error_rate": 0, "hang_rate": 0,
+          "slow_rate": 0, "slow_ms": 5000}
+
+PROMPT = "Respond in English. Be short.\n\nFarmer's question: How do I grow rice?\nReply:\n"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the breaker's monotonic clock with one the test advances."""
+    now = [1000.0]
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.min_calls):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "open"
+
+
+def test_breaker_opens_on_error_rate(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=30)
+    for ok in (True, False, True):
+        breaker.record(ok)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened == 1
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_probe_through_after_cooldown(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=30)
+    open_breaker(breaker)
+    clock[0] += 29.9
+    assert not breaker.allow()
+    clock[0] += 0.1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # Only one probe at a time
+    assert not breaker.allow()
+
+
+def test_breaker_closes_after_successful_probe(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=30)
+    open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.stats()["recent_calls"] == 0
+    assert breaker.allow()
+
+
+def test_breaker_reopens_after_failed_probe(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=30)
+    open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+    # The cooldown starts over from the failed probe
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_breaker_replaces_a_probe_that_never_reports(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, cooldown=30)
+    open_breaker(breaker)
+    clock[0] += 30
+    assert breaker.allow()
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+
+
+class BrokenStream:
+    """A streamed reply that fails after its first piece."""
+
+    async def __aiter__(self):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="Water"))])
+        raise ConnectionError("connection reset")
+
+    async def close(self):
+        pass
+
+
+class BrokenCompletions:
+    async def create(self, **kwargs):
+        return BrokenStream()
+
+
+def test_mid_stream_failure_counts_against_the_breaker():
+    client = LLMClient(api_key="test", model="fake", breaker=CircuitBreaker(window=10, min_calls=1))
+    client.completions = BrokenCompletions()
+
+    async def scenario():
+        pieces = []
+        with pytest.raises(ConnectionError):
+            async for piece in client.stream(PROMPT):
+                pieces.append(piece)
+        return pieces
+
+    assert asyncio.run(scenario()) == ["Water"]
+    assert client.failures == 1
+    assert client.breaker.state == "open"
+
+
+@pytest.fixture(scope="module")
+def fake_server():
+    """Run benchmarks/fake_openai_server.py on a free port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "fake_openai_server.py"), "--port", str(port),
+         "--latency-ms", "50", "--ttft-ms", "10", "--jitter-ms", "0"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(300):
+            assert process.poll() is None, "fake server exited"
+            try:
+                httpx.get(url + "/faults", timeout=1.0)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        yield url
+    finally:
+        # Injected hangs keep a graceful shutdown waiting
+        process.kill()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+def faults(fake_server):
+    """Set the fake server's faults for one test."""
+    def set_faults(**changes):
+        httpx.post(fake_server + "/faults", json=changes, timeout=5.0).raise_for_status()
+    yield set_faults
+    set_faults(**FAULTS)
+
+
+def upstream(fake_server, **kwargs):
+    return LLMClient(api_key="test", model="fake", base_url=fake_server + "/v1", **kwargs)
+
+
+def test_reply_from_fake_server(fake_server):
+    client = upstream(fake_server)
+
+    async def scenario():
+        try:
+            reply = await client.complete(PROMPT)
+            streamed = "".join([piece async for piece in client.stream(PROMPT)])
+        finally:
+            await client.aclose()
+        return reply, streamed
+
+    reply, streamed = asyncio.run(scenario())
+    assert reply and reply == streamed
+    assert client.breaker.stats()["recent_error_rate"] == 0
+
+
+def test_deadline_raises_for_local_fallback(fake_server, faults):
+    faults(hang_rate=1)
+    client = upstream(fake_server, deadline=0.3)
+
+    async def scenario():
+        try:
+            for call in (client.complete(PROMPT), anext(client.stream(PROMPT))):
+                started = time.perf_counter()
+                with pytest.raises(LLMUnavailable, match="no reply within 0.3s"):
+                    await call
+                assert time.perf_counter() - started < 1
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+    assert client.timeouts == 2
+
+
+def test_breaker_opens_on_upstream_errors(fake_server, faults):
+    faults(error_rate=1)
+    client = upstream(fake_server, breaker=CircuitBreaker(window=10, min_calls=3, error_rate=0.5, cooldown=30))
+
+    async def scenario():
+        try:
+            for _ in range(3):
+                with pytest.raises(LLMUnavailable, match="InternalServerError"):
+                    await client.complete(PROMPT)
+            with pytest.raises(LLMUnavailable, match="circuit open"):
+                await client.complete(PROMPT)
+        finally:
+            await client.aclose()
+
+    requests = httpx.get(fake_server + "/faults").json()["requests"]
+    asyncio.run(scenario())
+    assert client.breaker.state == "open"
+    assert client.short_circuited == 1
+    # The short-circuited call never reached the server
+    assert httpx.get(fake_server + "/faults").json()["requests"] == requests + 3
+
+
+def test_hedged_request_wins_over_a_slow_one(fake_server, faults):
+    faults(slow_rate=1)
+    client = upstream(fake_server, hedge_ms=200)
+
+    async def scenario():
+        try:
+            call = asyncio.ensure_future(client.complete(PROMPT))
+            # The first request is now slow; let the hedge be fast
+            await asyncio.sleep(0.1)
+            await asyncio.to_thread(faults, slow_rate=0)
+            started = time.perf_counter()
+            reply = await call
+            return reply, time.perf_counter() - started
+        finally:
+            await client.aclose()
+
+    reply, waited = asyncio.run(scenario())
+    assert reply
+    assert waited < 2
+    assert client.hedged == 1
+    assert client.hedge_wins == 1
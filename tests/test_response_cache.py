@@ -0,0 +1,97 @@
+import asyncio
+import threading
+
+import pytest
+
+from response_cache import ResponseCache, SharedStore, normalize_question
+
+
+@pytest.mark.parametrize("first, second", [
+    ("How do I grow rice?", "how do i grow RICE"),
+    ("  How do I   grow rice!! ", "How do I grow rice"),
+    ("धान कैसे उगाएं।", "धान कैसे उगाएं"),
+    ("rice-paddy", "rice paddy"),
+    ("Is café waste good compost?", "is café waste good compost"),
+])
+def test_normalize_question_merges_trivial_variants(first, second):
+    assert normalize_question(first) == normalize_question(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("How do I grow rice?", "How do I grow wheat?"),
+    ("Is it rain", "Isit rain"),
+    ("धान", "चावल"),
+    ("cafe", "café"),
+])
+def test_normalize_question_keeps_different_questions_apart(first, second):
+    assert normalize_question(first) != normalize_question(second)
+
+
+def test_shared_store_serves_other_processes_answers(tmp_path):
+    path = str(tmp_path / "answers.sqlite3")
+    writer = ResponseCache(16, 60, SharedStore(path, 100, 60))
+    reader = ResponseCache(16, 60, SharedStore(path, 100, 60))
+
+    async def scenario():
+        writer.set("key", "Rice needs standing water.")
+        # Writes are queued on the store's thread; closing waits for them
+        writer.store.close()
+        assert await reader.get("key") == "Rice needs standing water."
+        # Now held in memory
+        assert await reader.get("key") == "Rice needs standing water."
+        assert await reader.get("other") is None
+
+    asyncio.run(scenario())
+    assert reader.stats()["shared_hits"] == 1
+    assert reader.stats()["hits"] == 2
+    assert reader.stats()["misses"] == 1
+    reader.store.close()
+
+
+def test_shared_store_queries_run_off_the_event_loop(tmp_path, monkeypatch):
+    store = SharedStore(str(tmp_path / "answers.sqlite3"), 100, 60)
+    threads = []
+    get = store.get
+    monkeypatch.setattr(store, "get", lambda key: threads.append(threading.current_thread()) or get(key))
+
+    async def scenario():
+        assert await store.lookup("key") is None
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(scenario())
+    assert threads and threads[0] is not loop_thread
+    store.close()
+
+
+def test_begin_refuses_a_key_already_in_flight():
+    cache = ResponseCache(16, 60)
+
+    async def scenario():
+        pending = cache.begin("key")
+        with pytest.raises(RuntimeError):
+            cache.begin("key")
+        pending.set_result("Rice needs standing water.")
+        await asyncio.sleep(0)
+        assert cache.stats()["inflight"] == 0
+        assert await cache.get("key") == "Rice needs standing water."
+        # The key can be computed again once the first call is done
+        cache.begin("key").cancel()
+
+    asyncio.run(scenario())
+
+
+def test_finished_call_leaves_a_newer_one_in_flight():
+    cache = ResponseCache(16, 60)
+
+    async def scenario():
+        old = cache.begin("key")
+        old.cancel()
+        await asyncio.sleep(0)
+        newer = cache.begin("key")
+        # A late callback for the old call must not unregister the newer one
+        cache._finish("key", old)
+        assert cache.stats()["inflight"] == 1
+        newer.set_result("Rice needs standing water.")
+        assert await cache.join("key") == "Rice needs standing water."
+
+    asyncio.run(scenario())
@@ -0,0 +1,25 @@
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.slow
+def test_startup_is_within_budget():
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "startup_profile.py"), "--runs", "1",
+         "--port", str(free_port()), "--budget", os.path.join(ROOT, "benchmarks", "startup_budget.json")],
+        cwd=ROOT, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "Within the startup budget" in result.stdout
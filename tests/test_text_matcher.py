@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from text_matcher import TOPIC_KEYWORDS, KeywordMatcher, TopicMatch, detect_language, find_topics
+
+# Keywords nested in each other ("pesticide" holds "pest", "tic" and "cide")
+# and overlapping ("insect" ends where "sector" begins)
+NESTED_KEYWORDS = {
+    "pest": ["pest", "pesticide", "insect", "sector"],
+    "chemistry": ["tic", "icide", "cide", "ticide"],
+    "land": ["sect", "ecto"],
+}
+
+
+def naive_find(keywords, text):
+    """Find every keyword occurrence by searching for each keyword in turn."""
+    lowered = text.lower()
+    matches = set()
+    for topic, words in keywords.items():
+        for word in {word.lower() for word in words}:
+            start = lowered.find(word)
+            while start != -1:
+                matches.add(TopicMatch(topic, word, start, start + len(word)))
+                start = lowered.find(word, start + 1)
+    return matches
+
+
+@pytest.mark.parametrize("text", [
+    "How do I grow rice and wheat in sandy soil?",
+    "PADDY fields need water during the rainy season",
+    "धान और गेहूं के लिए खाद कब डालें?",
+    "நெல் வயலில் பூச்சி தாக்குதல்; இயற்கை உரம் உதவுமா?",
+    "వరి పొలంలో పురుగు నివారణకు సహజ ఎరువు",
+    "rainwater irrigation for organic landraces in a changing climate",
+    "",
+])
+def test_find_topics_agrees_with_substring_search(text):
+    assert set(find_topics(text)) == naive_find(TOPIC_KEYWORDS, text)
+
+
+@pytest.mark.parametrize("text", [
+    "pesticide",
+    "insector",
+    "insecticide sector pesticides",
+    "ticidetic",
+    "PESTICIDE-INSECT",
+])
+def test_nested_and_overlapping_keywords(text):
+    matcher = KeywordMatcher(NESTED_KEYWORDS)
+    assert set(matcher.find(text)) == naive_find(NESTED_KEYWORDS, text)
+
+
+def test_random_text_over_keyword_alphabet():
+    matcher = KeywordMatcher(NESTED_KEYWORDS)
+    alphabet = sorted({ch for words in NESTED_KEYWORDS.values() for word in words for ch in word}) + [" "]
+    rng = random.Random(7)
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert set(matcher.find(text)) == naive_find(NESTED_KEYWORDS, text), text
+
+
+def test_matches_are_ordered_and_topics_deduplicated():
+    matcher = KeywordMatcher(NESTED_KEYWORDS)
+    matches = matcher.find("pesticide")
+    assert matches == sorted(matches, key=lambda match: (match.start, match.end))
+    assert matcher.topics("pesticide insect pest") == ["pest", "chemistry", "land"]
+
+
+@pytest.mark.parametrize("text, language", [
+    ("How much water does rice need?", "English"),
+    ("پانی کتنا دینا چاہیے؟", "Urdu"),
+    ("धान को कितना पानी चाहिए?", "Hindi"),
+    ("ধানের জন্য কত জল লাগে?", "Bengali"),
+    ("ਝੋਨੇ ਨੂੰ ਕਿੰਨਾ ਪਾਣੀ ਚਾਹੀਦਾ ਹੈ?", "Punjabi"),
+    ("ડાંગરને કેટલું પાણી જોઈએ?", "Gujarati"),
+    ("நெல்லுக்கு எவ்வளவு நீர் தேவை?", "Tamil"),
+    ("వరికి ఎంత నీరు అవసరం?", "Telugu"),
+    ("ಭತ್ತಕ್ಕೆ ಎಷ್ಟು ನೀರು ಬೇಕು?", "Kannada"),
+    ("നെല്ലിന് എത്ര വെള്ളം വേണം?", "Malayalam"),
+])
+def test_detect_language_by_script(text, language):
+    assert detect_language(text) == language
+
+
+def test_detect_language_defaults_and_mixed_scripts():
+    assert detect_language("Café crème", default="Hindi") == "Hindi"
+    assert detect_language("rice धान") == "Hindi"
+    # The script with the most characters wins
+    assert detect_language("धान நெல்லுக்கு எவ்வளவு நீர்") == "Tamil"
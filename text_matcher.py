@@ -0,0 +1,232 @@
+import re
+from collections import namedtuple
+
+# Topic keywords shared by the answer engine and the transcription simulator
+TOPIC_KEYWORDS = {
+    "rice": ["rice", "paddy", "धान", "चावल", "நெல்", "அரிசி", "వరి", "బియ్యం"],
+    "wheat": ["wheat", "गेहूं", "கோதுமை", "గోధుమ"],
+    "pest": ["pest", "insect", "bug", "कीट", "कीड़े", "பூச்சி", "పురుగు"],
+    "fertilizer": ["fertilizer", "manure", "compost", "उर्वरक", "खाद", "உரம்", "ఎరువు"],
+    "water": ["water", "irrigation", "rain", "पानी", "सिंचाई", "நீர்", "பாசனம்", "నీరు", "నీటి"],
+    "soil": ["soil", "land", "मिट्टी", "भूमि", "மண்", "நிலம்", "నేల", "మట్టి"],
+    "organic": ["organic", "natural", "जैविक", "प्राकृतिक", "இயற்கை", "సహజ"],
+    "season": ["season", "weather", "climate", "मौसम", "जलवायु", "பருவம்", "காலநிலை", "సీజన్", "వాతావరణం"]
+}
+
+# Unicode script blocks (128 code points each) and the language they indicate
+SCRIPT_LANGUAGES = {
+    0x0600: "Urdu",       # Arabic
+    0x0680: "Urdu",       # Arabic (continued)
+    0x0900: "Hindi",      # Devanagari
+    0x0980: "Bengali",    # Bengali
+    0x0A00: "Punjabi",    # Gurmukhi
+    0x0A80: "Gujarati",   # Gujarati
+    0x0B80: "Tamil",      # Tamil
+    0x0C00: "Telugu",     # Telugu
+    0x0C80: "Kannada",    # Kannada
+    0x0D00: "Malayalam",  # Malayalam
+}
+
+TopicMatch = namedtuple("TopicMatch", ["topic", "keyword", "start", "end"])
+
+
+def _script_class(blocks):
+    """Build a regex character class covering the given script blocks."""
+    return "[" + "".join(f"\\u{b:04x}-\\u{b + 0x7F:04x}" for b in sorted(blocks)) + "]"
+
+
+_ANY_SCRIPT = re.compile(_script_class(SCRIPT_LANGUAGES) + "+")
+_OTHER_SCRIPTS = {
+    language: re.compile(_script_class(b for b, lang in SCRIPT_LANGUAGES.items() if lang != language))
+    for language in set(SCRIPT_LANGUAGES.values())
+}
+
+
+def _trie_pattern(words):
+    """
+    Compile a set of words into a regex that walks a character trie.
+
+    Shared prefixes are factored out, so at each position the regex engine
+    follows at most one branch per character instead of trying every word.
+    Longer words are preferred over their prefixes.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def render(node):
+        branches = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return render(trie)
+
+
+class KeywordMatcher:
+    """
+    Multi-pattern matcher that finds every keyword occurrence in one scan.
+
+    The keyword set is compiled once into a trie-shaped regular expression,
+    which the regex engine runs as an automaton over the lower-cased text.
+    The scan reports the longest keyword starting at each hit and skips past
+    it; keywords nested inside a hit, and keywords that could start inside a
+    hit and run past its end, are resolved from tables built with the
+    automaton, so every occurrence is still reported.
+    """
+
+    def __init__(self, keywords):
+        """
+        Args:
+            keywords (dict): Mapping of topic name to a list of keywords
+        """
+        self.topic_order = {topic: i for i, topic in enumerate(keywords)}
+        self._topics_by_keyword = {}
+        for topic, words in keywords.items():
+            for word in words:
+                word = word.lower()
+                if topic not in self._topics_by_keyword.setdefault(word, ()):
+                    self._topics_by_keyword[word] += (topic,)
+
+        all_words = list(self._topics_by_keyword)
+        # Keywords found inside each keyword, as (offset, keyword) pairs
+        self._nested = {}
+        # Offsets inside each keyword where a longer keyword could begin
+        self._overlaps = {}
+        for word in all_words:
+            nested = []
+            overlaps = []
+            for offset in range(len(word)):
+                tail = word[offset:]
+                for other in all_words:
+                    if other != word and tail.startswith(other):
+                        nested.append((offset, other))
+                    elif offset and len(other) > len(tail) and other.startswith(tail):
+                        overlaps.append(offset)
+            self._nested[word] = tuple(nested)
+            self._overlaps[word] = tuple(sorted(set(overlaps)))
+        self._pattern = re.compile(_trie_pattern(all_words))
+
+    def _scan(self, lowered):
+        """Yield (start, keyword) for every keyword occurrence in the text."""
+        match = self._pattern.match
+        for m in self._pattern.finditer(lowered):
+            word = m.group()
+            start, end = m.span()
+            yield start, word
+            for offset, other in self._nested[word]:
+                yield start + offset, other
+            # Keywords that begin inside this hit but run past its end
+            for offset in self._overlaps[word]:
+                extra = match(lowered, start + offset)
+                if extra and extra.end() > end:
+                    pos = extra.start()
+                    yield pos, extra.group()
+                    for inner, other in self._nested[extra.group()]:
+                        if inner == 0 and pos + len(other) > end:
+                            yield pos, other
+
+    def find(self, text):
+        """
+        Find every keyword occurrence in the text.
+
+        Args:
+            text (str): The text to scan
+
+        Returns:
+            list[TopicMatch]: Matches ordered by position; offsets refer to
+            the lower-cased text
+        """
+        topics_by_keyword = self._topics_by_keyword
+        matches = [
+            TopicMatch(topic, word, start, start + len(word))
+            for start, word in self._scan(text.lower())
+            for topic in topics_by_keyword[word]
+        ]
+        matches.sort(key=lambda match: (match.start, match.end))
+        return matches
+
+    def topics(self, text):
+        """
+        Return the distinct topics mentioned in the text.
+
+        Args:
+            text (str): The text to scan
+
+        Returns:
+            list[str]: Topics in the order they appear in the keyword table
+        """
+        found = set()
+        for _, word in self._scan(text.lower()):
+            found.update(self._topics_by_keyword[word])
+        return sorted(found, key=self.topic_order.__getitem__)
+
+
+# Built once at import and shared by every caller
+TOPIC_MATCHER = KeywordMatcher(TOPIC_KEYWORDS)
+
+
+def find_topics(text):
+    """
+    Find all topic keywords in the text with their positions.
+
+    Args:
+        text (str): The text to scan
+
+    Returns:
+        list[TopicMatch]: Matches ordered by position
+    """
+    return TOPIC_MATCHER.find(text)
+
+
+def detect_topics(text):
+    """
+    Detect which farming topics the text mentions.
+
+    Args:
+        text (str): The text to scan
+
+    Returns:
+        list[str]: Topic names in keyword-table order
+    """
+    return TOPIC_MATCHER.topics(text)
+
+
+def detect_language(text, default="English"):
+    """
+    Detect the language of the text from the Unicode scripts it uses.
+
+    Text in a single Indic (or Arabic) script maps straight to that script's
+    language. When several scripts are mixed, the one with the most
+    characters wins. Text without any of these scripts is treated as
+    `default`.
+
+    Args:
+        text (str): The text to inspect
+        default (str): Language returned for Latin-only text
+
+    Returns:
+        str: The detected language name
+    """
+    if text.isascii():
+        return default
+
+    first = _ANY_SCRIPT.search(text)
+    if first is None:
+        return default
+
+    language = SCRIPT_LANGUAGES[ord(first.group()[0]) & ~0x7F]
+    if not _OTHER_SCRIPTS[language].search(text, first.end()):
+        return language
+
+    # Mixed scripts: count characters per language
+    counts = {}
+    for run in _ANY_SCRIPT.findall(text, first.start()):
+        for ch in run:
+            lang = SCRIPT_LANGUAGES[ord(ch) & ~0x7F]
+            counts[lang] = counts.get(lang, 0) + 1
+    return max(counts, key=counts.get)
@@ -0,0 +1,253 @@
+import importlib.util
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from metrics import Histogram
+
+# Whisper works on 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+
+def ffmpeg_available():
+    """Return True if ffmpeg-python is installed and the ffmpeg binary is on the PATH."""
+    return importlib.util.find_spec("ffmpeg") is not None and shutil.which("ffmpeg") is not None
+
+
+# Resample uploads to 16 kHz mono PCM and trim silence before transcription
+NORMALIZE_AUDIO = os.getenv("KRISHIMITRA_AUDIO_NORMALIZE", "1" if ffmpeg_available() else "0") == "1"
+
+# Leading and trailing audio quieter than this is trimmed, keeping a margin
+# either side so word onsets are not clipped
+SILENCE_THRESHOLD_DB = float(os.getenv("KRISHIMITRA_SILENCE_THRESHOLD_DB", "-40"))
+SILENCE_MARGIN_MS = int(os.getenv("KRISHIMITRA_SILENCE_MARGIN_MS", "200"))
+FRAME_MS = 20
+
+# Bitrates of the compact reply formats
+OPUS_BITRATE = os.getenv("KRISHIMITRA_OPUS_BITRATE", "16k")
+MP3_LOW_BITRATE = os.getenv("KRISHIMITRA_MP3_LOW_BITRATE", "24k")
+
+# Reply formats: media type, file extension and ffmpeg output options.
+# "mp3" is gTTS's own output and is sent without transcoding.
+REPLY_FORMATS = {
+    "mp3": ("audio/mpeg", ".mp3", None),
+    "mp3-low": ("audio/mpeg", ".mp3", {"format": "mp3", "ac": 1, "ar": 16000, "audio_bitrate": MP3_LOW_BITRATE}),
+    # Encoder complexity 5 of 10 roughly halves encode time for a ~3% larger file
+    "opus": ("audio/ogg", ".opus", {"format": "ogg", "acodec": "libopus", "ac": 1, "ar": 16000,
+                                    "audio_bitrate": OPUS_BITRATE, "application": "voip", "compression_level": 5}),
+}
+DEFAULT_REPLY_FORMAT = os.getenv("KRISHIMITRA_REPLY_FORMAT", "mp3")
+
+# Media types in an Accept header that select each compact format
+ACCEPT_FORMATS = {
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/ogg; codecs=opus": "opus",
+}
+
+
+class TranscodeError(Exception):
+    """Raised when ffmpeg cannot decode or encode a clip."""
+
+
+class TranscodeStats:
+    """
+    Transcode times and payload sizes, kept per direction and format.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, bytes_in, bytes_out):
+        """
+        Record one transcode.
+
+        Args:
+            name (str): "input" or the reply format
+            seconds (float): Time spent in ffmpeg
+            bytes_in (int): Size of the source audio
+            bytes_out (int): Size of the result
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._entries[name] = {"time": Histogram(), "count": 0, "bytes_in": 0, "bytes_out": 0}
+            entry["count"] += 1
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+        entry["time"].observe(seconds)
+
+    def stats(self):
+        """Return transcode time, mean payload sizes and size ratio for each direction and format."""
+        with self._lock:
+            entries = dict(self._entries)
+        return {
+            name: {
+                "count": entry["count"],
+                "time": entry["time"].snapshot(),
+                "mean_bytes_in": entry["bytes_in"] // entry["count"],
+                "mean_bytes_out": entry["bytes_out"] // entry["count"],
+                "size_ratio": round(entry["bytes_out"] / entry["bytes_in"], 4) if entry["bytes_in"] else 0.0,
+            }
+            for name, entry in entries.items()
+        }
+
+
+TRANSCODE_STATS = TranscodeStats()
+
+
+def trim_silence(samples, rate=SAMPLE_RATE, threshold_db=SILENCE_THRESHOLD_DB, margin_ms=SILENCE_MARGIN_MS):
+    """
+    Cut leading and trailing silence from a clip.
+
+    The clip is split into 20 ms frames; everything before the first and
+    after the last frame louder than the threshold is dropped, apart from a
+    margin either side. A clip with no frame above the threshold is returned
+    unchanged so the speech-to-text engine still sees it.
+
+    Args:
+        samples (np.ndarray): float32 samples in [-1, 1]
+        rate (int): Sample rate
+        threshold_db (float): Frame RMS level, in dBFS, that counts as sound
+        margin_ms (int): Audio kept either side of the sound
+
+    Returns:
+        np.ndarray: The trimmed samples
+    """
+    frame = rate * FRAME_MS // 1000
+    frames = len(samples) // frame
+    if not frames:
+        return samples
+    rms = np.sqrt(np.mean(np.square(samples[:frames * frame].reshape(frames, frame)), axis=1))
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if not len(loud):
+        return samples
+    margin = rate * margin_ms // 1000
+    start = max(0, loud[0] * frame - margin)
+    end = min(len(samples), (loud[-1] + 1) * frame + margin)
+    return samples[start:end]
+
+
+def normalize_audio(path):
+    """
+    Decode a clip to 16 kHz mono PCM and trim its silence.
+
+    Args:
+        path (str): Path to the uploaded clip, in any format ffmpeg reads
+
+    Returns:
+        np.ndarray: float32 samples at 16 kHz, ready for Whisper
+
+    Raises:
+        TranscodeError: If ffmpeg cannot decode the clip, or cannot be run
+    """
+    ffmpeg = _ffmpeg()
+    started = time.perf_counter()
+    try:
+        pcm, _ = (
+            ffmpeg.input(path)
+            .output("pipe:", format="s16le", acodec="pcm_s16le", ac=1, ar=SAMPLE_RATE)
+            .run(cmd=["ffmpeg", "-nostdin", "-threads", "0"], capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        raise TranscodeError(_ffmpeg_message(e)) from e
+    except OSError as e:
+        raise TranscodeError(f"ffmpeg could not be run: {e}") from e
+
+    samples = trim_silence(np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0)
+    TRANSCODE_STATS.record("input", time.perf_counter() - started, os.path.getsize(path), samples.nbytes // 2)
+    return samples
+
+
+def negotiate_format(accept=None, requested=None, allowed=tuple(REPLY_FORMATS)):
+    """
+    Choose the reply audio format.
+
+    An explicit `format` query parameter wins. Otherwise the first media type
+    in the Accept header (by q-value) that maps to a compact format is used,
+    and anything else gets the default format.
+
+    Args:
+        accept (str): The request's Accept header
+        requested (str): The `format` query parameter
+        allowed (tuple): Formats the endpoint can send
+
+    Returns:
+        str | None: A key of REPLY_FORMATS, or None if `requested` is not allowed
+    """
+    if requested:
+        requested = requested.strip().lower()
+        return requested if requested in allowed else None
+
+    ranked = []
+    for position, item in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip().lower() for part in item.split(";")]
+        quality = 1.0
+        codecs = []
+        for param in params:
+            name, _, value = param.partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+            elif name == "codecs":
+                codecs.append(value.strip('"'))
+        if quality > 0:
+            ranked.append((-quality, position, media_type, codecs))
+
+    default = DEFAULT_REPLY_FORMAT if DEFAULT_REPLY_FORMAT in allowed else "mp3"
+    for _, _, media_type, codecs in sorted(ranked):
+        if media_type in ("audio/mpeg", "audio/mp3"):
+            return default if REPLY_FORMATS[default][0] == "audio/mpeg" else "mp3"
+        if media_type in ("audio/*", "*/*"):
+            break
+        name = ACCEPT_FORMATS.get(f"{media_type}; codecs={codecs[0]}" if codecs else media_type)
+        if name in allowed:
+            return name
+    return default
+
+
+def encode_audio(source, destination, fmt):
+    """
+    Transcode a reply into a compact format.
+
+    Args:
+        source (str): Path to the MP3 produced by gTTS
+        destination (str): Path to write the result to
+        fmt (str): A key of REPLY_FORMATS other than "mp3"
+
+    Raises:
+        TranscodeError: If ffmpeg fails or cannot be run
+    """
+    ffmpeg = _ffmpeg()
+    started = time.perf_counter()
+    try:
+        (
+            ffmpeg.input(source)
+            .output(destination, **REPLY_FORMATS[fmt][2])
+            .overwrite_output()
+            .run(cmd=["ffmpeg", "-nostdin"], capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error as e:
+        raise TranscodeError(_ffmpeg_message(e)) from e
+    except OSError as e:
+        raise TranscodeError(f"ffmpeg could not be run: {e}") from e
+    TRANSCODE_STATS.record(fmt, time.perf_counter() - started, os.path.getsize(source), os.path.getsize(destination))
+
+
+def _ffmpeg():
+    """Import ffmpeg-python, reporting its absence as a TranscodeError."""
+    try:
+        import ffmpeg
+    except ImportError as e:
+        raise TranscodeError("ffmpeg-python is not installed") from e
+    return ffmpeg
+
+
+def _ffmpeg_message(error):
+    """Return the last line ffmpeg wrote to stderr, which names the problem."""
+    lines = (error.stderr or b"").decode("utf-8", "replace").strip().splitlines()
+    return lines[-1] if lines else "ffmpeg failed"
@@ -1,72 +1,82 @@
 import os
-from tempfile import NamedTemporaryFile
 from fastapi import UploadFile
-
-# This is a temporary implementation that doesn't use Whisper
-# It will be replaced with the actual Whisper implementation once ffmpeg is installed
+from asr import ASR_POOL, whisper_available
+from audio_ingest import read_upload
+from request_timing import add_stage, stage
+from text_matcher import TOPIC_KEYWORDS, detect_language, detect_topics
+from transcode import NORMALIZE_AUDIO, normalize_audio
+from voice_output import LANGUAGE_CODE_MAP
+from workers import VOICE_POOL
+
+# Speech-to-text runs on local Whisper when openai-whisper is installed.
+# The "simulated" backend makes up questions from the upload's metadata and
+# is kept for development machines without Whisper or ffmpeg.
 
 import random
 import time
 
-async def transcribe_audio(audio: UploadFile):
+ASR_BACKEND = os.getenv("KRISHIMITRA_ASR_BACKEND", "whisper" if whisper_available() else "simulated")
+
+async def transcribe_audio(audio: UploadFile, language=None):
     """
-    Simulates transcribing audio with dynamic content based on audio metadata.
-    In a real implementation, this would use Whisper to convert speech to text.
+    Transcribe the farmer's spoken question.
+
+    With the Whisper backend the clip is transcribed by the local worker pool.
+    The simulated backend generates a question from the audio metadata.
+    The caller admits the request with VOICE_POOL.admit() first; the voice
+    pool work done here is then queued rather than rejected.
 
     Args:
         audio (UploadFile): The uploaded audio file
+        language (str): The language the farmer is speaking, used as a hint
 
     Returns:
         str: The transcribed text
+
+    Raises:
+        HTTPException: If the upload is too large or not a recognized audio format
+        TranscodeError: If the clip cannot be decoded
     """
-    # Save the uploaded file to a temporary file
-    with NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-        content = await audio.read()
-        tmp.write(content)
-        tmp_path = tmp.name
+    # Read the upload in chunks; only clips above the spool threshold touch disk
+    with stage("upload"):
+        clip = await read_upload(audio)
 
+    started = time.perf_counter()
     try:
+        if ASR_BACKEND == "whisper":
+            # Whisper decodes from a file named with the detected format, written off the event loop
+            clip_path = await clip.path()
+            lang_code = LANGUAGE_CODE_MAP.get(language) if language else None
+            if not NORMALIZE_AUDIO:
+                return await ASR_POOL.transcribe(clip_path, lang_code)
+
+            # Hand Whisper 16 kHz mono samples with the silence trimmed, so it
+            # neither decodes the file again nor spends time on dead air
+            with stage("transcode"):
+                samples = await VOICE_POOL.run(normalize_audio, clip_path, admitted=True)
+            started = time.perf_counter()
+            return await ASR_POOL.transcribe(samples, lang_code)
+
         # Extract information from the audio file metadata
         file_name = audio.filename.lower()
-        file_size = len(content)
+        file_size = clip.size
         timestamp = int(time.time())
 
         # Use these values to create a more dynamic response
         # In a real implementation, we would use Whisper to get the actual content
 
-        # Define topic keywords that might be in the filename or could be detected
-        topics = {
-            "rice": ["rice", "paddy", "धान", "चावल", "நெல்", "அரிசி"],
-            "wheat": ["wheat", "गेहूं", "கோதுமை"],
-            "pest": ["pest", "insect", "bug", "कीट", "कीड़े", "பூச்சி"],
-            "fertilizer": ["fertilizer", "manure", "compost", "उर्वरक", "खाद", "உரம்"],
-            "water": ["water", "irrigation", "rain", "पानी", "सिंचाई", "நீர்", "பாசனம்"],
-            "soil": ["soil", "land", "मिट्टी", "भूमि", "மண்", "நிலம்"],
-            "organic": ["organic", "natural", "जैविक", "प्राकृतिक", "இயற்கை"],
-            "season": ["season", "weather", "climate", "मौसम", "जलवायु", "பருவம்", "காலநிலை"]
-        }
-
-        # Determine language from filename or metadata
-        language = "English"  # Default
-        if any(char in file_name for char in "हिंदीफसलखेती"):
-            language = "Hindi"
-        elif any(char in file_name for char in "தமிழ்பயிர்நெல்"):
-            language = "Tamil"
-        elif any(char in file_name for char in "తెలుగు"):
-            language = "Telugu"
+        # Determine language from the script used in the filename
+        language = detect_language(file_name)
 
         # Determine topic from filename or use timestamp to select random topic
-        detected_topics = []
-        for topic, keywords in topics.items():
-            if any(keyword in file_name for keyword in keywords):
-                detected_topics.append(topic)
+        detected_topics = detect_topics(file_name)
 
         # If no topics detected, use timestamp to select random topics
         if not detected_topics:
             # Use the timestamp to select 1-2 random topics
             random.seed(timestamp % 100)  # Use last two digits of timestamp as seed
             num_topics = random.randint(1, 2)
-            detected_topics = random.sample(list(topics.keys()), num_topics)
+            detected_topics = random.sample(list(TOPIC_KEYWORDS.keys()), num_topics)
 
         # Generate a question based on detected topics and language
         question_templates = {
@@ -116,7 +126,7 @@ async def transcribe_audio(audio: UploadFile):
         questions = []
         for topic in detected_topics:
             if topic in question_templates.get(language, question_templates["English"]):
-                topic_questions = question_templates[language][topic]
+                topic_questions = question_templates.get(language, question_templates["English"])[topic]
                 # Use a combination of factors to select a question
                 question_index = (timestamp + file_size + len(topic)) % len(topic_questions)
                 questions.append(topic_questions[question_index])
@@ -174,6 +184,6 @@ async def transcribe_audio(audio: UploadFile):
             # Return a single question with some randomness in selection
             return questions[random.randint(0, len(questions) - 1)]
     finally:
-        # Clean up the temporary file
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
+        add_stage("asr", time.perf_counter() - started)
+        # Release the buffer and any temporary file
+        await clip.close()
@@ -1,6 +1,13 @@
+import asyncio
+import logging
 import os
-from gtts import gTTS
-from tempfile import NamedTemporaryFile
+import tempfile
+from audio_cache import AudioCache
+from request_timing import stage
+from transcode import REPLY_FORMATS, TranscodeError, encode_audio
+from workers import VOICE_POOL
+
+logger = logging.getLogger(__name__)
 
 # Language code mapping
 LANGUAGE_CODE_MAP = {
@@ -17,26 +24,207 @@ LANGUAGE_CODE_MAP = {
     "English": "en"
 }
 
-def text_to_speech(text, language="English"):
+# gTTS class, imported on first synthesis (or during warmup) by load_tts;
+# the load test installs a fake here
+gTTS = None
+
+# Synthesized replies are cached on disk, keyed on the text and voice settings
+TTS_CACHE = AudioCache(
+    directory=os.getenv("KRISHIMITRA_TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "krishimitra_tts")),
+    max_bytes=int(os.getenv("KRISHIMITRA_TTS_CACHE_MAX_MB", "256")) * 1024 * 1024,
+    max_age=float(os.getenv("KRISHIMITRA_TTS_CACHE_MAX_AGE", str(7 * 24 * 3600))),
+)
+
+def speech_cache_key(text, language="English"):
     """
-    Convert text to speech using Google Text-to-Speech.
-    
+    Build the cache key for a reply's audio.
+
     Args:
         text (str): The text to convert to speech
         language (str): The language of the text
-        
+
     Returns:
-        str: Path to the generated audio file
+        str: The cache key
+    """
+    lang_code = LANGUAGE_CODE_MAP.get(language, "en")
+    return TTS_CACHE.key(text, lang_code, "slow=False")
+
+def lookup_speech(text, language="English"):
+    """
+    Return the cached audio for a reply without synthesizing it.
+
+    Args:
+        text (str): The text to convert to speech
+        language (str): The language of the text
+
+    Returns:
+        str | None: Path to the cached audio file, or None if not cached
+    """
+    return TTS_CACHE.get(speech_cache_key(text, language))
+
+def load_tts():
+    """
+    Import gTTS if it has not been loaded yet.
+
+    Returns:
+        type: The gTTS class
+    """
+    global gTTS
+    if gTTS is None:
+        from gtts import gTTS as tts_class
+        gTTS = tts_class
+    return gTTS
+
+def synthesize_speech(text, language="English"):
+    """
+    Synthesize a reply with gTTS and store it in the cache.
+
+    Args:
+        text (str): The text to convert to speech
+        language (str): The language of the text
+
+    Returns:
+        str: Path to the cached audio file
     """
     # Get the language code
     lang_code = LANGUAGE_CODE_MAP.get(language, "en")
-    
+
     # Create a gTTS object
-    tts = gTTS(text=text, lang=lang_code, slow=False)
-    
-    # Save to a temporary file
-    tmp = NamedTemporaryFile(delete=False, suffix=".mp3")
-    tts.save(tmp.name)
-    tmp.close()
+    tts = load_tts()(text=text, lang=lang_code, slow=False)
+
+    # Write into the cache; the file is renamed into place once complete
+    return TTS_CACHE.put(speech_cache_key(text, language), tts.save)
+
+def text_to_speech(text, language="English"):
+    """
+    Convert text to speech using Google Text-to-Speech, reusing cached audio
+    for text that has been synthesized before.
     
-    return tmp.name  # Return path to mp3 file
+    Args:
+        text (str): The text to convert to speech
+        language (str): The language of the text
+        
+    Returns:
+        str: Path to the generated audio file
+    """
+    cached_path = lookup_speech(text, language)
+    if cached_path:
+        return cached_path
+
+    return synthesize_speech(text, language)
+
+def encode_reply(mp3_path, fmt="mp3"):
+    """
+    Return a reply's audio in the requested format, transcoding the gTTS
+    MP3 once and caching the result next to it.
+
+    Args:
+        mp3_path (str): Path to the cached gTTS audio
+        fmt (str): A key of REPLY_FORMATS
+
+    Returns:
+        str: Path to the audio in the requested format
+
+    Raises:
+        TranscodeError: If ffmpeg fails
+    """
+    if fmt == "mp3":
+        return mp3_path
+
+    _, suffix, options = REPLY_FORMATS[fmt]
+    key = TTS_CACHE.key(os.path.basename(mp3_path), fmt, sorted(options.items()))
+    cached_path = TTS_CACHE.get(key, suffix)
+    if cached_path:
+        return cached_path
+    return TTS_CACHE.put(key, lambda path: encode_audio(mp3_path, path, fmt), suffix)
+
+def speech_bytes(text, language="English", fmt="mp3"):
+    """
+    Convert text to speech and return the audio data.
+
+    Args:
+        text (str): The text to convert to speech
+        language (str): The language of the text
+        fmt (str): Audio format, a key of REPLY_FORMATS
+
+    Returns:
+        bytes: The audio
+    """
+    with open(encode_reply(text_to_speech(text, language), fmt), "rb") as f:
+        return f.read()
+
+async def stream_speech(sentences, language="English", lookahead=2, fmt="mp3"):
+    """
+    Synthesize sentences as they arrive and yield their audio in order.
+
+    Synthesis of upcoming sentences runs on the voice pool while the audio of
+    the current sentence is being sent, so the first sentence can be played
+    before the rest of the reply has been synthesized. MP3 frames can be
+    concatenated, so the yielded pieces form one playable stream.
+
+    The caller admits the reply on the voice pool with VOICE_POOL.admit()
+    before streaming it. Its sentences are then queued rather than rejected,
+    so a busy pool can't cut a reply short. At most lookahead + 1 of them
+    are on the pool at a time. A sentence that fails to synthesize is tried
+    once more before the error is raised.
+
+    Args:
+        sentences: Async iterable of sentences
+        language (str): The language of the text
+        lookahead (int): Sentences synthesized ahead of the one being sent
+        fmt (str): A key of REPLY_FORMATS; only the MP3 formats can be
+            concatenated into one stream
+
+    Yields:
+        bytes: Audio, one sentence at a time
+    """
+    pending = asyncio.Queue()
+    slots = asyncio.Semaphore(lookahead + 1)
+
+    async def speak(sentence):
+        try:
+            return await VOICE_POOL.run(speech_bytes, sentence, language, fmt, admitted=True)
+        except TranscodeError as e:
+            # MP3 frames of any bitrate join into one stream, so the
+            # sentence can go out untranscoded; other formats can't mix
+            if REPLY_FORMATS[fmt][0] != "audio/mpeg":
+                raise
+            logger.warning("Could not transcode a sentence to %s, sending MP3: %s", fmt, e)
+            return await VOICE_POOL.run(speech_bytes, sentence, language, "mp3", admitted=True)
+
+    async def synthesize(sentence):
+        # Summed over sentences, so it can exceed the wall-clock time
+        with stage("tts"):
+            try:
+                return await speak(sentence)
+            except Exception as e:
+                # gTTS fails now and then; one retry keeps the sentence in the
+                # reply, and a second failure is raised to the caller
+                logger.warning("Could not synthesize a sentence, retrying: %s", e)
+                return await speak(sentence)
+
+    async def produce():
+        try:
+            async for sentence in sentences:
+                await slots.acquire()
+                pending.put_nowait(asyncio.ensure_future(synthesize(sentence)))
+        finally:
+            pending.put_nowait(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            synthesis = await pending.get()
+            if synthesis is None:
+                break
+            data = await synthesis
+            slots.release()
+            yield data
+        # Surface errors from the reply stream
+        await producer
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            synthesis = pending.get_nowait()
+            if synthesis is not None:
+                synthesis.cancel()
@@ -0,0 +1,453 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+from ai_agent import stream_answer
+from asr import ASR_POOL, TranscriptionError
+from metrics import Histogram
+from sentences import iter_sentences
+from transcode import FRAME_MS, SAMPLE_RATE, SILENCE_MARGIN_MS, TranscodeError, trim_silence
+from voice_input import ASR_BACKEND
+from voice_output import LANGUAGE_CODE_MAP, stream_speech
+from workers import VOICE_POOL, Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Voice activity detection: a 20 ms frame louder than the threshold is
+# speech. An utterance starts after VAD_START_MS of speech and ends after
+# VAD_END_MS of silence, or once it reaches MAX_UTTERANCE_SECONDS.
+VAD_THRESHOLD_DB = float(os.getenv("KRISHIMITRA_VAD_THRESHOLD_DB", "-35"))
+VAD_START_MS = int(os.getenv("KRISHIMITRA_VAD_START_MS", "100"))
+VAD_END_MS = int(os.getenv("KRISHIMITRA_VAD_END_MS", "700"))
+MAX_UTTERANCE_SECONDS = float(os.getenv("KRISHIMITRA_MAX_UTTERANCE_SECONDS", "30"))
+
+# Partial transcripts are sent at most this often while the farmer speaks.
+# Each covers the audio since the last commit; once that grows past the
+# window, the oldest part is transcribed for good and left out of later
+# partials, so their cost stays bounded however long the farmer talks.
+PARTIAL_INTERVAL_MS = int(os.getenv("KRISHIMITRA_PARTIAL_INTERVAL_MS", "1000"))
+PARTIAL_WINDOW_SECONDS = float(os.getenv("KRISHIMITRA_PARTIAL_WINDOW_SECONDS", "10"))
+PARTIAL_MIN_MS = 500
+
+# Concurrent sessions per worker process; more are closed with code 1013
+MAX_SESSIONS = int(os.getenv("KRISHIMITRA_WS_MAX_SESSIONS", "32"))
+
+# Close codes: 1011 server error, 1013 try again later
+CLOSE_UNAVAILABLE = 1011
+CLOSE_BUSY = 1013
+
+
+class UtteranceDetector:
+    """
+    Energy-based voice activity detection over a stream of 16 kHz mono
+    16-bit PCM.
+
+    Audio before speech is dropped, apart from a short pre-roll kept so the
+    first word is not clipped. Audio from the start of an utterance to its
+    end is collected in a preallocated buffer.
+    """
+
+    def __init__(self, threshold_db=VAD_THRESHOLD_DB, start_ms=VAD_START_MS, end_ms=VAD_END_MS,
+                 max_seconds=MAX_UTTERANCE_SECONDS, preroll_ms=SILENCE_MARGIN_MS):
+        """
+        Args:
+            threshold_db (float): Frame RMS level, in dBFS, that counts as speech
+            start_ms (int): Speech needed to start an utterance
+            end_ms (int): Silence that ends an utterance
+            max_seconds (float): Longest utterance; longer speech is cut here
+            preroll_ms (int): Audio kept from before the start of speech
+        """
+        self.frame = SAMPLE_RATE * FRAME_MS // 1000
+        self.threshold = 10 ** (threshold_db / 20)
+        self.start_frames = max(1, start_ms // FRAME_MS)
+        self.end_frames = max(1, end_ms // FRAME_MS)
+        self.audio = np.empty(int(max_seconds * SAMPLE_RATE), np.float32)
+        self.length = 0
+        self.speaking = False
+        self._voiced = 0
+        self._silent = 0
+        self._history = deque(maxlen=self.start_frames + preroll_ms // FRAME_MS)
+        self._remainder = b""
+
+    def feed(self, pcm):
+        """
+        Add audio and detect utterance boundaries in it.
+
+        Args:
+            pcm (bytes): Little-endian 16-bit mono samples at 16 kHz
+
+        Returns:
+            list: ("start", None) and ("end", samples) events in order, where
+                samples is a float32 copy of the finished utterance
+        """
+        data = self._remainder + pcm
+        usable = len(data) - len(data) % (2 * self.frame)
+        self._remainder = data[usable:]
+        if not usable:
+            return []
+
+        frames = (np.frombuffer(data[:usable], "<i2").astype(np.float32) / 32768.0).reshape(-1, self.frame)
+        voiced = np.sqrt(np.mean(np.square(frames), axis=1)) > self.threshold
+        events = []
+        for frame, loud in zip(frames, voiced):
+            if not self.speaking:
+                self._history.append(frame)
+                self._voiced = self._voiced + 1 if loud else 0
+                if self._voiced >= self.start_frames:
+                    self.speaking = True
+                    self._silent = 0
+                    self.length = 0
+                    for earlier in self._history:
+                        self._append(earlier)
+                    self._history.clear()
+                    events.append(("start", None))
+                continue
+
+            self._append(frame)
+            self._silent = 0 if loud else self._silent + 1
+            if self._silent >= self.end_frames or self.length + self.frame > len(self.audio):
+                events.append(("end", self.finish()))
+        return events
+
+    def utterance(self):
+        """Return a view of the audio collected for the current utterance."""
+        return self.audio[:self.length]
+
+    def finish(self):
+        """
+        End the current utterance, for instance when the client says it has
+        stopped recording.
+
+        Returns:
+            np.ndarray: float32 copy of the utterance's samples
+        """
+        samples = self.audio[:self.length].copy()
+        self.speaking = False
+        self._voiced = 0
+        self.length = 0
+        return samples
+
+    def _append(self, frame):
+        self.audio[self.length:self.length + len(frame)] = frame
+        self.length += len(frame)
+
+
+class Utterance:
+    """Transcription state of one utterance within a session."""
+
+    def __init__(self, number):
+        self.number = number
+        self.committed = 0
+        self.committed_text = []
+        self.ended = False
+        self.partial = None
+        self.committing = False
+
+    def text(self, tail=""):
+        """Join the committed text and the transcript of the rest."""
+        return " ".join(part for part in [*self.committed_text, tail] if part)
+
+
+class SessionStats:
+    """Counters and latencies shared by every voice session in the process."""
+
+    def __init__(self):
+        self.active = 0
+        self.sessions = 0
+        self.rejected = 0
+        self.utterances = 0
+        self.partials = 0
+        self.partials_skipped = 0
+        # From the detected end of an utterance to its final transcript and
+        # to the first reply audio
+        self.final_transcript = Histogram()
+        self.first_audio = Histogram()
+
+    def snapshot(self):
+        """Return session counters and latencies."""
+        return {
+            "active": self.active,
+            "sessions": self.sessions,
+            "rejected": self.rejected,
+            "utterances": self.utterances,
+            "partials": self.partials,
+            "partials_skipped": self.partials_skipped,
+            "final_transcript": self.final_transcript.snapshot(),
+            "first_audio": self.first_audio.snapshot(),
+        }
+
+
+SESSION_STATS = SessionStats()
+
+
+def quiet_cut(samples, search_seconds=2.0):
+    """
+    Pick where to split audio so the cut falls between words.
+
+    Args:
+        samples (np.ndarray): float32 samples
+        search_seconds (float): How far back from the end to look
+
+    Returns:
+        int: Sample index in the middle of the quietest 20 ms frame near the end
+    """
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    start = max(0, len(samples) - int(search_seconds * SAMPLE_RATE))
+    frames = (len(samples) - start) // frame
+    if not frames:
+        return len(samples)
+    energy = np.mean(np.square(samples[start:start + frames * frame].reshape(frames, frame)), axis=1)
+    return start + int(np.argmin(energy)) * frame + frame // 2
+
+
+class VoiceSession:
+    """
+    One farmer talking to KrishiMitra over a WebSocket.
+
+    The client streams 16 kHz mono 16-bit PCM in binary messages while it
+    records. Partial transcripts are pushed back as the farmer speaks; when
+    voice activity detection finds the end of the utterance, the final
+    transcript is taken and the answer starts right away, streamed as text
+    and as one audio message per sentence. Recording carries on meanwhile,
+    and a new question cancels an answer still being sent.
+    """
+
+    def __init__(self, websocket: WebSocket, language="English", fmt="mp3"):
+        """
+        Args:
+            websocket (WebSocket): The connection, not yet accepted
+            language (str): The language the farmer speaks and is answered in
+            fmt (str): Reply audio format, a key of REPLY_FORMATS, or None for
+                text only
+        """
+        self.websocket = websocket
+        self.language = language
+        self.lang_code = LANGUAGE_CODE_MAP.get(language)
+        self.fmt = fmt
+        self.detector = UtteranceDetector()
+        self.utterance = None
+        self.answer = None
+        self.closed = False
+        self._count = 0
+        self._last_partial = 0.0
+        self._send_lock = asyncio.Lock()
+
+    async def run(self):
+        """Serve the session until the client disconnects."""
+        await self.websocket.accept()
+        if ASR_BACKEND != "whisper":
+            await self.websocket.close(CLOSE_UNAVAILABLE, "Real-time transcription needs the Whisper backend")
+            return
+        if SESSION_STATS.active >= MAX_SESSIONS:
+            SESSION_STATS.rejected += 1
+            await self.websocket.close(CLOSE_BUSY, "Server busy, please retry")
+            return
+
+        SESSION_STATS.active += 1
+        SESSION_STATS.sessions += 1
+        try:
+            await self.send({"type": "ready", "sample_rate": SAMPLE_RATE, "encoding": "pcm_s16le",
+                             "format": self.fmt})
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    await self.on_audio(message["bytes"])
+                elif message.get("text") is not None:
+                    await self.on_control(message["text"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.closed = True
+            SESSION_STATS.active -= 1
+            for task in (self.answer, self.utterance and self.utterance.partial):
+                if task is not None:
+                    task.cancel()
+
+    async def on_audio(self, pcm):
+        """Run voice activity detection on new audio and act on what it finds."""
+        for event, samples in self.detector.feed(pcm):
+            if event == "start":
+                self._count += 1
+                self.utterance = Utterance(self._count)
+                self._last_partial = time.perf_counter()
+                await self.send({"type": "speech_start", "id": self._count})
+            else:
+                self.end_utterance(samples)
+
+        if self.detector.speaking:
+            self.maybe_partial()
+
+    async def on_control(self, text):
+        """
+        Handle a JSON control message: `end` closes the current utterance
+        (e.g. when a push-to-talk button is released), `cancel` stops the
+        answer being sent.
+        """
+        try:
+            kind = json.loads(text).get("type")
+        except (ValueError, AttributeError):
+            kind = None
+        if kind == "end":
+            if self.detector.speaking:
+                self.end_utterance(self.detector.finish())
+        elif kind == "cancel":
+            if self.answer is not None:
+                self.answer.cancel()
+        else:
+            await self.send({"type": "error",
+                             "detail": 'Unknown message; send PCM audio, or JSON with type "end" or "cancel"'})
+
+    def maybe_partial(self):
+        """Start a partial transcription if one is due and none is running."""
+        utterance = self.utterance
+        now = time.perf_counter()
+        if utterance.partial is not None and not utterance.partial.done():
+            return
+        if now - self._last_partial < PARTIAL_INTERVAL_MS / 1000:
+            return
+        audio = self.detector.utterance()[utterance.committed:]
+        if len(audio) < PARTIAL_MIN_MS * SAMPLE_RATE // 1000:
+            return
+
+        # Copy the audio now: the detector reuses its buffer for the next utterance
+        commit = quiet_cut(audio[:int(PARTIAL_WINDOW_SECONDS * SAMPLE_RATE)]) \
+            if len(audio) > PARTIAL_WINDOW_SECONDS * SAMPLE_RATE else 0
+        self._last_partial = now
+        utterance.partial = asyncio.ensure_future(self.partial(utterance, audio.copy(), commit))
+
+    async def partial(self, utterance, audio, commit):
+        """
+        Transcribe the uncommitted audio of an utterance and send the result.
+
+        Args:
+            utterance (Utterance): The utterance being spoken
+            audio (np.ndarray): Its samples from the last commit to now
+            commit (int): Number of leading samples to commit first, or 0
+        """
+        try:
+            if commit:
+                utterance.committing = True
+                try:
+                    text = await ASR_POOL.transcribe(audio[:commit], self.lang_code)
+                finally:
+                    utterance.committing = False
+                utterance.committed_text.append(text)
+                utterance.committed += commit
+                audio = audio[commit:]
+            if utterance.ended:
+                return
+            tail = await ASR_POOL.transcribe(audio, self.lang_code)
+        except (Overloaded, TranscriptionError) as e:
+            # Partials are best effort; the final transcript is what counts
+            SESSION_STATS.partials_skipped += 1
+            logger.debug("Skipped a partial transcript: %s", e)
+            return
+        if not utterance.ended:
+            SESSION_STATS.partials += 1
+            await self.send({"type": "partial", "id": utterance.number, "text": utterance.text(tail)})
+
+    def end_utterance(self, samples):
+        """Start answering an utterance that has just ended; a previous answer still being sent is dropped."""
+        utterance = self.utterance
+        utterance.ended = True
+        SESSION_STATS.utterances += 1
+        if self.answer is not None:
+            self.answer.cancel()
+        self.answer = asyncio.ensure_future(self.respond(utterance, samples, time.perf_counter()))
+
+    async def respond(self, utterance, samples, ended):
+        """
+        Take the final transcript of an utterance, then stream the answer.
+
+        Args:
+            utterance (Utterance): The utterance that ended
+            samples (np.ndarray): All of its audio
+            ended (float): perf_counter() time the end was detected
+        """
+        timings = {}
+        try:
+            text = await self.final_transcript(utterance, samples)
+            timings["transcript_ms"] = round((time.perf_counter() - ended) * 1000, 1)
+            SESSION_STATS.final_transcript.observe(time.perf_counter() - ended)
+            await self.send({"type": "final", "id": utterance.number, "text": text})
+            if text:
+                await self.stream_reply(utterance, text, ended, timings)
+        except asyncio.CancelledError:
+            # Dropped for a newer utterance or by a cancel message; close the
+            # utterance for the client before letting the cancellation through
+            await self.send({"type": "done", "id": utterance.number, "cancelled": True})
+            raise
+        except Overloaded as e:
+            await self.send({"type": "error", "id": utterance.number,
+                             "detail": f"Server busy ({e.pool} pool full), please retry",
+                             "retry_after": e.retry_after})
+            return
+        except TranscriptionError as e:
+            logger.warning("Error transcribing audio: %s", e)
+            await self.send({"type": "error", "id": utterance.number, "detail": "Could not transcribe the audio"})
+            return
+        except TranscodeError as e:
+            logger.warning("Could not encode the reply audio: %s", e)
+            await self.send({"type": "error", "id": utterance.number, "detail": "Could not encode the reply audio"})
+            return
+        except Exception:
+            # Every utterance ends with done or error, whatever went wrong
+            logger.exception("Error answering utterance %d", utterance.number)
+            await self.send({"type": "error", "id": utterance.number, "detail": "Could not answer the question"})
+            return
+        timings["total_ms"] = round((time.perf_counter() - ended) * 1000, 1)
+        await self.send({"type": "done", "id": utterance.number, "timings": timings})
+
+    async def final_transcript(self, utterance, samples):
+        """
+        Transcribe what the partials have not committed yet.
+
+        A commit still in flight is awaited, so its text is not transcribed
+        twice; a partial of the uncommitted audio is cancelled.
+        """
+        partial = utterance.partial
+        if partial is not None and not partial.done():
+            if utterance.committing:
+                await asyncio.wait([partial])
+            else:
+                partial.cancel()
+        tail = trim_silence(samples[utterance.committed:])
+        return utterance.text(await ASR_POOL.transcribe(tail, self.lang_code) if len(tail) else "")
+
+    async def stream_reply(self, utterance, question, ended, timings):
+        """Send the answer sentence by sentence, as text and, unless disabled, as audio."""
+        async def sentences():
+            async for sentence in iter_sentences(stream_answer(question, self.language)):
+                await self.send({"type": "answer", "id": utterance.number, "text": sentence})
+                yield sentence
+
+        if self.fmt is None:
+            async for _ in sentences():
+                pass
+            return
+
+        VOICE_POOL.admit()
+        async for data in stream_speech(sentences(), self.language, fmt=self.fmt):
+            if "first_audio_ms" not in timings:
+                timings["first_audio_ms"] = round((time.perf_counter() - ended) * 1000, 1)
+                SESSION_STATS.first_audio.observe(time.perf_counter() - ended)
+            await self.send(data)
+
+    async def send(self, message):
+        """Send a JSON message, or audio bytes, unless the client has gone."""
+        if self.closed:
+            return
+        try:
+            async with self._send_lock:
+                if isinstance(message, bytes):
+                    await self.websocket.send_bytes(message)
+                else:
+                    await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+        except (WebSocketDisconnect, RuntimeError):
+            self.closed = True
@@ -0,0 +1,132 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Histogram
+
+
+class Overloaded(Exception):
+    """Raised when a pool's queue is full and new work is turned away."""
+
+    def __init__(self, pool, retry_after):
+        super().__init__(f"{pool} pool is at capacity")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking work with a bounded queue.
+
+    Work is rejected up front with Overloaded once every worker is busy and
+    the queue is full, instead of waiting indefinitely behind earlier jobs.
+    """
+
+    def __init__(self, name, max_workers, max_queue):
+        """
+        Args:
+            name (str): Pool name used in logs and stats
+            max_workers (int): Number of worker threads
+            max_queue (int): Jobs allowed to wait for a free worker
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.rejected = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self._pending = 0
+        self._running = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def admit(self):
+        """
+        Check that the pool can take more work.
+
+        Raises:
+            Overloaded: If every worker is busy and the queue is full
+        """
+        with self._lock:
+            full = self._pending >= self.max_workers + self.max_queue
+        if full:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+
+    async def run(self, func, *args, admitted=False):
+        """
+        Run a blocking function on the pool.
+
+        Args:
+            func (callable): The function to run
+            *args: Arguments passed to the function
+            admitted (bool): The caller already passed admit() for this work,
+                so it is queued even when the pool is at capacity
+
+        Returns:
+            The function's return value
+
+        Raises:
+            Overloaded: If the pool is at capacity and the work was not admitted
+        """
+        if not admitted:
+            self.admit()
+        with self._lock:
+            self._pending += 1
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            self.wait_time.observe(started - submitted)
+            with self._lock:
+                self._running += 1
+            try:
+                return func(*args)
+            finally:
+                self.run_time.observe(time.perf_counter() - started)
+                with self._lock:
+                    self._running -= 1
+
+        future = self._executor.submit(job)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def retry_after(self):
+        """Estimate in whole seconds how long until the queue has drained."""
+        mean_run = self.run_time.sum / self.run_time.count if self.run_time.count else 1.0
+        return max(1, math.ceil(self.queue_depth() * mean_run / self.max_workers))
+
+    def queue_depth(self):
+        """Return the number of jobs waiting for a worker."""
+        with self._lock:
+            return self._pending - self._running
+
+    def stats(self):
+        """Return queue depth, utilization and wait-time figures."""
+        with self._lock:
+            pending = self._pending
+            running = self._running
+        return {
+            "workers": self.max_workers,
+            "running": running,
+            "queue_depth": pending - running,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "wait": self.wait_time.snapshot(),
+            "run": self.run_time.snapshot(),
+        }
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+
+# Speech synthesis, transcription and upload file I/O for the voice endpoints.
+# Text-only /ask requests never wait on this pool.
+VOICE_POOL = BoundedExecutor(
+    "voice",
+    max_workers=int(os.getenv("KRISHIMITRA_VOICE_WORKERS", "4")),
+    max_queue=int(os.getenv("KRISHIMITRA_VOICE_QUEUE", "16")),
+)